@@ -0,0 +1,98 @@
+# Argent Anemometer
+#
+# Calculates the wind speed, gust and lull from the times of the anemometer's
+# switch closures. The switch closes twice per rotation.
+#
+# The sensor callback only adds the time of each closure to a TimestampRing,
+# so no pulses are lost while the speed is being calculated and the speed can
+# be calculated over any window of time after the fact.
+#
+# The gust and lull follow the WMO definition: the highest and lowest 3 second
+# running average of the wind speed, sampled every 0.25 seconds.
+#
+# Ensure the following connections to the Raspberry Pi 3 Model B:
+#
+# Pin 3 on the RJ11 connector to Ground
+# Pin 4 on the RJ11 connector to BCM 5
+
+import math
+from timestamp_ring import TimestampRing
+
+CM_IN_A_MILE = 160934.4
+SECS_IN_AN_HOUR = 3600
+# Calibration factor used to report the correct wind speed
+WIND_CALIBRATION = 2.3589722140805094
+RADIUS_CM = 9.0  # Radius of the anemometer
+
+# The window and sample step used for the gust and lull
+GUST_WINDOW = 3.0  # Seconds
+GUST_STEP = 0.25  # Seconds
+
+
+class WindEngine:
+    """
+    Records the anemometer pulses and calculates speeds from them in MPH.
+    """
+
+    def __init__(
+        self, capacity=131072, radius_cm=RADIUS_CM, calibration=WIND_CALIBRATION
+    ):
+        self.pulses = TimestampRing(capacity)
+
+        # Half a rotation per pulse. The anemometer data sheet indicates that
+        # if the switch closes once per second, a wind speed of 1.492 MPH
+        # should be reported. Multiply by the calibration factor to be
+        # accurate according to the data sheet.
+        circumference_cm = (2 * math.pi) * radius_cm
+        self.mph_per_pulse_per_sec = (
+            (circumference_cm / 2.0) / CM_IN_A_MILE * SECS_IN_AN_HOUR * calibration
+        )
+
+    def pulse(self, timestamp):
+        """
+        Records a switch closure. This is called from the sensor callback.
+        """
+        self.pulses.push(timestamp)
+
+    def speed(self, start, end):
+        """
+        Returns the average wind speed between the start and end times.
+        """
+        if end <= start:
+            return 0.0
+        count = self.pulses.count_between(start, end)
+        return count / (end - start) * self.mph_per_pulse_per_sec
+
+    def gust_and_lull(self, start, end, window=GUST_WINDOW, step=GUST_STEP):
+        """
+        Returns the highest and lowest running average of the wind speed over
+        window seconds between the start and end times.
+        """
+        if end - start <= window:
+            speed = self.speed(start, end)
+            return speed, speed
+
+        times = self.pulses.between(start, end)
+        total = len(times)
+        steps = int((end - start - window) / step)
+
+        # Slide the window along, counting the pulses that enter and leave it
+        lowest = None
+        highest = 0
+        entered = 0
+        left = 0
+        for i in range(steps + 1):
+            window_end = start + window + i * step
+            window_start = window_end - window
+            while entered < total and times[entered] < window_end:
+                entered += 1
+            while left < entered and times[left] < window_start:
+                left += 1
+            count = entered - left
+            if count > highest:
+                highest = count
+            if lowest is None or count < lowest:
+                lowest = count
+
+        factor = self.mph_per_pulse_per_sec / window
+        return highest * factor, lowest * factor
@@ -0,0 +1,242 @@
+# Component Benchmarks
+#
+# Times the parts of the station that run on every sample or every record on
+# their own, using the simulated weather instead of the sensors. Each result
+# is the best time per call over several repeats, which is the least
+# disturbed by whatever else the computer is doing.
+#
+# Daniel Hornberger
+# 2021
+
+import datetime
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+# The station's modules are in the directory above this one
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bme280_sensor
+import influx_writer
+import journal
+import live_api
+import logger as logging
+import metrics
+import sensor_backend
+import wind_direction
+from anemometer import WindEngine
+from circular_stats import DirectionAccumulator
+from columnar_store import ColumnarWriter
+from derived import DerivedEngine
+from rollup import RollupEngine
+
+from simulation import DIRECTION_CODES
+from simulation import START_TIME
+from simulation import SimulatedBackend
+
+
+def time_per_call(function, arguments, repeat=5):
+    """
+    Calls the function with each of the arguments in turn, repeat times, and
+    returns the fastest average seconds per call.
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for argument in arguments:
+            function(argument)
+        best = min(best, (time.perf_counter() - start) / len(arguments))
+    return best
+
+
+def result(seconds, unit):
+    """
+    Returns a result in the unit (ns, us or ms) where lower is better.
+    """
+    scale = {"ns": 1e9, "us": 1e6, "ms": 1e3}[unit]
+    return {"value": round(seconds * scale, 3), "unit": unit, "better": "lower"}
+
+
+def _record(number, when):
+    return {
+        "record_number": number,
+        "time": when,
+        "temperature": 61.2,
+        "pressure": 1012.4,
+        "humidity": 48.3,
+        "wind_direction": 225.0,
+        "wind_direction_string": "SW",
+        "wind_speed": 5.4,
+        "wind_gust": 12.1,
+        "precipitation": 0.011 * (number % 7),
+        "image": "nan",
+    }
+
+
+def _point(record):
+    return {
+        "measurement": "weather",
+        "tags": {"location": "backyard"},
+        "time": record["time"],
+        "fields": {
+            "Temperature (F)": record["temperature"],
+            "Pressure (mbar)": record["pressure"],
+            "Relative Humidity (%)": record["humidity"],
+            "Wind Direction (Degrees)": record["wind_direction"],
+            "Wind Direction (String)": record["wind_direction_string"],
+            "Avg. Wind Speed (MPH)": record["wind_speed"],
+            "Wind Gust (MPH)": record["wind_gust"],
+            "Precipitation (Inches)": record["precipitation"],
+            "Image": record["image"],
+        },
+    }
+
+
+def _loaded_wind_engine(seconds):
+    """
+    Returns a WindEngine holding seconds of simulated anemometer pulses and
+    the time of the last one.
+    """
+    backend = SimulatedBackend()
+    wind = WindEngine()
+    backend.on_edge(5, lambda: wind.pulse(backend.monotonic()))
+    for _ in range(int(seconds / 10)):
+        backend.sleep(10)
+    return wind, backend.monotonic()
+
+
+def run(quick=False, directory=None):
+    """
+    Runs the component benchmarks and returns the results by name.
+    """
+    count = 2000 if quick else 20000
+    disk_count = 100 if quick else 500
+    results = {}
+    directory = tempfile.mkdtemp(prefix="benchmark_", dir=directory)
+    try:
+        # Sampling
+        wind = WindEngine()
+        times = [START_TIME + i * 0.3 for i in range(count * 10)]
+        results["anemometer_pulse"] = result(time_per_call(wind.pulse, times), "ns")
+
+        wind, end = _loaded_wind_engine(86400)
+        ends = [end - i * 7.3 for i in range(count)]
+        results["anemometer_tick_speed"] = result(
+            time_per_call(lambda t: wind.speed(t - 10, t), ends), "us"
+        )
+        ends = [end - i * 901 for i in range(90)]
+        results["anemometer_gust_and_lull"] = result(
+            time_per_call(lambda t: wind.gust_and_lull(t - 900, t), ends, repeat=3),
+            "ms",
+        )
+
+        decoder = wind_direction.get_decoder()
+        codes = list(DIRECTION_CODES.values()) * (count // 16 * 10)
+        results["direction_decode"] = result(time_per_call(decoder.angle, codes), "ns")
+
+        accumulator = DirectionAccumulator()
+        angles = [decoder.angle(code) for code in codes]
+        results["direction_accumulate"] = result(
+            time_per_call(lambda angle: accumulator.add(angle, 4.2), angles), "ns"
+        )
+
+        sensor_backend.backend = SimulatedBackend()
+        sampler = bme280_sensor.BME280Sampler()
+        results["bme280_sample"] = result(
+            time_per_call(lambda _: sampler.sample(), range(count)), "us"
+        )
+        sensor_backend.backend = None
+
+        stage = metrics.stage("benchmark")
+
+        def timed(_):
+            with stage:
+                pass
+
+        results["metrics_stage"] = result(time_per_call(timed, range(count * 10)), "ns")
+
+        logging.initialize_logger(os.path.join(directory, "logs", "benchmark.log"))
+        results["log_message"] = result(
+            time_per_call(
+                lambda _: logging.log("Calculating the wind speed"), range(count * 10)
+            ),
+            "ns",
+        )
+
+        server = live_api.LiveServer("127.0.0.1", 0)
+        server.start()
+        sample = {
+            "time": "2021-01-01T00:00:10",
+            "tick": 1,
+            "wind_speed": 5.4,
+            "wind_direction": 225.0,
+            "wind_direction_string": "SW",
+            "humidity": 48.3,
+            "pressure": 1012.4,
+            "temperature": 61.2,
+            "precipitation": 0.0,
+            "rain_rate": 0.0,
+        }
+        results["live_publish"] = result(
+            time_per_call(lambda _: server.publish("sample", sample), range(count)),
+            "us",
+        )
+        server.stop()
+
+        # Records
+        start = datetime.datetime.fromtimestamp(START_TIME)
+        records = [
+            _record(i, start + datetime.timedelta(seconds=900 * i))
+            for i in range(disk_count)
+        ]
+        points = [_point(record) for record in records]
+        results["line_protocol"] = result(
+            time_per_call(influx_writer.to_line_protocol, points), "us"
+        )
+
+        data_file = journal.DataFile(os.path.join(directory, "data.csv"), "Labels\n")
+        lines = [",".join(str(value) for value in r.values()) + "\n" for r in records]
+        results["csv_append"] = result(
+            time_per_call(data_file.append, lines, repeat=1), "us"
+        )
+        data_file.close()
+
+        columnar = ColumnarWriter(os.path.join(directory, "columnar"))
+        results["columnar_append"] = result(
+            time_per_call(columnar.append, records, repeat=1), "us"
+        )
+        columnar.close()
+
+        queue = influx_writer.WriteAheadQueue(os.path.join(directory, "queue"))
+        line_batches = [[influx_writer.to_line_protocol(point)] for point in points]
+        results["influx_queue_append"] = result(
+            time_per_call(queue.append, line_batches, repeat=1), "us"
+        )
+        queue.close()
+
+        engine = DerivedEngine(elevation=300.0, pressure_offset=152.2826)
+        results["derived_add"] = result(
+            time_per_call(
+                lambda r: engine.add(
+                    r["time"].timestamp(),
+                    r["temperature"],
+                    r["humidity"],
+                    r["pressure"],
+                    r["wind_speed"],
+                ),
+                records,
+            ),
+            "us",
+        )
+
+        rollups = RollupEngine(os.path.join(directory, "rollups"), None, {})
+        results["rollup_add"] = result(
+            time_per_call(rollups.add, records, repeat=1), "us"
+        )
+    finally:
+        logging.shutdown()
+        shutil.rmtree(directory, ignore_errors=True)
+
+    return results
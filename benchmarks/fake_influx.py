@@ -0,0 +1,118 @@
+# Fake InfluxDB
+#
+# A local stand-in for the InfluxDB HTTP API the station writes to, so the
+# database writes can be benchmarked without a database. It accepts writes at
+# /write (gzip compressed or not), checks every line is valid line protocol,
+# counts the points and throws them away. /ping answers like InfluxDB does.
+#
+# Daniel Hornberger
+# 2021
+
+import gzip
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+import os
+import sys
+import threading
+import time
+
+# The station's modules are in the directory above this one
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ingest_server
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, body=b""):
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.startswith("/ping"):
+            self._reply(204)
+        else:
+            self._reply(404)
+
+    def do_POST(self):
+        server = self.server.fake
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if not self.path.startswith("/write"):
+            self._reply(404)
+            return
+        if self.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+
+        lines = [line for line in body.decode().split("\n") if line]
+        for number, line in enumerate(lines, 1):
+            try:
+                ingest_server.validate_line(line, "benchmark")
+            except ingest_server.InvalidPoint as e:
+                with server.lock:
+                    server.rejected += len(lines)
+                self._reply(400, f'{{"error":"line {number}: {e}"}}'.encode())
+                return
+
+        with server.lock:
+            server.requests += 1
+            server.points += len(lines)
+            server.bytes += len(body)
+            server.last_write = time.monotonic()
+        self._reply(204)
+
+
+class FakeInflux:
+    """
+    Serves the fake database on a background thread. The counts of the
+    requests, points and uncompressed bytes written are kept.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0):
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.fake = self
+        self.url = f"http://{host}:{self._server.server_address[1]}"
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.points = 0
+        self.bytes = 0
+        self.rejected = 0
+        self.last_write = None
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="fake_influx", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def counts(self):
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "points": self.points,
+                "bytes": self.bytes,
+                "rejected": self.rejected,
+            }
+
+
+if __name__ == "__main__":
+    server = FakeInflux(port=int(sys.argv[1]) if len(sys.argv) > 1 else 8086).start()
+    print(f"Fake InfluxDB listening at {server.url}")
+    try:
+        while True:
+            time.sleep(10)
+            print(server.counts())
+    except KeyboardInterrupt:
+        server.stop()
@@ -0,0 +1,192 @@
+# Pipeline Benchmark
+#
+# Runs the whole station (weather_station.main) from a recording as fast as
+# it can be replayed, and writes how long the ticks and records took, the
+# throughput and how the memory grew to a JSON file. The stage timings come
+# from the station's own metrics (see metrics.py).
+#
+# It's run in its own process by run_benchmarks.py so the memory it measures
+# is only the station's:
+#
+#   python3 benchmarks/pipeline.py --recording sim.jsonl --config bench.ini --data-directory /tmp/bench --result result.json
+#
+# Daniel Hornberger
+# 2021
+
+import argparse
+import contextlib
+import json
+import os
+import resource
+import sys
+import threading
+import time
+
+# The station's modules are in the directory above this one
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import metrics
+import sensor_backend
+import weather_station
+
+# How often the memory use is sampled
+MEMORY_SAMPLE_INTERVAL = 0.1  # Seconds
+
+
+def rss_mb():
+    """
+    Returns the memory the process is using (its resident set size) in MB.
+    """
+    try:
+        with open("/proc/self/status") as file:
+            for line in file:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # Only the peak is available on other systems
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class MemorySampler:
+    """
+    Samples the memory use on a background thread along with the replayed
+    time, so the growth can be measured against the simulated days.
+    """
+
+    def __init__(self, interval=MEMORY_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="memory", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+
+    def _sample(self):
+        backend = sensor_backend.backend
+        if backend is not None:
+            self.samples.append((backend.time(), rss_mb()))
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def growth(self, start_time):
+        """
+        Returns the memory use after the first simulated day (once everything
+        has been loaded and the caches are warm), at the end, the peak and the
+        growth in between per 30 simulated days.
+        """
+        if not self.samples:
+            return {}
+        baseline = next(
+            (sample for sample in self.samples if sample[0] >= start_time + 86400),
+            self.samples[0],
+        )
+        end = self.samples[-1]
+        days = (end[0] - baseline[0]) / 86400
+        growth = end[1] - baseline[1]
+        return {
+            "rss_after_first_day_mb": round(baseline[1], 2),
+            "rss_end_mb": round(end[1], 2),
+            "rss_peak_mb": round(max(rss for _, rss in self.samples), 2),
+            "rss_growth_mb": round(growth, 2),
+            "rss_growth_mb_per_30_days": round(growth / days * 30, 3) if days > 0 else None,
+            # About one sample per simulated week to see the trend
+            "rss_by_day": [
+                [round((t - start_time) / 86400, 1), round(rss, 2)]
+                for t, rss in self.samples[:: max(len(self.samples) // 52, 1)]
+            ],
+        }
+
+
+def _stage(name):
+    histogram = metrics.stage(name)
+    histogram.fold()
+    return histogram.count, histogram.sum, histogram.quantile(0.99)
+
+
+def run(recording, config, data_directory):
+    """
+    Runs the station from the recording and returns the results.
+    """
+    memory = MemorySampler()
+    memory.start()
+    start = time.perf_counter()
+    # The station prints every record, which would only slow it down here
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        weather_station.main(
+            [
+                "--replay",
+                recording,
+                "--speed",
+                "0",
+                "--config",
+                config,
+                "--data-directory",
+                data_directory,
+            ]
+        )
+    wall_seconds = time.perf_counter() - start
+    memory.stop()
+
+    with open(recording) as file:
+        start_time = json.loads(file.readline())["wall"]
+    simulated_seconds = memory.samples[-1][0] - start_time if memory.samples else 0
+
+    ticks, tick_seconds, tick_p99 = _stage("tick")
+    log_ticks, log_tick_seconds, log_tick_p99 = _stage("log_tick")
+    records = weather_station.RECORDS.get()
+
+    stages = {}
+    for name, labels, metric in metrics.REGISTRY.collect():
+        if "stage" not in labels:
+            continue
+        metric.fold()
+        if metric.count:
+            stages[labels["stage"]] = {
+                "count": metric.count,
+                "mean_us": round(metric.sum / metric.count * 1e6, 2),
+                "p99_us": round(metric.quantile(0.99) * 1e6, 2),
+            }
+
+    return {
+        "wall_seconds": round(wall_seconds, 3),
+        "simulated_days": round(simulated_seconds / 86400, 3),
+        "ticks": ticks + log_ticks,
+        "records": records,
+        "ticks_per_second": round((ticks + log_ticks) / wall_seconds, 1),
+        "records_per_second": round(records / wall_seconds, 2),
+        "simulated_seconds_per_second": round(simulated_seconds / wall_seconds, 1),
+        "tick_mean_us": round(tick_seconds / ticks * 1e6, 2) if ticks else None,
+        "tick_p99_us": round(tick_p99 * 1e6, 2) if ticks else None,
+        "log_tick_mean_ms": round(log_tick_seconds / log_ticks * 1e3, 3)
+        if log_ticks
+        else None,
+        "log_tick_p99_ms": round(log_tick_p99 * 1e3, 3) if log_ticks else None,
+        "memory": memory.growth(start_time),
+        "stages": stages,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the station from a recording")
+    parser.add_argument("--recording", required=True)
+    parser.add_argument("--config", required=True)
+    parser.add_argument("--data-directory", required=True)
+    parser.add_argument("--result", required=True, help="Write the results to this file")
+    args = parser.parse_args()
+
+    results = run(args.recording, args.config, args.data_directory)
+    with open(args.result, "w") as file:
+        json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,355 @@
+# Run Benchmarks
+#
+# Benchmarks the station without any of its hardware and saves the results as
+# JSON, so the results of two versions can be compared to catch slowdowns.
+#
+# The component benchmarks time the parts of the station that run on every
+# sample or record (see components.py). The pipeline benchmarks run the whole
+# station from simulated recordings (see simulation.py and pipeline.py) with
+# its database writes going to a fake InfluxDB (see fake_influx.py):
+#
+# pipeline - A simulated day with the usual intervals. Measures the time
+#            spent on each sample tick and each log cycle, and the ticks per
+#            second.
+# year     - A simulated year logged every 15 minutes with the anemometer
+#            pulses thinned out. Measures the records per second and how the
+#            memory use grows.
+#
+# The means are compared between versions. The 99th percentiles and the
+# timing of every stage are saved in the details, since the percentiles are
+# only known to the nearest histogram bucket (see metrics.py).
+#
+# Examples:
+#
+#   # Run everything and save the results
+#   python3 benchmarks/run_benchmarks.py --output before.json
+#
+#   # A shorter run that's compared against the earlier results. The exit
+#   # status is 1 if anything got slower by more than the threshold.
+#   python3 benchmarks/run_benchmarks.py --quick --output after.json --compare before.json
+#
+#   # Only compare two saved results
+#   python3 benchmarks/run_benchmarks.py --compare before.json --against after.json
+#
+# Daniel Hornberger
+# 2021
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import components
+import simulation
+from fake_influx import FakeInflux
+
+BENCHMARK_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+REPO_DIRECTORY = os.path.dirname(BENCHMARK_DIRECTORY)
+
+RESULTS_VERSION = 1
+
+# A change smaller than this fraction isn't reported as a regression
+DEFAULT_THRESHOLD = 0.15
+
+
+def log(message):
+    print(message, file=sys.stderr, flush=True)
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=REPO_DIRECTORY,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def camera_available():
+    """
+    The simulated pictures are only taken if Pillow is installed, since it's
+    needed to make them and to measure their brightness.
+    """
+    try:
+        import PIL  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+###############################################################################
+# Pipeline
+###############################################################################
+
+
+def write_config(path, database_url, accumulation_interval, log_interval, camera):
+    with open(path, "w") as file:
+        file.write(
+            f"[intervals]\n"
+            f"accumulation_interval = {accumulation_interval}\n"
+            f"log_interval = {log_interval}\n"
+            f"[camera]\n"
+            f"enabled = {str(camera).lower()}\n"
+            # Keeps a year of pictures from filling the disk, which also
+            # exercises the image store's eviction
+            f"storage_budget = 50000000\n"
+            f"min_free_space = 0\n"
+            f"[database]\n"
+            f"url = {database_url}\n"
+            f"[live]\n"
+            f"host = 127.0.0.1\n"
+            f"port = 0\n"
+        )
+
+
+def run_pipeline(name, directory, days, accumulation_interval, log_interval, pulse_scale):
+    """
+    Runs the station from a simulated recording in another process and
+    returns its results along with what the fake database received.
+    """
+    camera = camera_available()
+    recording = os.path.join(directory, f"{name}.jsonl")
+    started = time.perf_counter()
+    simulation.write_recording(
+        recording,
+        days=days,
+        accumulation_interval=accumulation_interval,
+        log_interval=log_interval,
+        pulse_scale=pulse_scale,
+        frames=camera,
+    )
+    log(f"  Simulated {days} days in {time.perf_counter() - started:.1f} seconds")
+
+    database = FakeInflux().start()
+    config = os.path.join(directory, f"{name}.ini")
+    write_config(config, database.url, accumulation_interval, log_interval, camera)
+    result_file = os.path.join(directory, f"{name}.json")
+    try:
+        subprocess.run(
+            [
+                sys.executable,
+                os.path.join(BENCHMARK_DIRECTORY, "pipeline.py"),
+                "--recording",
+                recording,
+                "--config",
+                config,
+                "--data-directory",
+                os.path.join(directory, f"{name}_data"),
+                "--result",
+                result_file,
+            ],
+            check=True,
+        )
+    finally:
+        database.stop()
+
+    with open(result_file) as file:
+        result = json.load(file)
+    result["camera"] = camera
+    result["database"] = database.counts()
+    log(
+        f"  {result['records']} records in {result['wall_seconds']} seconds, "
+        f"{result['database']['points']} points written to the fake database"
+    )
+    return result
+
+
+def pipeline_results(name, result, throughput):
+    """
+    Returns the results of a pipeline run that are compared between versions,
+    with the throughput in ticks or records per second.
+    """
+    results = {
+        f"{name}.{throughput}_per_second": {
+            "value": result[f"{throughput}_per_second"],
+            "unit": f"{throughput}/s",
+            "better": "higher",
+        },
+    }
+    for key, unit in [("tick_mean_us", "us"), ("log_tick_mean_ms", "ms")]:
+        if result.get(key) is not None:
+            results[f"{name}.{key}"] = {
+                "value": result[key],
+                "unit": unit,
+                "better": "lower",
+            }
+    return results
+
+
+###############################################################################
+# Comparison
+###############################################################################
+
+
+def compare(baseline, current, threshold):
+    """
+    Prints how each result changed from the baseline and returns the names of
+    the results that got worse by more than the threshold (and by more than
+    their min_change, if they have one).
+    """
+    regressions = []
+    if baseline.get("quick") != current.get("quick"):
+        print("Warning: only one of the runs was a --quick run, so their pipelines differ")
+    print(
+        f"{'Benchmark':40} {'Baseline':>12} {'Current':>12} {'Change':>8}  "
+        f"({baseline.get('commit')} -> {current.get('commit')})"
+    )
+    for name, result in sorted(current["benchmarks"].items()):
+        old = baseline["benchmarks"].get(name)
+        if old is None or not old["value"]:
+            print(f"{name:40} {'-':>12} {result['value']:>12} {'new':>8}")
+            continue
+        change = (result["value"] - old["value"]) / old["value"]
+        worse = change > threshold if result["better"] == "lower" else change < -threshold
+        if abs(result["value"] - old["value"]) <= result.get("min_change", 0):
+            worse = False
+        if worse:
+            regressions.append(name)
+        print(
+            f"{name:40} {old['value']:>12} {result['value']:>12} "
+            f"{change * 100:>+7.1f}%{'  SLOWER' if worse else ''}"
+        )
+    return regressions
+
+
+###############################################################################
+# Main Program
+###############################################################################
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the weather station")
+    parser.add_argument(
+        "--output", metavar="FILE", help="Save the results to FILE as JSON"
+    )
+    parser.add_argument(
+        "--compare",
+        metavar="FILE",
+        help="Compare the results with the earlier results saved in FILE",
+    )
+    parser.add_argument(
+        "--against",
+        metavar="FILE",
+        help="With --compare, compare the results saved in FILE instead of running",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=DEFAULT_THRESHOLD,
+        help="Report results more than this fraction worse as regressions",
+    )
+    parser.add_argument(
+        "--quick",
+        action="store_true",
+        help="Run shorter benchmarks (a quarter day and 30 days of weather)",
+    )
+    parser.add_argument(
+        "--skip",
+        action="append",
+        default=[],
+        choices=["components", "pipeline", "year"],
+        help="Skip a group of benchmarks. Can be given more than once.",
+    )
+    parser.add_argument(
+        "--keep",
+        action="store_true",
+        help="Keep the recordings and data files instead of deleting them",
+    )
+    return parser.parse_args(argv)
+
+
+def run(args):
+    results = {
+        "version": RESULTS_VERSION,
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "quick": args.quick,
+        "benchmarks": {},
+        "details": {},
+    }
+
+    directory = tempfile.mkdtemp(prefix="weather_benchmark_")
+    try:
+        if "components" not in args.skip:
+            log("Running the component benchmarks")
+            results["benchmarks"].update(components.run(args.quick, directory))
+
+        if "pipeline" not in args.skip:
+            log("Running the station for a simulated day")
+            pipeline = run_pipeline(
+                "pipeline", directory, 0.25 if args.quick else 1, 10, 900, 1.0
+            )
+            results["benchmarks"].update(pipeline_results("pipeline", pipeline, "ticks"))
+            results["details"]["pipeline"] = pipeline
+
+        if "year" not in args.skip:
+            days = 30 if args.quick else 365
+            log(f"Running the station for {days} simulated days")
+            year = run_pipeline("year", directory, days, 900, 900, 0.01)
+            results["benchmarks"].update(pipeline_results("year", year, "records"))
+            memory = year["memory"]
+            # The memory use moves by a few hundred KB from run to run
+            results["benchmarks"]["year.rss_growth_mb_per_30_days"] = {
+                "value": memory["rss_growth_mb_per_30_days"],
+                "unit": "MB",
+                "better": "lower",
+                "min_change": 1.0,
+            }
+            results["benchmarks"]["year.rss_peak_mb"] = {
+                "value": memory["rss_peak_mb"],
+                "unit": "MB",
+                "better": "lower",
+                "min_change": 2.0,
+            }
+            results["details"]["year"] = year
+    finally:
+        if args.keep:
+            log(f"The recordings and data files were kept in {directory}")
+        else:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    return results
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    if args.against:
+        if not args.compare:
+            sys.exit("--against needs --compare")
+        with open(args.against) as file:
+            results = json.load(file)
+    else:
+        results = run(args)
+        if args.output:
+            with open(args.output, "w") as file:
+                json.dump(results, file, indent=2)
+            log(f"The results were saved to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        regressions = compare(baseline, results, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} benchmarks got slower: {', '.join(regressions)}")
+            sys.exit(1)
+    else:
+        for name, result in sorted(results["benchmarks"].items()):
+            print(f"{name:40} {result['value']:>12} {result['unit']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,310 @@
+# Simulation
+#
+# Simulated weather for running the station without the hardware. The weather
+# is made up but plausible: the temperature and humidity follow the time of
+# day and year, the pressure drifts, the wind gusts and veers, and it rains now
+# and then. The same seed always gives the same weather.
+#
+# write_recording() writes the readings the station would take as a recording
+# in the format of sensor_backend.py, so the whole station can be run from it
+# with --replay. SimulatedBackend gives the readings directly for benchmarking
+# single parts of the station.
+#
+# Daniel Hornberger
+# 2021
+
+import datetime
+import json
+import math
+import os
+import random
+import sys
+
+# The station's modules are in the directory above this one
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sensor_backend
+import wind_direction
+from anemometer import WindEngine
+
+# 2021-01-01 00:00:00 UTC
+START_TIME = 1609459200.0
+
+# Where the simulated monotonic clock starts
+START_MONOTONIC = 1000.0
+
+# The pins from the default settings
+WIND_SPEED_PIN = 5
+RAIN_PIN = 6
+
+RAIN_BUCKET_SIZE = 0.011  # Inches per tip
+
+# The ADC code the wind direction sensor gives for each heading
+DIRECTION_CODES = {
+    angle: round(voltage / wind_direction.VREF * sensor_backend.ADC_MAX_CODE)
+    for voltage, angle in wind_direction.volts.items()
+}
+
+MPH_PER_PULSE_PER_SECOND = WindEngine().mph_per_pulse_per_sec
+
+
+class Weather:
+    """
+    Gives the simulated conditions at any time. The times must be asked for
+    in order.
+    """
+
+    def __init__(self, seed=0):
+        self.random = random.Random(seed)
+        self._time = None
+        self._gust = 0.0
+        self._direction = 225.0
+        self._pressure_drift = 0.0
+        self._rain_until = 0.0
+        self._rain_rate = 0.0
+
+    def advance(self, time, seconds):
+        """
+        Moves the random parts of the weather forward by seconds to time.
+        """
+        self._time = time
+        scale = math.sqrt(max(seconds, 1e-3) / 10)
+        # The gusts and the direction wander, pulled back toward the average
+        self._gust += self.random.gauss(0, 1.5 * scale) - self._gust * min(
+            0.1 * seconds / 10, 1
+        )
+        self._direction = (self._direction + self.random.gauss(0, 8 * scale)) % 360
+        self._pressure_drift += self.random.gauss(0, 0.05 * scale)
+        self._pressure_drift *= 0.9999
+        # Rain starts on about one day in ten and lasts a few hours
+        if time >= self._rain_until and self.random.random() < seconds / 864000:
+            self._rain_until = time + self.random.uniform(1800, 6 * 3600)
+            self._rain_rate = self.random.uniform(0.02, 0.5)
+
+    def _day_fraction(self):
+        return (self._time % 86400) / 86400
+
+    def _year_fraction(self):
+        return ((self._time - START_TIME) % 31557600) / 31557600
+
+    def wind_speed(self):
+        """
+        Returns the wind speed in MPH. It's calmer at night.
+        """
+        daily = 3 - 3 * math.cos(2 * math.pi * (self._day_fraction() - 0.1))
+        return max(1.5 + daily + self._gust, 0.0)
+
+    def direction(self):
+        """
+        Returns the wind direction rounded to one of the 16 headings.
+        """
+        return round(self._direction / 22.5) % 16 * 22.5
+
+    def temperature(self):
+        """
+        Returns the temperature in Celsius.
+        """
+        yearly = -12 * math.cos(2 * math.pi * self._year_fraction())
+        daily = -6 * math.cos(2 * math.pi * (self._day_fraction() - 0.1))
+        return 12 + yearly + daily + self.random.gauss(0, 0.1)
+
+    def humidity(self):
+        daily = 20 * math.cos(2 * math.pi * (self._day_fraction() - 0.1))
+        raining = 25 if self.raining() else 0
+        return min(max(55 + daily + raining + self.random.gauss(0, 0.5), 5), 100)
+
+    def pressure(self):
+        """
+        Returns the raw pressure in mbar before the calibration offset is
+        added.
+        """
+        return 860 + self._pressure_drift * 5 + self.random.gauss(0, 0.05)
+
+    def raining(self):
+        return self._time < self._rain_until
+
+    def rain_rate(self):
+        """
+        Returns the rain rate in inches per hour.
+        """
+        return self._rain_rate if self.raining() else 0.0
+
+    def daylight(self):
+        return 0.25 < self._day_fraction() < 0.8
+
+
+def _times(random_generator, start, end, rate):
+    """
+    Returns random event times between start and end at a rate per second.
+    """
+    times = []
+    if rate <= 0:
+        return times
+    time = start + random_generator.expovariate(rate)
+    while time < end:
+        times.append(time)
+        time += random_generator.expovariate(rate)
+    return times
+
+
+def write_recording(
+    path,
+    days=1.0,
+    accumulation_interval=10,
+    log_interval=900,
+    pulse_scale=1.0,
+    frames=True,
+    seed=0,
+    start_time=START_TIME,
+):
+    """
+    Writes a recording of days of simulated weather to path as the station
+    with the intervals would read it. Only pulse_scale of the anemometer
+    pulses are kept, which shrinks long recordings. If frames is True, a
+    bright frame is recorded for the pictures taken during the day and a
+    dark one at night, which needs Pillow. Returns the number of ticks.
+    """
+    weather = Weather(seed)
+    pulse_random = random.Random(seed + 1)
+
+    frames_directory = path + ".frames"
+    if frames:
+        _write_frames(frames_directory)
+
+    # The ticks land on the same deadlines as the station's Scheduler
+    wall_offset = start_time - START_MONOTONIC
+    number = math.floor(start_time / accumulation_interval) + 1
+    ticks_per_log = log_interval // accumulation_interval
+    ticks = int(days * 86400 / accumulation_interval)
+
+    with open(path, "w") as file:
+        write = file.write
+        dumps = json.dumps
+
+        write(
+            dumps(
+                {
+                    "type": "header",
+                    "version": sensor_backend.RECORDING_VERSION,
+                    "wall": start_time,
+                    "mono": START_MONOTONIC,
+                }
+            )
+            + "\n"
+        )
+
+        previous = START_MONOTONIC
+        for tick in range(ticks):
+            deadline = number * accumulation_interval - wall_offset
+            weather.advance(deadline + wall_offset, deadline - previous)
+
+            # The edges since the last tick, in order
+            pulse_rate = weather.wind_speed() / MPH_PER_PULSE_PER_SECOND
+            edges = [
+                (t, WIND_SPEED_PIN)
+                for t in _times(pulse_random, previous, deadline, pulse_rate * pulse_scale)
+            ]
+            rain_rate = weather.rain_rate() / RAIN_BUCKET_SIZE / 3600
+            edges += [(t, RAIN_PIN) for t in _times(pulse_random, previous, deadline, rain_rate)]
+            edges.sort()
+            for t, pin in edges:
+                write(f'{{"type":"edge","t":{t!r},"pin":{pin}}}\n')
+
+            # The readings taken on the tick
+            write(
+                f'{{"type":"bme280","t":{deadline!r},'
+                f'"humidity":{weather.humidity()!r},'
+                f'"pressure":{weather.pressure()!r},'
+                f'"temperature":{weather.temperature()!r}}}\n'
+            )
+            write(
+                f'{{"type":"adc","t":{deadline!r},"channel":{wind_direction.ADC_CHANNEL},'
+                f'"code":{DIRECTION_CODES[weather.direction()]}}}\n'
+            )
+            # The picture is taken on the tick before the record is logged
+            if frames and (number + 1) % ticks_per_log == 0:
+                name = "day.jpeg" if weather.daylight() else "night.jpeg"
+                write(f'{{"type":"frame","t":{deadline!r},"file":"{name}"}}\n')
+
+            previous = deadline
+            number += 1
+
+    return ticks
+
+
+def _write_frames(directory, size=(256, 256)):
+    """
+    Writes the bright and dark frames the simulated camera returns.
+    """
+    from PIL import Image
+
+    os.makedirs(directory, exist_ok=True)
+    for name, brightness in [("day.jpeg", 140), ("night.jpeg", 3)]:
+        image = Image.new("RGB", size, (brightness, brightness, brightness + 20))
+        # Some detail so the frames compress like real pictures
+        pixels = image.load()
+        generator = random.Random(brightness)
+        for _ in range(size[0] * size[1] // 8):
+            x = generator.randrange(size[0])
+            y = generator.randrange(size[1])
+            shade = min(brightness + generator.randrange(40), 255)
+            pixels[x, y] = (shade, shade, shade)
+        image.save(os.path.join(directory, name), "JPEG", quality=85)
+
+
+class SimulatedBackend:
+    """
+    A sensor backend that reads the simulated weather on a virtual clock.
+    sleep() advances the clock and fires the anemometer and rain gauge edges
+    that fall in the slept period.
+    """
+
+    def __init__(self, seed=0, start_time=START_TIME):
+        self.weather = Weather(seed)
+        self._random = random.Random(seed + 1)
+        self._monotonic = START_MONOTONIC
+        self._wall_offset = start_time - START_MONOTONIC
+        self._callbacks = {}
+        self.weather.advance(start_time, 0)
+
+    def time(self):
+        return self._monotonic + self._wall_offset
+
+    def monotonic(self):
+        return self._monotonic
+
+    def sleep(self, seconds):
+        start = self._monotonic
+        end = start + max(seconds, 0.0)
+        self.weather.advance(end + self._wall_offset, end - start)
+        pulse_rate = self.weather.wind_speed() / MPH_PER_PULSE_PER_SECOND
+        rain_rate = self.weather.rain_rate() / RAIN_BUCKET_SIZE / 3600
+        edges = [(t, WIND_SPEED_PIN) for t in _times(self._random, start, end, pulse_rate)]
+        edges += [(t, RAIN_PIN) for t in _times(self._random, start, end, rain_rate)]
+        for t, pin in sorted(edges):
+            self._monotonic = t
+            callback = self._callbacks.get(pin)
+            if callback is not None:
+                callback()
+        self._monotonic = end
+
+    def now(self):
+        return datetime.datetime.fromtimestamp(self.time())
+
+    def utcnow(self):
+        return datetime.datetime.utcfromtimestamp(self.time())
+
+    def on_edge(self, pin, callback):
+        self._callbacks[pin] = callback
+
+    def read_adc(self, channel):
+        return DIRECTION_CODES[self.weather.direction()]
+
+    def read_bme280(self, port, address, oversampling=1):
+        return self.weather.humidity(), self.weather.pressure(), self.weather.temperature()
+
+    def camera(self):
+        raise NotImplementedError("The simulated backend has no camera")
+
+    def close(self):
+        pass
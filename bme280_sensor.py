@@ -10,10 +10,17 @@
 # GND of the BME280 sensor connected to pin 9 (Ground)
 # SCL of the BME280 sensor connected to BCM 3 (SCL)
 # SDA of the BME280 sensor connected to BCM 2 (SDA)
+#
+# The BME280Sampler samples the sensor many times over a log interval and
+# keeps the mean, minimum, maximum and variance of each reading, so the logged
+# values represent the whole interval rather than a single snapshot. Each
+# sample is a forced mode measurement with hardware oversampling, which takes
+# about 30 ms at x4.
 
-import bme280
-import smbus2
-from time import sleep
+import logger as logging
+import metrics
+from running_stats import RunningStats
+import sensor_backend
 
 # Amount to add to the barometer reading for a particular location
 # NOTE: This will need to be calibrated for each individual sensor
@@ -22,27 +29,75 @@ CALIBRATION = 152.2826
 # True will report temperature in F, False will report in C
 DO_FAHRENHEIT = True
 
+# The number of readings the sensor averages for each sample (1, 2, 4, 8 or 16)
+OVERSAMPLING = 4
+
+READ = metrics.stage("bme280_read")
+SAMPLES = metrics.counter("bme280_samples", "Successful BME280 samples")
+FAILURES = metrics.counter("bme280_failures", "BME280 samples that failed")
+
 port = 1
 address = 0x76  # BME280 address (Diymore sensor. Adafruit would be 0x77)
-bus = smbus2.SMBus(port)
 
-bme280.load_calibration_params(bus, address)
 
-# Samples the BME280 sensor and returns the humidity, temperature, and
-# ambient_temperature
-def read_all():
-    bme280_data = bme280.sample(bus, address)
-    humidity = round(bme280_data.humidity, 1)
-    pressure = round(bme280_data.pressure + CALIBRATION, 1)
-    ambient_temperature = round(bme280_data.temperature, 1)
-    if DO_FAHRENHEIT:
-        ambient_temperature = round((ambient_temperature * 1.8) + 32, 1)
+class BME280Sampler:
+    """
+    Keeps the statistics of the humidity, pressure and temperature sampled
+    since the last reset.
+    """
+
+    def __init__(
+        self, oversampling=OVERSAMPLING, calibration=CALIBRATION, fahrenheit=DO_FAHRENHEIT
+    ):
+        self.oversampling = oversampling
+        self.calibration = calibration
+        self.fahrenheit = fahrenheit
+        self.humidity = RunningStats()
+        self.pressure = RunningStats()
+        self.temperature = RunningStats()
+        self.failures = 0
+        # The latest (humidity, pressure, temperature), kept across resets
+        self.last = None
+
+    def sample(self):
+        """
+        Samples the sensor once. Returns False if the sensor couldn't be read.
+        """
+        try:
+            with READ:
+                humidity, pressure, temperature = sensor_backend.get_backend().read_bme280(
+                    port, address, self.oversampling
+                )
+        except Exception as e:
+            self.failures += 1
+            FAILURES.inc()
+            logging.debug(f"Reading the bme280 sensor failed: {str(e.args)}")
+            return False
+
+        self.humidity.add(humidity)
+        self.pressure.add(pressure + self.calibration)
+        if self.fahrenheit:
+            temperature = (temperature * 1.8) + 32
+        self.temperature.add(temperature)
+        self.last = (humidity, pressure + self.calibration, temperature)
+        SAMPLES.inc()
+        return True
+
+    @property
+    def count(self):
+        return self.temperature.count
 
-    return humidity, pressure, ambient_temperature
+    def reset(self):
+        self.humidity.reset()
+        self.pressure.reset()
+        self.temperature.reset()
+        self.failures = 0
 
 
 # This can be used to print the values being read for testing or calibration
+# sampler = BME280Sampler()
 # while True:
-#    humidity, pressure, ambient_temperature = read_all()
-#    print(f"Humidity: {humidity}, Pressure: {pressure}, Temperature: {ambient_temperature}")
-#    sleep(1)
+#    if sampler.sample():
+#        humidity, pressure, ambient_temperature = sampler.last
+#        print(f"Humidity: {humidity}, Pressure: {pressure}, Temperature: {ambient_temperature}")
+#    time.sleep(1)
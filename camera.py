@@ -3,17 +3,27 @@
 # This module can be used to take a picture with the PiCamera.
 # It will take a picture and save it to the specified location.
 #
+# The CameraWorker takes the pictures on a background thread so the sensor
+# readings aren't paused while the camera is busy. It captures a single jpeg
+# per request, measures its brightness from a reduced size grayscale decode,
+# and saves that same jpeg to an ImageStore (see image_store.py) if it's
+# bright enough.
+#
 # Daniel Hornberger
 # 2021
 
+from concurrent.futures import Future
 import datetime
-import math
-from picamera import PiCamera
+import queue
+import threading
 from io import BytesIO
-from PIL import Image
-from PIL import ImageStat
 
 import logger as logging
+import metrics
+
+CAPTURE = metrics.stage("camera_capture")
+BRIGHTNESS = metrics.stage("image_brightness")
+SAVE = metrics.stage("image_save")
 
 # NOTE: The PiCamera 'camera' object has to be passed in from the weather_station.py
 # loop since the object gets used in rapid succession. If it's reinstated for each
@@ -53,14 +63,95 @@ def sufficient_brightness(camera_obj, threshold):
     # Capture an in-memory stream
     stream = BytesIO()
     camera_obj.capture(stream, format='jpeg')
-    # Rewind the stream to the beginning to read its content
-    stream.seek(0)
-    image = Image.open(stream)
-
-    # https://stackoverflow.com/questions/3490727/what-are-some-methods-to-analyze-image-brightness-using-python#answer-3498247
-    stat = ImageStat.Stat(image)
-    perceived_brightness = stat.mean[0] 
+    perceived_brightness = measure_brightness(stream.getvalue())
     logging.log(f"Calculated image brightness: {perceived_brightness}")
     print(f"Calculated image brightness: {perceived_brightness}")
 
     return perceived_brightness > threshold
+
+
+def measure_brightness(jpeg, size=(128, 128)):
+    """
+    Returns the average grayscale brightness (0 - 255) of a jpeg image.
+    Only a grayscale version of about the given size is decoded, which is
+    much faster than decoding the full color image.
+    """
+    # PIL is imported here since it's slow to import and the station doesn't
+    # need it until the first picture is taken
+    from PIL import Image
+    from PIL import ImageStat
+
+    image = Image.open(BytesIO(jpeg))
+    # JPEG draft mode lets the decoder skip the color conversion and scale
+    # the image down by up to 8 times while decoding
+    image.draft("L", size)
+    image = image.convert("L")
+
+    # https://stackoverflow.com/questions/3490727/what-are-some-methods-to-analyze-image-brightness-using-python#answer-3498247
+    stat = ImageStat.Stat(image)
+    return stat.mean[0]
+
+
+class CameraWorker:
+    """
+    Takes pictures on a background thread. Each call to request() returns a
+    Future that will hold the name of the saved image in the store, or "nan" if
+    it was too dark or the capture failed.
+    """
+
+    def __init__(self, camera_obj, store, now=datetime.datetime.now):
+        self.camera_obj = camera_obj
+        self.store = store
+        self.now = now
+        self.last_brightness = None
+        self.last_capture_time = 0.0
+        self._requests = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="camera", daemon=True)
+        self._thread.start()
+
+    def request(self, threshold):
+        """
+        Queues a picture to be taken and saved to the store if its brightness
+        is above the threshold.
+        """
+        future = Future()
+        self._requests.put((future, threshold))
+        return future
+
+    def stop(self):
+        self._requests.put(None)
+        self._thread.join()
+
+    def _capture(self, threshold):
+        now = self.now()
+        stream = BytesIO()
+        with CAPTURE:
+            self.camera_obj.capture(stream, format="jpeg")
+        jpeg = stream.getvalue()
+
+        with BRIGHTNESS:
+            self.last_brightness = measure_brightness(jpeg)
+        logging.log(f"Calculated image brightness: {self.last_brightness}")
+        if self.last_brightness <= threshold:
+            return "nan"  # The influx database fails with math.nan
+
+        with SAVE:
+            return self.store.save(jpeg, now, self.last_brightness)
+
+    def _run(self):
+        while True:
+            request = self._requests.get()
+            if request is None:
+                return
+            future, threshold = request
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            start = datetime.datetime.now()
+            try:
+                future.set_result(self._capture(threshold))
+            except Exception as e:
+                print(f"Exception from camera.py: {str(e.args)}")
+                logging.log(f"Exception from camera.py: {str(e.args)}")
+                future.set_result("nan")
+            self.last_capture_time = (datetime.datetime.now() - start).total_seconds()
@@ -0,0 +1,189 @@
+# Circular Statistics
+#
+# Statistics for angles such as wind directions. Angles can't be averaged
+# directly (the average of 350 and 10 degrees is 0, not 180), so each angle is
+# treated as a unit vector and the vectors are averaged instead.
+#
+# DirectionAccumulator keeps running sums so any number of samples can be
+# added using a constant amount of memory. The batch functions use NumPy to
+# calculate the same statistics over stored history, such as the directions
+# read back from the data files.
+#
+# The standard deviation is calculated with the Yamartino method:
+# Yamartino, R.J. (1984). "A Comparison of Several "Single-Pass" Estimators of
+# the Standard Deviation of Wind Direction". Journal of Climate and Applied
+# Meteorology. 23 (9): 1362-1366.
+
+import collections
+import math
+
+# NumPy is only imported when a batch calculation is first used, since
+# importing it takes seconds on the Raspberry Pi and the station doesn't need
+# it to start sampling
+np = None
+
+# The statistics calculated over a set of directions
+#
+# mean                   - The average direction in degrees
+# std_dev                - The Yamartino standard deviation in degrees
+# vector_mean_direction  - The average direction weighted by wind speed
+# vector_mean_speed      - The speed of the average wind vector
+# count                  - The number of samples
+DirectionStats = collections.namedtuple(
+    "DirectionStats",
+    ["mean", "std_dev", "vector_mean_direction", "vector_mean_speed", "count"],
+)
+
+YAMARTINO_FACTOR = 2.0 / math.sqrt(3.0) - 1.0
+
+
+def _direction(sin_sum, cos_sum):
+    """
+    Returns the angle of a vector in degrees between 0 and 360.
+    """
+    if sin_sum == 0.0 and cos_sum == 0.0:
+        return 0.0
+    angle = math.degrees(math.atan2(sin_sum, cos_sum)) % 360.0
+    return 0.0 if angle == 360.0 else angle
+
+
+def _yamartino(sin_mean, cos_mean):
+    epsilon = math.sqrt(max(1.0 - (sin_mean * sin_mean + cos_mean * cos_mean), 0.0))
+    return math.degrees(math.asin(epsilon) * (1.0 + YAMARTINO_FACTOR * epsilon ** 3))
+
+
+class DirectionAccumulator:
+    """
+    Keeps the running sums needed to calculate the statistics of a stream of
+    directions, optionally paired with wind speeds.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.sin_sum = 0.0
+        self.cos_sum = 0.0
+        self.speed_sin_sum = 0.0
+        self.speed_cos_sum = 0.0
+
+    def add(self, angle, speed=1.0):
+        """
+        Adds a direction in degrees and the wind speed when it was read.
+        """
+        radians = math.radians(angle)
+        sin = math.sin(radians)
+        cos = math.cos(radians)
+        self.count += 1
+        self.sin_sum += sin
+        self.cos_sum += cos
+        self.speed_sin_sum += speed * sin
+        self.speed_cos_sum += speed * cos
+
+    def merge(self, other):
+        """
+        Adds the samples of another accumulator to this one.
+        """
+        self.count += other.count
+        self.sin_sum += other.sin_sum
+        self.cos_sum += other.cos_sum
+        self.speed_sin_sum += other.speed_sin_sum
+        self.speed_cos_sum += other.speed_cos_sum
+
+    def mean(self):
+        return _direction(self.sin_sum, self.cos_sum)
+
+    def std_dev(self):
+        if self.count == 0:
+            return 0.0
+        return _yamartino(self.sin_sum / self.count, self.cos_sum / self.count)
+
+    def vector_mean(self):
+        """
+        Returns the direction and speed of the average wind vector.
+        """
+        if self.count == 0:
+            return 0.0, 0.0
+        speed = math.hypot(self.speed_sin_sum, self.speed_cos_sum) / self.count
+        return _direction(self.speed_sin_sum, self.speed_cos_sum), speed
+
+    def stats(self):
+        direction, speed = self.vector_mean()
+        return DirectionStats(self.mean(), self.std_dev(), direction, speed, self.count)
+
+
+###############################################################################
+# Batch Calculations
+###############################################################################
+
+
+def _require_numpy():
+    global np
+
+    if np is None:
+        try:
+            import numpy
+        except ImportError:
+            raise ImportError("NumPy is required for the batch circular statistics")
+        np = numpy
+
+
+def batch_stats(angles, speeds=None):
+    """
+    Calculates the statistics of an array of directions in degrees and the
+    matching wind speeds.
+    """
+    _require_numpy()
+
+    radians = np.radians(np.asarray(angles, dtype=np.float64))
+    count = radians.size
+    if count == 0:
+        return DirectionStats(0.0, 0.0, 0.0, 0.0, 0)
+
+    sin = np.sin(radians)
+    cos = np.cos(radians)
+    sin_sum = float(sin.sum())
+    cos_sum = float(cos.sum())
+
+    if speeds is None:
+        speed_sin_sum = sin_sum
+        speed_cos_sum = cos_sum
+    else:
+        speeds = np.asarray(speeds, dtype=np.float64)
+        speed_sin_sum = float(np.dot(speeds, sin))
+        speed_cos_sum = float(np.dot(speeds, cos))
+
+    return DirectionStats(
+        _direction(sin_sum, cos_sum),
+        _yamartino(sin_sum / count, cos_sum / count),
+        _direction(speed_sin_sum, speed_cos_sum),
+        math.hypot(speed_sin_sum, speed_cos_sum) / count,
+        count,
+    )
+
+
+def windowed_stats(angles, window):
+    """
+    Calculates the mean direction and Yamartino standard deviation of every
+    window of consecutive samples using cumulative sums, so the cost doesn't
+    depend on the size of the window. Returns two arrays with one entry per
+    window.
+    """
+    _require_numpy()
+
+    radians = np.radians(np.asarray(angles, dtype=np.float64))
+    if window <= 0 or radians.size < window:
+        return np.empty(0), np.empty(0)
+
+    sin_sums = np.concatenate(([0.0], np.cumsum(np.sin(radians))))
+    cos_sums = np.concatenate(([0.0], np.cumsum(np.cos(radians))))
+    sin_means = (sin_sums[window:] - sin_sums[:-window]) / window
+    cos_means = (cos_sums[window:] - cos_sums[:-window]) / window
+
+    means = np.degrees(np.arctan2(sin_means, cos_means)) % 360.0
+    # A tiny negative angle wraps around to 360, which is 0 as in _direction()
+    means[means == 360.0] = 0.0
+    epsilon = np.sqrt(np.clip(1.0 - (sin_means ** 2 + cos_means ** 2), 0.0, None))
+    std_devs = np.degrees(np.arcsin(epsilon) * (1.0 + YAMARTINO_FACTOR * epsilon ** 3))
+    return means, std_devs
@@ -0,0 +1,357 @@
+# Columnar Store
+#
+# Stores the weather records in a compact binary format alongside the .csv
+# data file. The records of each day are kept in their own chunk file named
+# YYYY-MM-DD.wsc, so a query over a range of days only opens the chunks for
+# those days.
+#
+# Each chunk file starts with a small header holding the number of records in
+# it and the times of the first and last record. It is followed by one region
+# per column with room for CAPACITY values of a fixed width (float32 for the
+# readings, float64 epoch seconds for the time). The direction strings and
+# image names are dictionary encoded: the column holds a uint16 code and the
+# strings are listed in order in a <chunk>.dict file, one JSON string per line.
+#
+# A record is appended by writing its values into the column regions and then
+# updating the record count in the header, so a record that was only partly
+# written when the power was lost is ignored. A chunk is grown to twice its
+# capacity if it fills up.
+#
+# The chunks are read with mmap, and NumPy arrays of the columns are views of
+# the mapped file rather than copies.
+
+import datetime
+import json
+import mmap
+import os
+import struct
+
+# NumPy is only imported when the records are read, so the station can start
+# writing without waiting for it. See _numpy().
+np = None
+_numpy_checked = False
+
+MAGIC = b"WXCOLS\x00\x01"
+VERSION = 1
+CHUNK_SUFFIX = ".wsc"
+DICTIONARY_SUFFIX = ".dict"
+
+# Room for one record per minute. Chunks grow if more are written.
+CAPACITY = 1440
+
+# magic, version, record count, capacity, first time, last time
+HEADER = struct.Struct("<8sIIIxxxxdd")
+HEADER_SIZE = 64
+
+# The columns in the order they are stored: name, array typecode, .csv label.
+# Columns with the "H" typecode are dictionary encoded strings.
+COLUMNS = [
+    ("record_number", "I", "Record Number"),
+    ("time", "d", "Time"),
+    ("temperature", "f", "Temperature (F)"),
+    ("pressure", "f", "Pressure (mbars)"),
+    ("humidity", "f", "Relative Humidity (%)"),
+    ("wind_direction", "f", "Wind Direction (Degrees)"),
+    ("wind_direction_string", "H", "Wind Direction (String)"),
+    ("wind_speed", "f", "Wind Speed (MPH)"),
+    ("wind_gust", "f", "Wind Gust (MPH)"),
+    ("precipitation", "f", "Precipitation (Inches)"),
+    ("image", "H", "Image"),
+]
+COLUMN_NAMES = [name for name, typecode, label in COLUMNS]
+STRING_COLUMNS = [name for name, typecode, label in COLUMNS if typecode == "H"]
+LABELS = {name: label for name, typecode, label in COLUMNS}
+
+
+def _column_offsets(capacity):
+    """
+    Returns the offset of each column's region and the total size of a chunk
+    with room for capacity records.
+    """
+    offsets = {}
+    offset = HEADER_SIZE
+    for name, typecode, label in COLUMNS:
+        offsets[name] = offset
+        offset += struct.calcsize(typecode) * capacity
+        # Keep every column aligned to 8 bytes
+        offset = (offset + 7) // 8 * 8
+    return offsets, offset
+
+
+def _numpy():
+    """
+    Returns the numpy module, or None if it isn't installed.
+    """
+    global np
+    global _numpy_checked
+
+    if not _numpy_checked:
+        try:
+            import numpy
+
+            np = numpy
+        except ImportError:
+            np = None
+        _numpy_checked = True
+    return np
+
+
+def chunk_name(day):
+    return day.strftime("%Y-%m-%d") + CHUNK_SUFFIX
+
+
+###############################################################################
+# Reading
+###############################################################################
+
+
+class Chunk:
+    """
+    A read only view of a chunk file. The NumPy arrays returned by column()
+    refer to the mapped file, so close() can only be called once they are no
+    longer used.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, count, capacity, first, last = HEADER.unpack_from(self._map)
+        if magic != MAGIC or version != VERSION:
+            self._map.close()
+            raise ValueError(f"{path} is not a weather station chunk file")
+
+        self.count = count
+        self.capacity = capacity
+        self.first_time = first
+        self.last_time = last
+        self._offsets, size = _column_offsets(capacity)
+        self._typecodes = {name: typecode for name, typecode, label in COLUMNS}
+
+        self.dictionary = []
+        if os.path.exists(path + DICTIONARY_SUFFIX):
+            with open(path + DICTIONARY_SUFFIX) as file:
+                self.dictionary = [json.loads(line) for line in file if line.strip()]
+
+    def column(self, name):
+        """
+        Returns the values of a column as a NumPy array, or a memoryview if
+        NumPy isn't installed. No data is copied.
+        """
+        typecode = self._typecodes[name]
+        offset = self._offsets[name]
+        np = _numpy()
+        if np is not None:
+            return np.frombuffer(
+                self._map, dtype=np.dtype(typecode), count=self.count, offset=offset
+            )
+        size = struct.calcsize(typecode)
+        return memoryview(self._map)[offset : offset + size * self.count].cast(typecode)
+
+    def strings(self, name):
+        """
+        Returns the decoded values of a dictionary encoded column as a list.
+        """
+        dictionary = self.dictionary
+        return [dictionary[code] for code in self.column(name)]
+
+    def close(self):
+        self._map.close()
+
+
+def days_between(start, end):
+    """
+    Yields every date from start to end inclusive.
+    """
+    day = start
+    while day <= end:
+        yield day
+        day += datetime.timedelta(days=1)
+
+
+def chunks_between(directory, start, end):
+    """
+    Yields the chunks for the days from the datetime start to end that have
+    any records between those times. Only the chunks of those days are read.
+    """
+    start_time = start.timestamp()
+    end_time = end.timestamp()
+    for day in days_between(start.date(), end.date()):
+        path = os.path.join(directory, chunk_name(day))
+        if not os.path.exists(path):
+            continue
+        chunk = Chunk(path)
+        if chunk.count and chunk.last_time >= start_time and chunk.first_time <= end_time:
+            yield chunk
+        else:
+            chunk.close()
+
+
+def query(directory, start, end, columns=COLUMN_NAMES):
+    """
+    Returns a dictionary of NumPy arrays holding the columns of the records
+    between the datetimes start and end. String columns are returned as lists.
+    """
+    np = _numpy()
+    if np is None:
+        raise ImportError("NumPy is required to query the columnar store")
+
+    results = {name: [] for name in columns}
+    start_time = start.timestamp()
+    end_time = end.timestamp()
+    for chunk in chunks_between(directory, start, end):
+        times = chunk.column("time")
+        mask = (times >= start_time) & (times <= end_time)
+        for name in columns:
+            if name in STRING_COLUMNS:
+                codes = chunk.column(name)[mask]
+                results[name].extend(chunk.dictionary[code] for code in codes)
+            else:
+                # Copy the selected values so the chunk can be closed
+                results[name].append(chunk.column(name)[mask].copy())
+        del times, mask
+        chunk.close()
+
+    for name in columns:
+        if name not in STRING_COLUMNS:
+            typecode = [t for n, t, label in COLUMNS if n == name][0]
+            parts = results[name]
+            results[name] = np.concatenate(parts) if parts else np.empty(0, typecode)
+    return results
+
+
+###############################################################################
+# Writing
+###############################################################################
+
+
+class ColumnarWriter:
+    """
+    Appends records to the chunk files in a directory.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._day = None
+        self._file = None
+        self._map = None
+        self._dictionary = {}
+        self._dictionary_file = None
+
+    def _open(self, day):
+        self.close()
+        path = os.path.join(self.directory, chunk_name(day))
+        if not os.path.exists(path):
+            self._create(path, CAPACITY)
+
+        self._day = day
+        self._path = path
+        self._file = open(path, "r+b")
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        magic, version, self._count, self._capacity, self._first, self._last = (
+            HEADER.unpack_from(self._map)
+        )
+        self._offsets, size = _column_offsets(self._capacity)
+
+        self._dictionary = {}
+        if os.path.exists(path + DICTIONARY_SUFFIX):
+            with open(path + DICTIONARY_SUFFIX) as file:
+                for line in file:
+                    if line.strip():
+                        self._dictionary[json.loads(line)] = len(self._dictionary)
+        self._dictionary_file = open(path + DICTIONARY_SUFFIX, "a")
+
+    def _create(self, path, capacity):
+        offsets, size = _column_offsets(capacity)
+        with open(path + ".tmp", "wb") as file:
+            file.truncate(size)
+            file.write(HEADER.pack(MAGIC, VERSION, 0, capacity, 0.0, 0.0))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(path + ".tmp", path)
+
+    def _grow(self):
+        """
+        Rewrites the current chunk with twice the capacity.
+        """
+        capacity = self._capacity * 2
+        offsets, size = _column_offsets(capacity)
+        with open(self._path + ".tmp", "wb") as file:
+            file.truncate(size)
+            file.write(
+                HEADER.pack(MAGIC, VERSION, self._count, capacity, self._first, self._last)
+            )
+            for name, typecode, label in COLUMNS:
+                start = self._offsets[name]
+                length = struct.calcsize(typecode) * self._count
+                file.seek(offsets[name])
+                file.write(self._map[start : start + length])
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(self._path + ".tmp", self._path)
+        self._open(self._day)
+
+    def _encode(self, value):
+        value = str(value)
+        code = self._dictionary.get(value)
+        if code is None:
+            code = len(self._dictionary)
+            self._dictionary[value] = code
+            self._dictionary_file.write(json.dumps(value) + "\n")
+            self._dictionary_file.flush()
+            os.fsync(self._dictionary_file.fileno())
+        return code
+
+    def append(self, record):
+        """
+        Appends a record given as a dictionary keyed by the COLUMN_NAMES. The
+        time is a local datetime and decides which chunk it is stored in.
+        """
+        day = record["time"].date()
+        if day != self._day:
+            self._open(day)
+        if self._count >= self._capacity:
+            self._grow()
+
+        row = self._count
+        timestamp = record["time"].timestamp()
+        for name, typecode, label in COLUMNS:
+            if name == "time":
+                value = timestamp
+            elif typecode == "H":
+                value = self._encode(record[name])
+            else:
+                value = record[name]
+            struct.pack_into(
+                "<" + typecode,
+                self._map,
+                self._offsets[name] + row * struct.calcsize(typecode),
+                value,
+            )
+
+        # Updating the header commits the record
+        self._count += 1
+        if row == 0:
+            self._first = timestamp
+        self._last = timestamp
+        HEADER.pack_into(
+            self._map,
+            0,
+            MAGIC,
+            VERSION,
+            self._count,
+            self._capacity,
+            self._first,
+            self._last,
+        )
+        self._map.flush()
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._file.close()
+            self._dictionary_file.close()
+            self._map = None
+            self._day = None
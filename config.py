@@ -0,0 +1,168 @@
+# Config
+#
+# Loads the weather station's settings from an INI file so the intervals,
+# thresholds, calibration and paths can be changed without editing the code.
+#
+# Every setting has a default in DEFAULTS, and the file only needs to hold the
+# settings that differ from them. The value in the file is converted to the
+# type of the default. An unknown section or setting is an error so a typo
+# isn't silently ignored. See weather_station.ini for the settings and what
+# they do.
+#
+# Example:
+#
+#   settings = config.load("weather_station.ini")
+#   print(settings.intervals.log_interval)
+#
+# Daniel Hornberger
+# 2021
+
+import configparser
+import os
+import types
+
+DEFAULT_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "weather_station.ini"
+)
+
+DEFAULTS = {
+    "intervals": {
+        # How often the sensor readings are logged in seconds
+        "log_interval": 900,
+        # How often readings are taken to form the logged averages in seconds
+        "accumulation_interval": 10,
+        # Sample the BME280 sensor every this many accumulation ticks
+        "bme280_sample_ticks": 1,
+    },
+    "camera": {
+        "enabled": True,
+        # Images darker than this average brightness (0 - 255) aren't saved
+        "brightness_threshold": 10,
+        "width": 1024,
+        "height": 1024,
+        "brightness": 50,
+        "rotation": 90,
+        # How long to wait for a picture before logging the record without it
+        "timeout": 30.0,
+        # The bytes the images may use and the bytes left free on the disk
+        "storage_budget": 16000000000,
+        "min_free_space": 1000000000,
+    },
+    "calibration": {
+        # Added to the barometer reading for the station's elevation in mbar
+        "pressure_offset": 152.2826,
+        # The station's elevation in meters for the sea level pressure. If 0,
+        # the pressure_offset is taken to correct the pressure to sea level.
+        "elevation": 0.0,
+        "fahrenheit": True,
+        "bme280_oversampling": 4,
+        "anemometer_radius_cm": 9.0,
+        "wind_calibration": 2.3589722140805094,
+        # Inches of rain per bucket tip
+        "rain_bucket_size": 0.011,
+    },
+    "pins": {
+        # BCM pins the anemometer and rain gauge switches are connected to
+        "wind_speed": 5,
+        "rain": 6,
+    },
+    "paths": {
+        # Write everything here instead of choosing a location automatically
+        "data_directory": "",
+        # The external storage device and where it's mounted
+        "external_device": "/dev/sda1",
+        "external_directory": "/mnt/usb1",
+        # Used when the external storage device isn't connected
+        "internal_directory": "/home/pi/WeatherStation/data",
+        "internal_log_directory": "/home/pi/WeatherStation/logs",
+    },
+    "database": {
+        "url": "http://localhost:8086",
+        # The database must already exist
+        "name": "weather",
+        "measurement": "weather",
+        "location": "backyard",
+    },
+    "ingest": {
+        # The url of a central ingest server (see ingest_server.py) the
+        # records are also sent to. Leave empty to only use the local database.
+        "url": "",
+        # The name the station is known by. Defaults to the location.
+        "station": "",
+    },
+    "live": {
+        # Serve the current conditions over HTTP (see live_api.py)
+        "enabled": True,
+        "host": "0.0.0.0",
+        "port": 8090,
+        # How many of the latest samples and records are kept in memory
+        "capacity": 512,
+    },
+    "profiler": {
+        # Allow profiling to be switched on by a signal or the control file
+        # (see profiler.py)
+        "enabled": True,
+        # Samples of the stacks per second
+        "rate": 100,
+        # Profiling stops by itself after this many seconds
+        "max_duration": 600.0,
+        "max_file_size": 1000000,
+        "max_files": 10,
+        # Profiling runs while this file exists. Relative to the data
+        # directory. Leave empty to only use the signal.
+        "control_file": "profile.on",
+    },
+    "startup": {
+        # How long to wait before trying to start a failed subsystem again
+        "retry_interval": 300.0,
+    },
+}
+
+
+def _convert(section, name, text, default):
+    try:
+        if isinstance(default, bool):
+            return configparser.ConfigParser.BOOLEAN_STATES[text.strip().lower()]
+        if isinstance(default, int):
+            return int(text)
+        if isinstance(default, float):
+            return float(text)
+    except (KeyError, ValueError):
+        raise ValueError(
+            f"[{section}] {name} = {text} is not a valid {type(default).__name__}"
+        )
+    return text.strip()
+
+
+def load(path=None):
+    """
+    Returns the settings as a namespace per section, using the defaults for
+    anything the file at path doesn't set. A missing file at the default path
+    uses all of the defaults, but a missing file that was asked for is an
+    error.
+    """
+    settings = {section: dict(values) for section, values in DEFAULTS.items()}
+
+    parser = configparser.ConfigParser(interpolation=None)
+    if path is not None:
+        with open(path) as file:
+            parser.read_file(file)
+    elif os.path.exists(DEFAULT_PATH):
+        parser.read(DEFAULT_PATH)
+
+    for section in parser.sections():
+        if section not in settings:
+            raise ValueError(f"Unknown config section [{section}]")
+        for name, text in parser.items(section):
+            if name not in settings[section]:
+                raise ValueError(f"Unknown config setting [{section}] {name}")
+            settings[section][name] = _convert(
+                section, name, text, DEFAULTS[section][name]
+            )
+
+    return types.SimpleNamespace(
+        **{
+            section: types.SimpleNamespace(**values)
+            for section, values in settings.items()
+        }
+    )
@@ -0,0 +1,574 @@
+# Derived
+#
+# Calculates the quantities derived from the logged readings so the graphs,
+# the live API and the tools don't each have to work them out themselves:
+#
+# dew_point         - The temperature the air would have to cool to for dew
+#                     to form (the Magnus formula).
+# heat_index        - How hot it feels when humidity is added to heat (the
+#                     National Weather Service's regression). The temperature
+#                     itself below 80 F.
+# wind_chill        - How cold it feels when the wind is added to cold (the
+#                     2001 National Weather Service formula). The temperature
+#                     itself above 50 F or below 3 MPH.
+# feels_like        - The wind chill when it's cold and windy, the heat index
+#                     when it's hot, or else the temperature.
+# pressure_tendency - How much the pressure changed over the last 3 hours in
+#                     mbar, along with the Met Office's description of it
+#                     (such as "falling slowly").
+# sea_level_pressure - The pressure reduced to sea level. If the elevation
+#                     isn't set, the pressure_offset calibration already does
+#                     this and the logged pressure is used.
+#
+# They're calculated two ways that give the same results. DerivedEngine
+# calculates them for each record as it's logged, keeping the last few hours
+# of pressures for the tendency. It's plain Python so the station doesn't need
+# NumPy. DerivedCache calculates them with NumPy for the records in the
+# columnar store (see columnar_store.py), a day chunk at a time, and keeps the
+# results for each chunk so asking for the same days again doesn't calculate
+# them again. A chunk is only calculated again once records have been added to
+# it.
+#
+# The temperatures are in the unit the station logs (Fahrenheit unless the
+# fahrenheit calibration is off), the wind speed in MPH and the pressure in
+# mbar.
+#
+# Example:
+#
+#   engine = DerivedEngine()
+#   engine.add(time.time(), temperature=30.0, humidity=60.0, pressure=1012.0,
+#              wind_speed=15.0)
+#   # {"wind_chill": 19.0, "dew_point": 17.8, "heat_index": 30.0, ...}
+#
+# Daniel Hornberger
+# 2021
+
+import collections
+import datetime
+import math
+import os
+
+import columnar_store
+
+# The pressure tendency is the change over this long
+TENDENCY_PERIOD = 10800  # Seconds
+
+# The earlier pressure is only used if it was logged within this long of the
+# start of the period
+TENDENCY_TOLERANCE = 1800  # Seconds
+
+# The Met Office's descriptions of the change in pressure over 3 hours. Each
+# applies to a change smaller than its limit in mbar.
+TENDENCY_DESCRIPTIONS = [
+    (0.1, "steady"),
+    (1.6, "{} slowly"),
+    (3.6, "{}"),
+    (6.1, "{} quickly"),
+    (math.inf, "{} very rapidly"),
+]
+
+# The station logs this when the BME280 sensor couldn't be read
+MISSING_VALUE = -1000.0
+
+# The Magnus formula's constants for Celsius (Alduchov and Eskridge, 1996)
+MAGNUS_A = 17.625
+MAGNUS_B = 243.04
+
+# The standard atmosphere's lapse rate (K/m) and the barometric exponent
+LAPSE_RATE = 0.0065
+BAROMETRIC_EXPONENT = 5.257
+
+# The most chunks DerivedCache keeps the results of. A day is a few KB.
+MAX_CHUNKS = 400
+
+# The derived quantities and their labels in the database, with (F) replaced
+# by (C) if the station logs Celsius
+LABELS = {
+    "dew_point": "Dew Point (F)",
+    "heat_index": "Heat Index (F)",
+    "wind_chill": "Wind Chill (F)",
+    "feels_like": "Feels Like (F)",
+    "pressure_tendency": "Pressure Tendency (mbar/3h)",
+    "pressure_tendency_string": "Pressure Tendency (String)",
+    "sea_level_pressure": "Sea Level Pressure (mbar)",
+}
+NAMES = list(LABELS)
+NUMERIC_NAMES = [name for name in NAMES if name != "pressure_tendency_string"]
+
+
+###############################################################################
+# Formulas
+###############################################################################
+
+# These only use arithmetic so they work on numbers and NumPy arrays alike. The
+# temperatures are in Fahrenheit.
+
+
+def _to_fahrenheit(temperature):
+    return temperature * 9 / 5 + 32
+
+
+def _from_fahrenheit(temperature):
+    return (temperature - 32) * 5 / 9
+
+
+def _magnus(celsius, humidity, log):
+    return log(humidity / 100) + MAGNUS_A * celsius / (MAGNUS_B + celsius)
+
+
+def _dew_point(celsius, gamma):
+    return MAGNUS_B * gamma / (MAGNUS_A - gamma)
+
+
+def _heat_index_simple(temperature, humidity):
+    return 0.5 * (temperature + 61.0 + (temperature - 68.0) * 1.2 + humidity * 0.094)
+
+
+def _rothfusz(temperature, humidity):
+    t = temperature
+    rh = humidity
+    return (
+        -42.379
+        + 2.04901523 * t
+        + 10.14333127 * rh
+        - 0.22475541 * t * rh
+        - 0.00683783 * t * t
+        - 0.05481717 * rh * rh
+        + 0.00122874 * t * t * rh
+        + 0.00085282 * t * rh * rh
+        - 0.00000199 * t * t * rh * rh
+    )
+
+
+def _dry_adjustment(temperature, humidity):
+    return (13 - humidity) / 4 * ((17 - abs(temperature - 95)) / 17) ** 0.5
+
+
+def _humid_adjustment(temperature, humidity):
+    return (humidity - 85) / 10 * ((87 - temperature) / 5)
+
+
+def _wind_chill(temperature, wind_speed):
+    v = wind_speed ** 0.16
+    return 35.74 + 0.6215 * temperature - 35.75 * v + 0.4275 * temperature * v
+
+
+def _sea_level(pressure, celsius, elevation):
+    return pressure * (
+        1 - LAPSE_RATE * elevation / (celsius + LAPSE_RATE * elevation + 273.15)
+    ) ** -BAROMETRIC_EXPONENT
+
+
+def tendency_description(change):
+    """
+    Returns the Met Office's description of a change in pressure over 3 hours
+    in mbar, such as "rising slowly".
+    """
+    magnitude = abs(change)
+    for limit, description in TENDENCY_DESCRIPTIONS:
+        if magnitude < limit:
+            return description.format("rising" if change > 0 else "falling")
+
+
+###############################################################################
+# Record by Record
+###############################################################################
+
+
+def dew_point(temperature, humidity, fahrenheit=True):
+    if humidity <= 0:
+        return math.nan
+    celsius = _from_fahrenheit(temperature) if fahrenheit else temperature
+    dew_point = _dew_point(celsius, _magnus(celsius, min(humidity, 100), math.log))
+    return _to_fahrenheit(dew_point) if fahrenheit else dew_point
+
+
+def heat_index(temperature, humidity, fahrenheit=True):
+    t = temperature if fahrenheit else _to_fahrenheit(temperature)
+    if t < 80:
+        return temperature
+    index = _heat_index_simple(t, humidity)
+    if (index + t) / 2 >= 80:
+        index = _rothfusz(t, humidity)
+        if humidity < 13 and t <= 112:
+            index -= _dry_adjustment(t, humidity)
+        elif humidity > 85 and t <= 87:
+            index += _humid_adjustment(t, humidity)
+    return index if fahrenheit else _from_fahrenheit(index)
+
+
+def wind_chill(temperature, wind_speed, fahrenheit=True):
+    t = temperature if fahrenheit else _to_fahrenheit(temperature)
+    if t > 50 or wind_speed < 3:
+        return temperature
+    chill = _wind_chill(t, wind_speed)
+    return chill if fahrenheit else _from_fahrenheit(chill)
+
+
+def feels_like(temperature, humidity, wind_speed, fahrenheit=True):
+    t = temperature if fahrenheit else _to_fahrenheit(temperature)
+    if t <= 50 and wind_speed >= 3:
+        return wind_chill(temperature, wind_speed, fahrenheit)
+    if t >= 80:
+        return heat_index(temperature, humidity, fahrenheit)
+    return temperature
+
+
+def sea_level_pressure(
+    pressure, temperature, elevation=0.0, pressure_offset=0.0, fahrenheit=True
+):
+    """
+    Returns the pressure reduced to sea level from the station's elevation in
+    meters. The pressure_offset the pressure was calibrated with is removed
+    first. With no elevation the calibrated pressure is returned.
+    """
+    if not elevation:
+        return pressure
+    celsius = _from_fahrenheit(temperature) if fahrenheit else temperature
+    return _sea_level(pressure - pressure_offset, celsius, elevation)
+
+
+class DerivedEngine:
+    """
+    Calculates the derived quantities of each record as it's logged. The
+    pressures of the last TENDENCY_PERIOD are kept for the tendency, so the
+    records must be added in time order.
+    """
+
+    def __init__(self, fahrenheit=True, elevation=0.0, pressure_offset=0.0):
+        self.fahrenheit = fahrenheit
+        self.elevation = elevation
+        self.pressure_offset = pressure_offset
+        # The (time, pressure) of the recent records, oldest first
+        self._pressures = collections.deque()
+
+    def pressure_tendency(self, time, pressure):
+        """
+        Adds the pressure at the time in epoch seconds and returns the change
+        since TENDENCY_PERIOD earlier, or None if there's no pressure from
+        then.
+        """
+        pressures = self._pressures
+        pressures.append((time, pressure))
+        start = time - TENDENCY_PERIOD
+        # Keep the last pressure from before the start of the period
+        while len(pressures) > 1 and pressures[1][0] <= start:
+            pressures.popleft()
+        earlier_time, earlier = pressures[0]
+        if earlier_time > start or start - earlier_time > TENDENCY_TOLERANCE:
+            return None
+        return pressure - earlier
+
+    def seed(self, directory, time):
+        """
+        Adds the pressures logged in the TENDENCY_PERIOD before the time to the
+        columnar directory, so the tendency is known right after a restart.
+        """
+        start = time - TENDENCY_PERIOD - TENDENCY_TOLERANCE
+        end_day = datetime.date.fromtimestamp(time)
+        start_day = datetime.date.fromtimestamp(start)
+        for day in columnar_store.days_between(start_day, end_day):
+            path = os.path.join(directory, columnar_store.chunk_name(day))
+            if not os.path.exists(path):
+                continue
+            chunk = columnar_store.Chunk(path)
+            times = chunk.column("time")
+            pressures = chunk.column("pressure")
+            for logged, pressure in zip(times, pressures):
+                if start <= logged < time and pressure != MISSING_VALUE:
+                    self.pressure_tendency(float(logged), float(pressure))
+            del times, pressures
+            chunk.close()
+
+    def add(self, time, temperature, humidity, pressure, wind_speed):
+        """
+        Returns the derived quantities of a record logged at the time in epoch
+        seconds, rounded like the readings. The ones that depend on a missing
+        reading are left out.
+        """
+        derived = {}
+        have_temperature = temperature != MISSING_VALUE
+        have_humidity = humidity != MISSING_VALUE
+        have_pressure = pressure != MISSING_VALUE
+
+        if have_temperature:
+            fahrenheit = self.fahrenheit
+            derived["wind_chill"] = round(
+                wind_chill(temperature, wind_speed, fahrenheit), 1
+            )
+            if have_humidity:
+                value = dew_point(temperature, humidity, fahrenheit)
+                if not math.isnan(value):
+                    derived["dew_point"] = round(value, 1)
+                derived["heat_index"] = round(
+                    heat_index(temperature, humidity, fahrenheit), 1
+                )
+                derived["feels_like"] = round(
+                    feels_like(temperature, humidity, wind_speed, fahrenheit), 1
+                )
+            if have_pressure:
+                derived["sea_level_pressure"] = round(
+                    sea_level_pressure(
+                        pressure,
+                        temperature,
+                        self.elevation,
+                        self.pressure_offset,
+                        fahrenheit,
+                    ),
+                    1,
+                )
+
+        if have_pressure:
+            change = self.pressure_tendency(time, pressure)
+            if change is not None:
+                derived["pressure_tendency"] = round(change, 1)
+                derived["pressure_tendency_string"] = tendency_description(change)
+        return derived
+
+    def labels(self):
+        """
+        Returns the database label of each derived quantity.
+        """
+        if self.fahrenheit:
+            return dict(LABELS)
+        return {name: label.replace("(F)", "(C)") for name, label in LABELS.items()}
+
+
+###############################################################################
+# Arrays
+###############################################################################
+
+
+def derive_arrays(
+    times,
+    temperature,
+    humidity,
+    pressure,
+    wind_speed,
+    fahrenheit=True,
+    elevation=0.0,
+    pressure_offset=0.0,
+    tendency_times=None,
+    tendency_pressures=None,
+):
+    """
+    Returns a dictionary of NumPy arrays of the numeric derived quantities
+    for arrays of the readings, with NaN where a reading was missing. The
+    times must be in order. The tendency of the first records uses the
+    earlier pressures in tendency_times and tendency_pressures if they're
+    given (such as the end of the previous day). The descriptions of the
+    tendency are left to tendency_description().
+    """
+    np = columnar_store._numpy()
+    if np is None:
+        raise ImportError("NumPy is required to derive the quantities of arrays")
+
+    times = np.asarray(times, dtype=np.float64)
+    t = np.asarray(temperature, dtype=np.float64)
+    rh = np.asarray(humidity, dtype=np.float64)
+    p = np.asarray(pressure, dtype=np.float64)
+    v = np.asarray(wind_speed, dtype=np.float64)
+    t = np.where(t == MISSING_VALUE, np.nan, t)
+    rh = np.where(rh == MISSING_VALUE, np.nan, rh)
+    p = np.where(p == MISSING_VALUE, np.nan, p)
+
+    f = t if fahrenheit else _to_fahrenheit(t)
+    c = _from_fahrenheit(t) if fahrenheit else t
+
+    def output(values):
+        return values if fahrenheit else _from_fahrenheit(values)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        gamma = _magnus(c, np.minimum(rh, 100), np.log)
+        dew = _dew_point(c, gamma)
+        dew = np.where(rh > 0, _to_fahrenheit(dew) if fahrenheit else dew, np.nan)
+
+        simple = _heat_index_simple(f, rh)
+        index = _rothfusz(f, rh)
+        dry = (rh < 13) & (f <= 112)
+        humid = (rh > 85) & (f <= 87)
+        index = np.where(dry, index - _dry_adjustment(f, rh), index)
+        index = np.where(humid & ~dry, index + _humid_adjustment(f, rh), index)
+        index = np.where((simple + f) / 2 >= 80, index, simple)
+        heat = np.where(f < 80, f, index)
+        heat = np.where(np.isnan(rh), np.nan, heat)
+
+        cold = (f <= 50) & (v >= 3)
+        chill = np.where(cold, _wind_chill(f, np.maximum(v, 0)), f)
+
+        feels = np.where(cold, chill, np.where(f >= 80, heat, f))
+        feels = np.where(np.isnan(rh), np.nan, feels)
+
+        if elevation:
+            sea_level = _sea_level(p - pressure_offset, c, elevation)
+        else:
+            sea_level = p
+
+    # The pressure from TENDENCY_PERIOD earlier is the last one logged at or
+    # before then
+    valid = ~np.isnan(p)
+    history_times = times[valid]
+    history = p[valid]
+    if tendency_times is not None and len(tendency_times):
+        earlier_times = np.asarray(tendency_times, dtype=np.float64)
+        earlier = np.asarray(tendency_pressures, dtype=np.float64)
+        keep = earlier != MISSING_VALUE
+        history_times = np.concatenate([earlier_times[keep], history_times])
+        history = np.concatenate([earlier[keep], history])
+    start = times - TENDENCY_PERIOD
+    index = np.searchsorted(history_times, start, side="right") - 1
+    found = index >= 0
+    index = np.maximum(index, 0)
+    tendency = np.full(len(times), np.nan)
+    if len(history):
+        found &= start - history_times[index] <= TENDENCY_TOLERANCE
+        tendency = np.where(found & valid, p - history[index], np.nan)
+
+    return {
+        "dew_point": dew,
+        "heat_index": output(heat),
+        "wind_chill": output(chill),
+        "feels_like": output(feels),
+        "pressure_tendency": tendency,
+        "sea_level_pressure": sea_level,
+    }
+
+
+class DerivedCache:
+    """
+    Calculates the derived quantities of the records in a columnar directory
+    a day chunk at a time with NumPy, and keeps the results of the most
+    recently used max_chunks chunks. A chunk is calculated again if records
+    were added to it or the day before it since it was last calculated.
+    """
+
+    def __init__(
+        self,
+        directory,
+        fahrenheit=True,
+        elevation=0.0,
+        pressure_offset=0.0,
+        max_chunks=MAX_CHUNKS,
+    ):
+        self.directory = directory
+        self.fahrenheit = fahrenheit
+        self.elevation = elevation
+        self.pressure_offset = pressure_offset
+        self.max_chunks = max_chunks
+        self.hits = 0
+        self.misses = 0
+        # The chunk results by day in the order they were used
+        self._chunks = collections.OrderedDict()
+
+    @classmethod
+    def from_settings(cls, directory, calibration):
+        """
+        Returns a cache using the [calibration] settings (see config.py).
+        """
+        return cls(
+            directory,
+            calibration.fahrenheit,
+            calibration.elevation,
+            calibration.pressure_offset,
+        )
+
+    def _count(self, day):
+        path = os.path.join(self.directory, columnar_store.chunk_name(day))
+        if not os.path.exists(path):
+            return 0
+        chunk = columnar_store.Chunk(path)
+        count = chunk.count
+        chunk.close()
+        return count
+
+    def chunk(self, day):
+        """
+        Returns a dictionary of NumPy arrays holding the time and the numeric
+        derived quantities of the records of the day, or None if the day has
+        no records.
+        """
+        path = os.path.join(self.directory, columnar_store.chunk_name(day))
+        if not os.path.exists(path):
+            return None
+        chunk = columnar_store.Chunk(path)
+        previous_day = day - datetime.timedelta(days=1)
+        key = (chunk.count, self._count(previous_day))
+
+        cached = self._chunks.get(day)
+        if cached is not None and cached[0] == key:
+            chunk.close()
+            self._chunks.move_to_end(day)
+            self.hits += 1
+            return cached[1]
+        self.misses += 1
+
+        if not chunk.count:
+            chunk.close()
+            return None
+        columns = {
+            name: chunk.column(name).copy()
+            for name in ["time", "temperature", "humidity", "pressure", "wind_speed"]
+        }
+        chunk.close()
+        tendency_times, tendency_pressures = self._tail(
+            previous_day, columns["time"][0] - TENDENCY_PERIOD - TENDENCY_TOLERANCE
+        )
+        result = derive_arrays(
+            columns["time"],
+            columns["temperature"],
+            columns["humidity"],
+            columns["pressure"],
+            columns["wind_speed"],
+            self.fahrenheit,
+            self.elevation,
+            self.pressure_offset,
+            tendency_times,
+            tendency_pressures,
+        )
+        result["time"] = columns["time"]
+
+        self._chunks[day] = (key, result)
+        self._chunks.move_to_end(day)
+        while len(self._chunks) > self.max_chunks:
+            self._chunks.popitem(last=False)
+        return result
+
+    def _tail(self, day, start_time):
+        """
+        Returns the times and pressures of the day's records from start_time
+        on, for the tendency of the records early the next day.
+        """
+        path = os.path.join(self.directory, columnar_store.chunk_name(day))
+        if not os.path.exists(path):
+            return None, None
+        chunk = columnar_store.Chunk(path)
+        times = chunk.column("time")
+        keep = times >= start_time
+        result = times[keep].copy(), chunk.column("pressure")[keep].copy()
+        del times, keep
+        chunk.close()
+        return result
+
+    def query(self, start, end, names=NUMERIC_NAMES):
+        """
+        Returns a dictionary of NumPy arrays holding the time and the derived
+        quantities of the records from the datetime start up to end.
+        """
+        np = columnar_store._numpy()
+        if np is None:
+            raise ImportError("NumPy is required to query the derived quantities")
+
+        start_time = start.timestamp()
+        end_time = end.timestamp()
+        parts = {name: [] for name in ["time"] + list(names)}
+        for day in columnar_store.days_between(start.date(), end.date()):
+            result = self.chunk(day)
+            if result is None:
+                continue
+            mask = (result["time"] >= start_time) & (result["time"] < end_time)
+            for name in parts:
+                parts[name].append(result[name][mask])
+        return {
+            name: np.concatenate(values) if values else np.empty(0)
+            for name, values in parts.items()
+        }
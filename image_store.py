@@ -0,0 +1,326 @@
+# Image Store
+#
+# Keeps track of the pictures taken by the station and removes old ones so the
+# camera can keep taking pictures indefinitely without filling the disk.
+#
+# Every stored image is listed in an index (name, size, time and brightness)
+# kept in memory and in an append only index file in the image directory, so
+# the directory doesn't have to be scanned to find the oldest images. Two
+# limits are enforced whenever an image is added:
+#
+# * The images can't use more than a budget of bytes.
+# * The disk must keep a minimum amount of free space.
+#
+# Images older than THIN_AFTER are thinned to one per THIN_INTERVAL (one per
+# hour by default) and if the limits are still exceeded the oldest images are
+# removed. The free space of the disk is measured when the store is opened and
+# then tracked as images are added and removed. It is measured again every
+# RESYNC_INTERVAL to account for the other files written to the disk.
+#
+# The images are saved in a directory per day (YYYY-MM-DD/). The USB drives
+# are formatted with FAT32, which can only hold about 21844 files with long
+# names in a single directory.
+#
+# Daniel Hornberger
+# 2021
+
+import collections
+import datetime
+import json
+import os
+import shutil
+import threading
+import time
+
+import logger as logging
+
+INDEX_FILE = "index.jsonl"
+IMAGE_EXTENSIONS = (".jpeg", ".jpg", ".png")
+NAME_TIME_FORMAT = "%Y-%m-%d_%H-%M-%S"
+
+# Images older than this are thinned to one per THIN_INTERVAL
+THIN_AFTER = datetime.timedelta(days=30)
+THIN_INTERVAL = datetime.timedelta(hours=1)
+
+# How often the free space of the disk is measured
+RESYNC_INTERVAL = 3600  # Seconds
+
+# An image is a namedtuple with its name relative to the image directory, its
+# size in bytes, its time as a datetime and its brightness (None if unknown)
+Image = collections.namedtuple("Image", ["name", "size", "time", "brightness"])
+
+
+def _image_time(name, path):
+    """
+    Returns the time of an image from its name, or the modification time of
+    the file if the name isn't a time.
+    """
+    stem = os.path.splitext(os.path.basename(name))[0]
+    try:
+        return datetime.datetime.strptime(stem, NAME_TIME_FORMAT)
+    except ValueError:
+        return datetime.datetime.fromtimestamp(os.path.getmtime(path))
+
+
+class ImageStore:
+    """
+    Stores the images in directory, using at most budget bytes (None for no
+    limit) and leaving at least min_free bytes free on the disk.
+    """
+
+    def __init__(
+        self,
+        directory,
+        budget=None,
+        min_free=0,
+        thin_after=THIN_AFTER,
+        thin_interval=THIN_INTERVAL,
+    ):
+        self.directory = directory
+        self.budget = budget
+        self.min_free = min_free
+        self.thin_after = thin_after
+        self.thin_interval = thin_interval
+        self.total_size = 0
+        self.images_removed = 0
+
+        # Both are in time order. The images in _thinned have already been
+        # thinned to one per thin_interval.
+        self._recent = collections.deque()
+        self._thinned = collections.deque()
+
+        self._lock = threading.Lock()
+        self._index = None
+        self._index_entries = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+        self._measure_free()
+
+    def __len__(self):
+        return len(self._recent) + len(self._thinned)
+
+    ###########################################################################
+    # Index
+    ###########################################################################
+
+    def _load(self):
+        """
+        Reads the index and reconciles it with the image files on the disk.
+        This is the only time the image directories are scanned.
+        """
+        indexed = {}
+        index_path = os.path.join(self.directory, INDEX_FILE)
+        if os.path.exists(index_path):
+            with open(index_path) as file:
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # The last line may be torn by a power loss
+                        continue
+                    if "remove" in entry:
+                        indexed.pop(entry["remove"], None)
+                    else:
+                        indexed[entry["name"]] = entry
+
+        images = []
+        for directory, subdirectories, files in os.walk(self.directory):
+            for file_name in files:
+                if not file_name.lower().endswith(IMAGE_EXTENSIONS):
+                    continue
+                path = os.path.join(directory, file_name)
+                name = os.path.relpath(path, self.directory).replace(os.sep, "/")
+                entry = indexed.get(name)
+                if entry is not None:
+                    time_taken = datetime.datetime.fromisoformat(entry["time"])
+                    brightness = entry["brightness"]
+                else:
+                    time_taken = _image_time(name, path)
+                    brightness = None
+                images.append(
+                    Image(name, os.path.getsize(path), time_taken, brightness)
+                )
+
+        images.sort(key=lambda image: image.time)
+        self._recent.extend(images)
+        self.total_size = sum(image.size for image in images)
+        self._rewrite_index()
+
+        logging.log(
+            f"Image store: {len(images)} images using {self.total_size} bytes in {self.directory}"
+        )
+
+    def _rewrite_index(self):
+        """
+        Replaces the index file with one listing only the current images.
+        """
+        if self._index is not None:
+            self._index.close()
+        index_path = os.path.join(self.directory, INDEX_FILE)
+        with open(index_path + ".tmp", "w") as file:
+            for image in list(self._thinned) + list(self._recent):
+                file.write(self._entry(image))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(index_path + ".tmp", index_path)
+        self._index = open(index_path, "a")
+        self._index_entries = len(self)
+
+    @staticmethod
+    def _entry(image):
+        return (
+            json.dumps(
+                {
+                    "name": image.name,
+                    "size": image.size,
+                    "time": image.time.isoformat(),
+                    "brightness": image.brightness,
+                }
+            )
+            + "\n"
+        )
+
+    def _append_index(self, lines):
+        self._index.write("".join(lines))
+        self._index.flush()
+        self._index_entries += len(lines)
+        # Compact the index once most of its entries are removals
+        if self._index_entries > 2 * len(self) + 1000:
+            self._rewrite_index()
+
+    ###########################################################################
+    # Free space
+    ###########################################################################
+
+    def _measure_free(self):
+        self.free = shutil.disk_usage(self.directory).free
+        self._measured = time.monotonic()
+
+    def free_space(self):
+        """
+        Returns the estimated free space of the disk in bytes.
+        """
+        if time.monotonic() - self._measured > RESYNC_INTERVAL:
+            self._measure_free()
+        return self.free
+
+    def has_room(self, size=0):
+        """
+        Returns whether an image of the given size can be stored, which is
+        only False when removing every image wouldn't leave enough free space.
+        """
+        with self._lock:
+            reclaimable = self.free_space() + self.total_size
+            return reclaimable - size >= self.min_free
+
+    ###########################################################################
+    # Storing images
+    ###########################################################################
+
+    def path(self, time_taken, extension=".jpeg"):
+        """
+        Returns the name (relative to the image directory) and the full path
+        for an image taken at the given time, creating its directory.
+        """
+        name = f"{time_taken.strftime('%Y-%m-%d')}/{time_taken.strftime(NAME_TIME_FORMAT)}{extension}"
+        path = os.path.join(self.directory, *name.split("/"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return name, path
+
+    def save(self, data, time_taken, brightness=None, extension=".jpeg"):
+        """
+        Writes an encoded image to the store, making room for it first.
+        Returns its name relative to the image directory.
+        """
+        name, path = self.path(time_taken, extension)
+        with self._lock:
+            self._make_room(len(data), time_taken)
+        with open(path, "wb") as file:
+            file.write(data)
+        self.add(name, len(data), time_taken, brightness)
+        return name
+
+    def add(self, name, size, time_taken, brightness=None):
+        """
+        Adds an image that has been written to the image directory to the
+        index and removes old images to keep the store within its limits.
+        """
+        image = Image(name, size, time_taken, brightness)
+        with self._lock:
+            self._recent.append(image)
+            self.total_size += size
+            self.free -= size
+            self._append_index([self._entry(image)])
+            self._make_room(0, time_taken)
+
+    def _make_room(self, size, now):
+        """
+        Thins the old images and removes the oldest ones until an image of
+        the given size fits within the limits.
+        """
+        removed = []
+
+        # Keep the first image of every interval once they are old enough
+        cutoff = now - self.thin_after
+        while self._recent and self._recent[0].time < cutoff:
+            image = self._recent.popleft()
+            if self._thinned and self._same_interval(self._thinned[-1], image):
+                self._remove_file(image)
+                removed.append(image)
+            else:
+                self._thinned.append(image)
+
+        self.free_space()
+        while len(self) and (
+            (self.budget is not None and self.total_size + size > self.budget)
+            or self.free - size < self.min_free
+        ):
+            oldest = self._thinned if self._thinned else self._recent
+            image = oldest.popleft()
+            self._remove_file(image)
+            removed.append(image)
+
+        if not removed:
+            return
+        self._append_index(
+            [json.dumps({"remove": image.name}) + "\n" for image in removed]
+        )
+        logging.log(f"Image store: removed {len(removed)} old images")
+
+    def _same_interval(self, first, second):
+        interval = self.thin_interval.total_seconds()
+        return (
+            first.time.timestamp() // interval == second.time.timestamp() // interval
+        )
+
+    def _remove_file(self, image):
+        path = os.path.join(self.directory, *image.name.split("/"))
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        self.total_size -= image.size
+        self.free += image.size
+        self.images_removed += 1
+
+        # Remove the day's directory once it's empty
+        directory = os.path.dirname(path)
+        if directory != self.directory:
+            try:
+                os.rmdir(directory)
+            except OSError:
+                pass
+
+    def images(self):
+        """
+        Returns a list of the stored images from oldest to newest.
+        """
+        with self._lock:
+            return list(self._thinned) + list(self._recent)
+
+    def close(self):
+        with self._lock:
+            if self._index is not None:
+                self._index.close()
+                self._index = None
@@ -1,10 +1,14 @@
 # Influx Backup
 #
 # This script automates the backup process for the Influx database.
-# It rotates a previous and a latest backup to prevent data loss if
-# the power goes out during a backup. This can be called by a cronjob.
+# Only the points added since the previous backup are exported by
+# influx_export.py and appended to the files in influxExport, so
+# each backup takes about the same amount of time. If the power goes
+# out during a backup, the incomplete export is discarded the next
+# time it runs. This can be called by a cronjob.
+#
+# The exports can be restored into a new database with:
+#   python3 influx_export.py restore $LOCAL_BACKUP_PATH/influxExport
 
 . /home/pi/WeatherStation/.env
-rm -rf $LOCAL_BACKUP_PATH/influxBackupPrev
-mv $LOCAL_BACKUP_PATH/influxBackupLatest $LOCAL_BACKUP_PATH/influxBackupPrev
-influxd backup -portable $LOCAL_BACKUP_PATH/influxBackupLatest
+python3 /home/pi/WeatherStation/influx_export.py export $LOCAL_BACKUP_PATH/influxExport
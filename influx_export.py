@@ -0,0 +1,354 @@
+# Influx Export
+#
+# Backs up the InfluxDB database incrementally, replacing full backups with
+# `influxd backup`.
+#
+# The exporter remembers the time of the newest point it has exported from
+# each measurement (the high-water mark) and each run only queries the points
+# newer than LOOKBACK before that. Points can be written long after their time,
+# such as when the station's write-ahead queue drains after the database was
+# unreachable, or when records are replayed or the rollups rebuilt, so the
+# lookback window is read again on every run. The exporter remembers a
+# checksum of each point it exported in the window and only exports the ones
+# that are new or changed, such as the open bucket of the hourly, daily and
+# monthly rollups (see rollup.py), which is rewritten with every record. When
+# the exports are restored, the later copy of a point replaces the earlier
+# one. Points written later than LOOKBACK after their time are only exported
+# by a run with a larger --lookback.
+#
+# The points are written as line protocol to a gzip compressed chunk file for
+# each month, export-YYYY-MM.lp.gz. Each run appends a new gzip member to the
+# end of the chunk, so the chunks are only ever appended to, which lets
+# sync_agent.py send only the new bytes. The size of the chunk after each
+# complete run is saved with the high-water marks in state.json, and anything
+# after it (from a run interrupted by a power loss) is removed on the next run,
+# even if that run starts the next month's chunk. When restoring, an
+# incomplete member at the end of a chunk is ignored.
+#
+# Examples:
+#
+# Export the new points:
+#   python3 influx_export.py export /mnt/usb1/influxExport
+#
+# Export the points written in the last 30 days after being queued during an
+# outage:
+#   python3 influx_export.py export /mnt/usb1/influxExport --lookback 30
+#
+# Restore every export into a new database:
+#   python3 influx_export.py restore /mnt/usb1/influxExport \
+#       --url http://localhost:8086 --database weather
+#
+# Daniel Hornberger
+# 2021
+
+import argparse
+import datetime
+import glob
+import gzip
+import json
+import os
+import urllib.parse
+import urllib.request
+import zlib
+
+from influx_writer import send_lines
+from influx_writer import to_line_protocol
+from influx_writer import write_url
+
+STATE_FILE = "state.json"
+CHUNK_PREFIX = "export-"
+CHUNK_SUFFIX = ".lp.gz"
+
+# The number of points requested from the database at a time
+QUERY_CHUNK_SIZE = 10000
+
+# The number of points written to the database at a time when restoring
+RESTORE_BATCH_SIZE = 5000
+
+# How far behind the high-water mark each run looks for points written late
+LOOKBACK = 2 * 24 * 60 * 60  # Seconds
+
+
+def chunk_name(day):
+    return f"{CHUNK_PREFIX}{day.strftime('%Y-%m')}{CHUNK_SUFFIX}"
+
+
+def _quote(name):
+    return '"' + name.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+class InfluxExporter:
+    """
+    Exports the points added to a database since the previous export into
+    the chunk files in directory.
+    """
+
+    def __init__(
+        self,
+        directory,
+        url="http://localhost:8086",
+        database="weather",
+        timeout=60.0,
+        lookback=LOOKBACK,
+    ):
+        self.directory = directory
+        self.url = url
+        self.database = database
+        self.timeout = timeout
+        self.lookback = int(lookback * 1000000000)
+        self.points_exported = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self.state = {"watermarks": {}, "chunk": None, "size": 0}
+        try:
+            with open(os.path.join(directory, STATE_FILE)) as file:
+                self.state = json.load(file)
+        except (OSError, ValueError):
+            pass
+        # The checksums of the points exported in the lookback window, by
+        # measurement and then by series and time
+        self.state.setdefault("recent", {})
+
+    def _save_state(self):
+        path = os.path.join(self.directory, STATE_FILE)
+        with open(path + ".tmp", "w") as file:
+            json.dump(self.state, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(path + ".tmp", path)
+
+    def _query(self, statement):
+        """
+        Yields the series of the results of a query. Large results are
+        returned by the database in chunks, one JSON object per line.
+        """
+        parameters = {
+            "db": self.database,
+            "q": statement,
+            "epoch": "ns",
+            "chunked": "true",
+            "chunk_size": QUERY_CHUNK_SIZE,
+        }
+        request = urllib.request.Request(
+            f"{self.url}/query?" + urllib.parse.urlencode(parameters)
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            for line in response:
+                if not line.strip():
+                    continue
+                for result in json.loads(line).get("results", []):
+                    if "error" in result:
+                        raise RuntimeError(result["error"])
+                    yield from result.get("series", [])
+
+    def _field_types(self, measurement):
+        types = {}
+        for series in self._query(f"SHOW FIELD KEYS FROM {_quote(measurement)}"):
+            for name, field_type in series["values"]:
+                types[name] = field_type
+        return types
+
+    def _lines(self, measurement):
+        """
+        Yields the new points of a measurement as line protocol.
+        """
+        types = self._field_types(measurement)
+        watermark = self.state["watermarks"].get(measurement)
+        recent = self.state["recent"].setdefault(measurement, {})
+        if watermark is None:
+            condition = ""
+        else:
+            condition = f" WHERE time > {watermark - self.lookback}"
+        statement = f"SELECT * FROM {_quote(measurement)}{condition} GROUP BY *"
+        for series in self._query(statement):
+            columns = series["columns"]
+            for values in series["values"]:
+                fields = {}
+                for name, value in zip(columns[1:], values[1:]):
+                    if value is None:
+                        continue
+                    field_type = types.get(name)
+                    if field_type == "integer":
+                        value = int(value)
+                    elif field_type == "float":
+                        value = float(value)
+                    fields[name] = value
+                if not fields:
+                    continue
+                point = {
+                    "measurement": measurement,
+                    "tags": {
+                        key: value
+                        for key, value in (series.get("tags") or {}).items()
+                        if value
+                    },
+                    "fields": fields,
+                }
+                time = values[0]
+                line = f"{to_line_protocol(point)} {time}\n"
+                # Skip the points that were already exported unchanged
+                key = " ".join(
+                    [str(time)] + [f"{k}={v}" for k, v in sorted(point["tags"].items())]
+                )
+                checksum = zlib.crc32(line.encode())
+                if recent.get(key) == checksum:
+                    continue
+                recent[key] = checksum
+                self.state["watermarks"][measurement] = max(
+                    self.state["watermarks"].get(measurement, 0), time
+                )
+                yield line
+
+        # Forget the points that have left the lookback window
+        cutoff = self.state["watermarks"].get(measurement, 0) - self.lookback
+        self.state["recent"][measurement] = {
+            key: checksum
+            for key, checksum in recent.items()
+            if int(key.split(" ", 1)[0]) > cutoff
+        }
+
+    def export(self, now=None):
+        """
+        Appends the points added since the previous export to the current
+        month's chunk. Returns the number of points exported.
+        """
+        now = now or datetime.datetime.now()
+        name = chunk_name(now)
+        path = os.path.join(self.directory, name)
+
+        # Remove anything written by an interrupted export, which may be in
+        # the previous month's chunk
+        previous = self.state["chunk"]
+        previous_path = os.path.join(self.directory, previous) if previous else None
+        if previous_path and os.path.exists(previous_path):
+            if os.path.getsize(previous_path) > self.state["size"]:
+                with open(previous_path, "r+b") as file:
+                    file.truncate(self.state["size"])
+        if previous != name and os.path.exists(path):
+            # The chunk was started but its first export never completed
+            os.remove(path)
+
+        measurements = [
+            values[0]
+            for series in self._query("SHOW MEASUREMENTS")
+            for values in series["values"]
+        ]
+
+        count = 0
+        with open(path, "ab") as file:
+            start = file.tell()
+            with gzip.GzipFile(fileobj=file, mode="wb") as member:
+                for measurement in measurements:
+                    for line in self._lines(measurement):
+                        member.write(line.encode())
+                        count += 1
+            if count == 0:
+                # Don't append empty members
+                file.truncate(start)
+            file.flush()
+            os.fsync(file.fileno())
+
+        self.state["chunk"] = name
+        self.state["size"] = os.path.getsize(path)
+        self._save_state()
+        self.points_exported += count
+        return count
+
+
+def chunk_files(directory):
+    """
+    Returns the paths of the chunk files in the order they were written.
+    """
+    return sorted(glob.glob(os.path.join(directory, CHUNK_PREFIX + "*" + CHUNK_SUFFIX)))
+
+
+def read_chunk(path, size=None):
+    """
+    Yields the lines of a chunk file, stopping at size bytes if given. The
+    gzip members are read one at a time, stopping at an incomplete one left
+    by an interrupted export.
+    """
+    with open(path, "rb") as file:
+        data = file.read() if size is None else file.read(size)
+    while data:
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        try:
+            member = decompressor.decompress(data)
+        except zlib.error:
+            member = None
+        if member is None or not decompressor.eof:
+            print(f"Ignored an incomplete export at the end of {path}")
+            return
+        for line in member.decode().splitlines():
+            if line:
+                yield line
+        data = decompressor.unused_data
+
+
+def restore(directory, url="http://localhost:8086", database="weather", timeout=60.0):
+    """
+    Writes every exported point into a database, creating it if needed.
+    Returns the number of points written.
+    """
+    request = urllib.request.Request(
+        f"{url}/query",
+        data=urllib.parse.urlencode({"q": f"CREATE DATABASE {_quote(database)}"}).encode(),
+        method="POST",
+    )
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        response.read()
+
+    state = {}
+    if os.path.exists(os.path.join(directory, STATE_FILE)):
+        with open(os.path.join(directory, STATE_FILE)) as file:
+            state = json.load(file)
+
+    destination = write_url(url, database)
+    count = 0
+    for path in chunk_files(directory):
+        # Ignore anything after the last complete export
+        size = state.get("size") if os.path.basename(path) == state.get("chunk") else None
+        batch = []
+        for line in read_chunk(path, size):
+            batch.append(line)
+            if len(batch) >= RESTORE_BATCH_SIZE:
+                send_lines(destination, batch, timeout=timeout)
+                count += len(batch)
+                batch = []
+        if batch:
+            send_lines(destination, batch, timeout=timeout)
+            count += len(batch)
+        print(f"Restored {path}")
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Incrementally export the InfluxDB database and restore the exports"
+    )
+    parser.add_argument("command", choices=["export", "restore"])
+    parser.add_argument("directory", help="Where the exports are kept")
+    parser.add_argument("--url", default="http://localhost:8086", help="The database url")
+    parser.add_argument("--database", default="weather", help="The database name")
+    parser.add_argument(
+        "--lookback",
+        type=float,
+        default=LOOKBACK / 86400,
+        help="How many days behind the newest exported points to look for points "
+        "written late (default: %(default)s)",
+    )
+    args = parser.parse_args(argv)
+
+    if args.command == "export":
+        exporter = InfluxExporter(
+            args.directory, args.url, args.database, lookback=args.lookback * 86400
+        )
+        count = exporter.export()
+        print(f"Exported {count} points")
+    else:
+        count = restore(args.directory, args.url, args.database)
+        print(f"Restored {count} points")
+
+
+if __name__ == "__main__":
+    main()
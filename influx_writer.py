@@ -0,0 +1,458 @@
+# InfluxDB Writer
+#
+# Writes points to the InfluxDB database without losing them when the database
+# can't be reached.
+#
+# Points are first appended as line protocol to a write-ahead queue on disk
+# and synced, so they survive a crash or power loss. A background thread sends
+# the queued points to the database's HTTP API in batches, optionally gzip
+# compressed. If a write fails, it is retried with an increasing delay, and
+# once the database is reachable again the backlog is drained. If the database
+# rejects a batch because of a bad point, the batch is split in halves and sent
+# again until only the bad points are left, which are moved to rejected.lp. The
+# sampling loop never waits on the database.
+#
+# The same writer can send the points to an ingest server (see
+# ingest_server.py) instead of the database by giving it the station's name.
+# Each writer's queue depth, failures and timings are kept in the metrics
+# under its name (see metrics.py).
+#
+# The queue is a directory of segment files named by number. A cursor file
+# holds the segment and byte offset of the first point not yet written to the
+# database. Segments are deleted once all of their points have been written.
+#
+# Daniel Hornberger
+# 2021
+
+import calendar
+import datetime
+import gzip
+import os
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+import logger as logging
+import metrics
+
+SEGMENT_SIZE = 1000000  # Start a new segment after 1 MB
+CURSOR_FILE = "cursor"
+# Points the database rejects are moved here rather than retried forever
+REJECTED_FILE = "rejected.lp"
+
+
+###############################################################################
+# Line Protocol
+###############################################################################
+
+
+def _escape_key(value):
+    value = str(value).replace("\\", "\\\\").replace(",", "\\,")
+    return value.replace("=", "\\=").replace(" ", "\\ ")
+
+
+def _escape_measurement(value):
+    return str(value).replace("\\", "\\\\").replace(",", "\\,").replace(" ", "\\ ")
+
+
+def _format_field(value):
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, int):
+        return f"{value}i"
+    if isinstance(value, float):
+        return repr(value)
+    escaped = str(value).replace("\\", "\\\\").replace('"', '\\"')
+    return f'"{escaped}"'
+
+
+def _format_time(value):
+    """
+    Converts a UTC datetime or epoch seconds to epoch nanoseconds.
+    """
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(datetime.timezone.utc)
+        seconds = calendar.timegm(value.utctimetuple())
+        return seconds * 1000000000 + value.microsecond * 1000
+    return int(round(value * 1000000000))
+
+
+def to_line_protocol(point):
+    """
+    Converts a point in the dictionary format used by the influxdb client
+    library to a line of line protocol (without the trailing newline).
+    """
+    line = _escape_measurement(point["measurement"])
+    for key, value in sorted(point.get("tags", {}).items()):
+        line += f",{_escape_key(key)}={_escape_key(value)}"
+
+    fields = ",".join(
+        f"{_escape_key(key)}={_format_field(value)}"
+        for key, value in point["fields"].items()
+        if value is not None
+    )
+    line += " " + fields
+
+    if point.get("time") is not None:
+        line += f" {_format_time(point['time'])}"
+    return line
+
+
+###############################################################################
+# Write-Ahead Queue
+###############################################################################
+
+
+class WriteAheadQueue:
+    """
+    A durable first in, first out queue of lines stored in a directory.
+    """
+
+    def __init__(self, directory, segment_size=SEGMENT_SIZE):
+        self.directory = directory
+        self.segment_size = segment_size
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+        segments = self._segments()
+        self._read_segment, self._read_offset = self._load_cursor(segments)
+        self._write_segment = segments[-1] if segments else self._read_segment
+
+        self._repair(self._write_segment)
+        self._file = open(self._path(self._write_segment), "ab")
+        self.depth = self._count_pending()
+
+    def _path(self, segment):
+        return os.path.join(self.directory, f"{segment:010d}.lp")
+
+    def _segments(self):
+        names = os.listdir(self.directory)
+        return sorted(
+            int(name[:-3])
+            for name in names
+            if name.endswith(".lp") and name[:-3].isdigit()
+        )
+
+    def _load_cursor(self, segments):
+        try:
+            with open(os.path.join(self.directory, CURSOR_FILE)) as file:
+                segment, offset = file.read().split()
+                return int(segment), int(offset)
+        except (OSError, ValueError):
+            return (segments[0] if segments else 0), 0
+
+    def _save_cursor(self):
+        path = os.path.join(self.directory, CURSOR_FILE)
+        with open(path + ".tmp", "w") as file:
+            file.write(f"{self._read_segment} {self._read_offset}\n")
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(path + ".tmp", path)
+
+    def _repair(self, segment):
+        """
+        Removes a partially written last line left by a crash.
+        """
+        path = self._path(segment)
+        if not os.path.exists(path):
+            return
+        with open(path, "rb+") as file:
+            data = file.read()
+            if data and not data.endswith(b"\n"):
+                file.truncate(data.rfind(b"\n") + 1)
+
+    def _count_pending(self):
+        count = 0
+        for segment in self._segments():
+            if segment < self._read_segment:
+                continue
+            with open(self._path(segment), "rb") as file:
+                if segment == self._read_segment:
+                    file.seek(self._read_offset)
+                count += file.read().count(b"\n")
+        return count
+
+    def append(self, lines):
+        """
+        Adds lines to the end of the queue and syncs them to the disk.
+        """
+        data = "".join(line + "\n" for line in lines).encode()
+        with self._lock:
+            if self._file.tell() >= self.segment_size:
+                self._file.close()
+                self._write_segment += 1
+                self._file = open(self._path(self._write_segment), "ab")
+            self._file.write(data)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self.depth += len(lines)
+
+    def peek(self, count):
+        """
+        Returns up to count lines from the front of the queue and the
+        position after them, which should be passed to remove() once the
+        lines have been handled.
+        """
+        with self._lock:
+            segment = self._read_segment
+            offset = self._read_offset
+            lines = []
+            while len(lines) < count and segment <= self._write_segment:
+                try:
+                    with open(self._path(segment), "rb") as file:
+                        file.seek(offset)
+                        while len(lines) < count:
+                            line = file.readline()
+                            if not line.endswith(b"\n"):
+                                break
+                            lines.append(line[:-1].decode())
+                            offset += len(line)
+                except FileNotFoundError:
+                    pass
+                if len(lines) < count and segment < self._write_segment:
+                    segment += 1
+                    offset = 0
+                else:
+                    break
+            return lines, (segment, offset)
+
+    def remove(self, count, position):
+        """
+        Removes count lines from the front of the queue, up to the position
+        returned by peek().
+        """
+        with self._lock:
+            finished = self._read_segment
+            self._read_segment, self._read_offset = position
+            self._save_cursor()
+            self.depth -= count
+            # Delete the segments that have been completely consumed
+            for segment in range(finished, self._read_segment):
+                try:
+                    os.remove(self._path(segment))
+                except FileNotFoundError:
+                    pass
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+###############################################################################
+# Writer
+###############################################################################
+
+
+class WriteRejected(Exception):
+    """
+    The database refused the points, so retrying them won't help.
+    """
+
+
+def write_url(url, database, station=None):
+    """
+    Returns the url points are written to. The station is given when writing
+    to an ingest server (see ingest_server.py) rather than the database.
+    """
+    parameters = {"db": database, "precision": "ns"}
+    if station:
+        parameters["station"] = station
+    return f"{url}/write?" + urllib.parse.urlencode(parameters)
+
+
+def send_lines(url, lines, compress=True, timeout=10.0):
+    """
+    Writes lines of line protocol to the database's write url. Raises
+    WriteRejected if the database rejects them.
+    """
+    body = ("\n".join(lines) + "\n").encode()
+    headers = {"Content-Type": "text/plain; charset=utf-8"}
+    if compress:
+        body = gzip.compress(body)
+        headers["Content-Encoding"] = "gzip"
+
+    request = urllib.request.Request(url, data=body, headers=headers, method="POST")
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            response.read()
+    except urllib.error.HTTPError as e:
+        # Bad points are rejected with a 400. Anything else may succeed
+        # when retried.
+        if e.code == 400:
+            raise WriteRejected(e.read().decode(errors="replace"))
+        raise
+
+
+class InfluxWriter:
+    """
+    Queues points to be written to an InfluxDB database by a background
+    thread. Call start() to begin writing and stop() to flush and finish.
+    """
+
+    def __init__(
+        self,
+        queue_directory,
+        url="http://localhost:8086",
+        database="weather",
+        batch_size=500,
+        flush_interval=5.0,
+        compress=True,
+        timeout=10.0,
+        max_backoff=300.0,
+        station=None,
+        name="database",
+    ):
+        self.queue = WriteAheadQueue(queue_directory)
+        self.write_url = write_url(url, database, station)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.compress = compress
+        self.timeout = timeout
+        self.max_backoff = max_backoff
+
+        # Statistics
+        self.points_written = 0
+        self.points_rejected = 0
+        self.write_failures = 0
+        self.last_flush_latency = 0.0
+
+        self._append_stage = metrics.stage(f"{name}_queue")
+        self._flush_stage = metrics.stage(f"{name}_flush")
+        labels = {"queue": name}
+        metrics.gauge(
+            "queue_depth",
+            "Points waiting in a write-ahead queue",
+            labels,
+            self.queue_depth,
+        )
+        metrics.counter(
+            "points_written",
+            "Points sent from a write-ahead queue",
+            labels,
+            lambda: self.points_written,
+        )
+        metrics.counter(
+            "points_rejected",
+            "Points from a write-ahead queue the database refused",
+            labels,
+            lambda: self.points_rejected,
+        )
+        metrics.counter(
+            "write_failures",
+            "Failed attempts to send a batch of points",
+            labels,
+            lambda: self.write_failures,
+        )
+
+        self._wake = threading.Event()
+        self._stopping = False
+        self._thread = None
+
+    def write_points(self, points):
+        """
+        Queues a list of points in the influxdb client library's dictionary
+        format. The points are on the disk when this returns.
+        """
+        self.write_lines([to_line_protocol(point) for point in points])
+
+    def write_lines(self, lines):
+        """
+        Queues a list of points already converted to line protocol.
+        """
+        with self._append_stage:
+            self.queue.append(lines)
+        self._wake.set()
+
+    def queue_depth(self):
+        """
+        Returns the number of points waiting to be written to the database.
+        """
+        return self.queue.depth
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._run, name="influx_writer", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, timeout=10.0):
+        """
+        Tries to write the remaining points for up to timeout seconds and then
+        stops the background thread.
+        """
+        self._stopping = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.queue.close()
+
+    def _send(self, lines):
+        send_lines(self.write_url, lines, self.compress, self.timeout)
+
+    def _reject(self, lines, reason):
+        logging.log(f"ERROR: The database rejected {len(lines)} points: {reason}")
+        with open(os.path.join(self.queue.directory, REJECTED_FILE), "a") as file:
+            file.write("".join(line + "\n" for line in lines))
+
+    def _send_or_split(self, lines):
+        """
+        Sends lines, splitting them in halves when the database rejects them
+        so that only the bad points are rejected. Returns the rejected lines.
+        """
+        try:
+            self._send(lines)
+            return []
+        except WriteRejected as e:
+            if len(lines) == 1:
+                self._reject(lines, str(e))
+                return lines
+        middle = len(lines) // 2
+        return self._send_or_split(lines[:middle]) + self._send_or_split(lines[middle:])
+
+    def flush(self):
+        """
+        Writes one batch of queued points to the database. Returns the number
+        of points taken from the queue, or raises an exception if the write
+        failed.
+        """
+        lines, position = self.queue.peek(self.batch_size)
+        if not lines:
+            return 0
+
+        start = time.monotonic()
+        with self._flush_stage:
+            rejected = self._send_or_split(lines)
+        self.last_flush_latency = time.monotonic() - start
+
+        self.queue.remove(len(lines), position)
+        self.points_written += len(lines) - len(rejected)
+        self.points_rejected += len(rejected)
+        return len(lines)
+
+    def _run(self):
+        backoff = 1.0
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+
+            try:
+                # Keep writing batches until the backlog is drained
+                while self.flush() == self.batch_size:
+                    pass
+                backoff = 1.0
+            except Exception as e:
+                self.write_failures += 1
+                logging.log(
+                    f"ERROR: Writing to the database failed, retrying in {backoff} seconds: {e}"
+                )
+                if self._stopping:
+                    return
+                time.sleep(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+                continue
+
+            if self._stopping:
+                return
@@ -0,0 +1,762 @@
+# Ingest Server
+#
+# Collects the records of many weather stations and writes them to a central
+# InfluxDB database, so each station doesn't need its own.
+#
+# The server is a single asyncio process that accepts points over HTTP and
+# UDP in either of two formats:
+#
+# Line protocol - POST /write?station=NAME with one point per line, the same
+#                 as InfluxDB's own write endpoint, so a station's InfluxWriter
+#                 can send to it (see the [ingest] settings of
+#                 weather_station.ini). The timestamps are in nanoseconds
+#                 unless a precision of u, ms, s, m or h is given, as with
+#                 InfluxDB.
+# Records       - POST /records?station=NAME with one JSON record per line,
+#                 keyed by the columnar store's column names (see
+#                 columnar_store.py) with the time in epoch seconds or ISO
+#                 8601 (UTC unless an offset is given).
+#
+# The station can also be given in an X-Station header, and UDP datagrams
+# (which can hold either format) name it with a station tag or a "station"
+# key. Every point is given a station tag. A request is only accepted if
+# every point in it is valid, and the body can be gzip compressed.
+#
+# The accepted points are collected into batches that are written to a
+# write-ahead queue on the disk once per flush interval or once a batch is
+# full, by a thread so the event loop never waits on the disk. An InfluxWriter
+# then sends them to the database, retrying while it can't be reached (see
+# influx_writer.py).
+#
+# Each station has a token bucket that limits the rate of its points, and a
+# limit on its points waiting to be stored. A station that goes over either is
+# answered with 429 Too Many Requests and a Retry-After time, so one busy or
+# misbehaving station can't crowd out the rest. If too many points are waiting
+# to be stored in total, every station is answered with 503 Service
+# Unavailable until the disk catches up. Throttled UDP datagrams are dropped
+# and counted. GET /stats returns the counters as JSON.
+#
+# Example:
+#
+#   python3 ingest_server.py --queue-directory /var/lib/weather/ingest_queue
+#
+# Daniel Hornberger
+# 2021
+
+import argparse
+import asyncio
+import collections
+import datetime
+import json
+import math
+import re
+import signal
+import time
+import urllib.parse
+import zlib
+
+import columnar_store
+import logger as logging
+from influx_writer import InfluxWriter
+from influx_writer import to_line_protocol
+
+DEFAULT_PORT = 8087  # Both HTTP and UDP
+
+# The measurement the records are written to, the same as the stations use
+RECORD_MEASUREMENT = "weather"
+
+# Write a batch to the disk once it has this many points, or after
+# FLUSH_INTERVAL
+BATCH_SIZE = 5000
+FLUSH_INTERVAL = 0.5  # Seconds
+
+# The sustained points per second and the burst allowed from each station. A
+# station normally sends one record every 15 minutes, but it may have a
+# backlog to send after losing its connection.
+STATION_RATE = 100.0
+STATION_BURST = 5000
+
+# The most points from one station, and from all stations, that may be waiting
+# to be written to the disk
+STATION_QUEUE_LIMIT = 10000
+MAX_PENDING = 200000
+
+MAX_BODY_SIZE = 4000000  # Bytes after decompression
+MAX_HEADER_SIZE = 16384  # Bytes
+
+# How often the counters are logged
+STATS_INTERVAL = 60  # Seconds
+
+STATION_PATTERN = re.compile(r"[\w.-]{1,64}")
+
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+STATUS_TEXT = {
+    200: "OK",
+    204: "No Content",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    411: "Length Required",
+    413: "Payload Too Large",
+    429: "Too Many Requests",
+    431: "Request Header Fields Too Large",
+    503: "Service Unavailable",
+}
+
+
+class InvalidPoint(Exception):
+    """
+    A point isn't valid line protocol or a valid record.
+    """
+
+
+###############################################################################
+# Validation
+###############################################################################
+
+# A line of line protocol: the measurement and tags, the fields and an
+# optional timestamp. The alternatives in each repetition can't both match, so
+# it's checked in one pass without backtracking.
+_KEY = r"(?:[^\\, =]|\\.)+"
+_MEASUREMENT = r"(?:[^\\, ]|\\.)+"
+_VALUE = (
+    r'(?:"(?:[^"\\]|\\.)*"'
+    r"|[+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?"
+    r"|[+-]?\d+[iu]"
+    r"|t|T|true|True|TRUE|f|F|false|False|FALSE)"
+)
+_LINE = re.compile(
+    rf"(?P<key>{_MEASUREMENT}(?P<tags>(?:,{_KEY}={_KEY})*))"
+    rf" {_KEY}={_VALUE}(?:,{_KEY}={_VALUE})*(?: (?P<time>-?\d+))?"
+)
+
+# The nanoseconds in a unit of each timestamp precision of the write endpoint
+PRECISIONS = {
+    "n": 1,
+    "ns": 1,
+    "u": 1000,
+    "ms": 1000000,
+    "s": 1000000000,
+    "m": 60000000000,
+    "h": 3600000000000,
+}
+_TAG = re.compile(rf",({_KEY})=({_KEY})")
+
+
+def _escape_tag(value):
+    value = value.replace("\\", "\\\\").replace(",", "\\,")
+    return value.replace("=", "\\=").replace(" ", "\\ ")
+
+
+def check_station(name):
+    """
+    Returns the station name if it's valid, otherwise raises InvalidPoint.
+    """
+    if not isinstance(name, str) or not STATION_PATTERN.fullmatch(name):
+        raise InvalidPoint(f"invalid station name {name!r}")
+    return name
+
+
+def validate_line(line, station=None, precision="ns"):
+    """
+    Checks a line of line protocol and returns the station it's from and the
+    line with a station tag and its timestamp in nanoseconds. The station tag
+    in the line must match the station if both are given.
+    """
+    match = _LINE.fullmatch(line)
+    if match is None:
+        raise InvalidPoint("invalid line protocol")
+    if match.group("time") is not None and PRECISIONS[precision] != 1:
+        time = int(match.group("time")) * PRECISIONS[precision]
+        line = f"{line[: match.start('time')]}{time}"
+
+    line_station = None
+    tags = match.group("tags")
+    if "station=" in tags:
+        for name, value in _TAG.findall(tags):
+            if name == "station":
+                line_station = value
+
+    if line_station is not None:
+        if station is not None and line_station != _escape_tag(station):
+            raise InvalidPoint(f"the station tag isn't {station!r}")
+        return check_station(line_station), line
+
+    if station is None:
+        raise InvalidPoint("no station given")
+    end = match.end("key")
+    return station, f"{line[:end]},station={_escape_tag(station)}{line[end:]}"
+
+
+def _record_time(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        if not math.isfinite(value):
+            raise InvalidPoint(f"invalid time {value!r}")
+        return value
+    if isinstance(value, str):
+        if value.endswith("Z"):
+            value = value[:-1] + "+00:00"
+        try:
+            time = datetime.datetime.fromisoformat(value)
+        except ValueError:
+            raise InvalidPoint(f"invalid time {value!r}")
+        # Times without an offset are UTC
+        if time.tzinfo is None:
+            time = time.replace(tzinfo=datetime.timezone.utc)
+        return time
+    raise InvalidPoint("missing time")
+
+
+def record_to_line(record, station=None):
+    """
+    Checks a record given as a dictionary keyed by the columnar store's column
+    names and returns the station it's from and the record as a line of line
+    protocol.
+    """
+    if not isinstance(record, dict):
+        raise InvalidPoint("a record must be an object")
+
+    record_station = record.get("station")
+    if record_station is None:
+        record_station = station
+    elif station is not None and record_station != station:
+        raise InvalidPoint(f"the record's station isn't {station!r}")
+    station = check_station(record_station)
+
+    fields = {}
+    for name, value in record.items():
+        if name in ("station", "time", "record_number"):
+            continue
+        if name not in columnar_store.LABELS:
+            raise InvalidPoint(f"unknown field {name!r}")
+        if name in columnar_store.STRING_COLUMNS:
+            if not isinstance(value, str):
+                raise InvalidPoint(f"{name} must be a string")
+        else:
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                raise InvalidPoint(f"{name} must be a number")
+            if not math.isfinite(value):
+                raise InvalidPoint(f"{name} must be finite")
+            value = float(value)
+        fields[columnar_store.LABELS[name]] = value
+    if not fields:
+        raise InvalidPoint("the record has no fields")
+
+    point = {
+        "measurement": RECORD_MEASUREMENT,
+        "tags": {"station": station},
+        "fields": fields,
+        "time": _record_time(record.get("time")),
+    }
+    return station, to_line_protocol(point)
+
+
+def parse_body(body, kind, station=None, precision="ns"):
+    """
+    Validates the points in a body of line protocol ("lines") or JSON records
+    ("records"). Returns a dictionary of the lines of line protocol from each
+    station.
+    """
+    if precision not in PRECISIONS:
+        raise InvalidPoint(f"invalid precision {precision!r}")
+    try:
+        text = body.decode()
+    except UnicodeDecodeError:
+        raise InvalidPoint("the body isn't UTF-8")
+
+    lines = collections.defaultdict(list)
+    for number, line in enumerate(text.split("\n"), 1):
+        line = line.strip()
+        if not line or line[0] == "#":
+            continue
+        try:
+            if kind == "records":
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    raise InvalidPoint("invalid JSON")
+                point_station, point = record_to_line(record, station)
+            else:
+                point_station, point = validate_line(line, station, precision)
+        except InvalidPoint as e:
+            raise InvalidPoint(f"line {number}: {e}")
+        lines[point_station].append(point)
+    return lines
+
+
+def _decompress(body, limit):
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    try:
+        data = decompressor.decompress(body, limit + 1)
+    except zlib.error:
+        raise InvalidPoint("invalid gzip data")
+    if len(data) > limit:
+        raise ValueError("the body is too large")
+    return data
+
+
+###############################################################################
+# Server
+###############################################################################
+
+
+class _Station:
+    """
+    The rate limit and counters of one station.
+    """
+
+    __slots__ = [
+        "name",
+        "tokens",
+        "updated",
+        "queued",
+        "accepted",
+        "throttled",
+        "rejected",
+    ]
+
+    def __init__(self, name, burst, now):
+        self.name = name
+        self.tokens = burst
+        self.updated = now
+        self.queued = 0
+        self.accepted = 0
+        self.throttled = 0
+        self.rejected = 0
+
+
+class _DatagramProtocol(asyncio.DatagramProtocol):
+    def __init__(self, server):
+        self.server = server
+
+    def datagram_received(self, data, address):
+        self.server.receive_datagram(data)
+
+
+class IngestServer:
+    """
+    Accepts points from many stations and writes them in batches to storage,
+    which is anything with a write_lines() method such as an InfluxWriter.
+    """
+
+    def __init__(
+        self,
+        storage,
+        batch_size=BATCH_SIZE,
+        flush_interval=FLUSH_INTERVAL,
+        station_rate=STATION_RATE,
+        station_burst=STATION_BURST,
+        station_queue_limit=STATION_QUEUE_LIMIT,
+        max_pending=MAX_PENDING,
+        max_body_size=MAX_BODY_SIZE,
+        clock=time.monotonic,
+    ):
+        self.storage = storage
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.station_rate = station_rate
+        self.station_burst = station_burst
+        self.station_queue_limit = station_queue_limit
+        self.max_pending = max_pending
+        self.max_body_size = max_body_size
+        self.clock = clock
+
+        self.stations = {}
+        # Points accepted but not yet written to storage
+        self.pending = 0
+        self._batch = []
+        self._batch_counts = collections.Counter()
+        self._wake = None
+        self._stopping = None
+        self._connections = set()
+
+        # Statistics
+        self.requests = 0
+        self.datagrams = 0
+        self.invalid = 0
+        self.overloaded = 0
+        self.dropped = 0
+        self.stored = 0
+        self.store_failures = 0
+        self.last_store_latency = 0.0
+
+    ###########################################################################
+    # Accepting Points
+    ###########################################################################
+
+    def submit(self, lines):
+        """
+        Accepts the lines of line protocol from each station in a dictionary
+        if none of the stations are over their limits. Returns the HTTP status
+        (204, 429 or 503) and how many seconds to wait before retrying.
+        """
+        total = sum(len(station_lines) for station_lines in lines.values())
+        if self.pending + total > self.max_pending and self.pending:
+            self.overloaded += total
+            return 503, max(1, math.ceil(self.flush_interval))
+
+        now = self.clock()
+        stations = []
+        for name, station_lines in lines.items():
+            station = self.stations.get(name)
+            if station is None:
+                station = self.stations[name] = _Station(name, self.station_burst, now)
+            station.tokens = min(
+                self.station_burst,
+                station.tokens + (now - station.updated) * self.station_rate,
+            )
+            station.updated = now
+
+            # A request larger than the burst is let through when the bucket
+            # is full, and the station then waits until it's paid back
+            if station.tokens <= 0:
+                station.throttled += len(station_lines)
+                return 429, max(1, math.ceil(-station.tokens / self.station_rate))
+            queued = station.queued + len(station_lines)
+            if station.queued and queued > self.station_queue_limit:
+                station.throttled += len(station_lines)
+                return 429, max(1, math.ceil(self.flush_interval))
+            stations.append((station, station_lines))
+
+        for station, station_lines in stations:
+            count = len(station_lines)
+            station.tokens -= count
+            station.queued += count
+            station.accepted += count
+            self._batch.extend(station_lines)
+            self._batch_counts[station.name] += count
+        self.pending += total
+        if len(self._batch) >= self.batch_size and self._wake is not None:
+            self._wake.set()
+        return 204, 0
+
+    def receive_datagram(self, data):
+        """
+        Accepts the points in a UDP datagram. Datagrams can't be answered, so
+        any that are invalid or throttled are counted and dropped.
+        """
+        self.datagrams += 1
+        kind = "records" if data.lstrip()[:1] == b"{" else "lines"
+        try:
+            lines = parse_body(data, kind)
+        except InvalidPoint as e:
+            self.invalid += 1
+            logging.debug(f"Ingest: dropped an invalid datagram: {e}")
+            return
+        status, retry_after = self.submit(lines)
+        if status != 204:
+            self.dropped += sum(len(station_lines) for station_lines in lines.values())
+
+    ###########################################################################
+    # HTTP
+    ###########################################################################
+
+    def handle_request(self, method, target, headers, body):
+        """
+        Handles an HTTP request and returns the status, the response body and
+        any extra headers.
+        """
+        self.requests += 1
+        url = urllib.parse.urlsplit(target)
+        query = urllib.parse.parse_qs(url.query)
+
+        if url.path == "/ping":
+            return 204, b"", {}
+        if url.path == "/stats":
+            if method != "GET":
+                return 405, b"", {"Allow": "GET"}
+            return 200, json.dumps(self.stats()).encode(), JSON_HEADERS
+        if url.path not in ("/write", "/records"):
+            return 404, b"", {}
+        if method != "POST":
+            return 405, b"", {"Allow": "POST"}
+
+        station = query.get("station", [headers.get("x-station")])[0]
+        try:
+            if station is not None:
+                check_station(station)
+            if headers.get("content-encoding", "").lower() == "gzip":
+                body = _decompress(body, self.max_body_size)
+            kind = "records" if url.path == "/records" else "lines"
+            precision = query.get("precision", ["ns"])[0]
+            lines = parse_body(body, kind, station, precision)
+        except InvalidPoint as e:
+            self.invalid += 1
+            if station in self.stations:
+                self.stations[station].rejected += 1
+            return 400, json.dumps({"error": str(e)}).encode(), JSON_HEADERS
+        except ValueError as e:
+            return 413, json.dumps({"error": str(e)}).encode(), JSON_HEADERS
+
+        status, retry_after = self.submit(lines)
+        if status != 204:
+            return status, b"", {"Retry-After": str(retry_after)}
+        return 204, b"", {}
+
+    async def _handle_connection(self, reader, writer):
+        self._connections.add(writer)
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except asyncio.LimitOverrunError:
+                    writer.write(self._response(431, b"", {}, False))
+                    break
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+
+                request_line, *header_lines = head.decode("latin-1").split("\r\n")
+                try:
+                    method, target, version = request_line.split(" ", 2)
+                except ValueError:
+                    writer.write(self._response(400, b"", {}, False))
+                    break
+                headers = {}
+                for header in header_lines:
+                    name, colon, value = header.partition(":")
+                    if colon:
+                        headers[name.strip().lower()] = value.strip()
+
+                connection = headers.get("connection", "").lower()
+                if version == "HTTP/1.1":
+                    keep_alive = connection != "close"
+                else:
+                    keep_alive = connection == "keep-alive"
+                if "transfer-encoding" in headers:
+                    writer.write(self._response(411, b"", {}, False))
+                    break
+                try:
+                    length = int(headers.get("content-length", "0"))
+                except ValueError:
+                    writer.write(self._response(400, b"", {}, False))
+                    break
+                if length > self.max_body_size or length < 0:
+                    writer.write(self._response(413, b"", {}, False))
+                    break
+                if headers.get("expect", "").lower() == "100-continue":
+                    writer.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+                body = await reader.readexactly(length) if length else b""
+
+                status, response_body, extra_headers = self.handle_request(
+                    method, target, headers, body
+                )
+                writer.write(
+                    self._response(status, response_body, extra_headers, keep_alive)
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._connections.discard(writer)
+            writer.close()
+
+    def _response(self, status, body, headers, keep_alive):
+        lines = [f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}"]
+        if status != 204:
+            lines.append(f"Content-Length: {len(body)}")
+        if not keep_alive:
+            lines.append("Connection: close")
+        for name, value in headers.items():
+            lines.append(f"{name}: {value}")
+        return ("\r\n".join(lines) + "\r\n\r\n").encode() + body
+
+    ###########################################################################
+    # Storing Points
+    ###########################################################################
+
+    async def _flush_loop(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            if not self._batch:
+                if self._stopping.is_set():
+                    return
+                continue
+
+            lines = self._batch
+            counts = self._batch_counts
+            self._batch = []
+            self._batch_counts = collections.Counter()
+
+            start = self.clock()
+            try:
+                # The storage syncs the points to the disk, so it's done on a
+                # thread to keep accepting points in the meantime
+                await loop.run_in_executor(None, self.storage.write_lines, lines)
+            except Exception as e:
+                self.store_failures += 1
+                logging.log(f"ERROR: Storing {len(lines)} points failed, retrying: {e}")
+                # Put the points back in front of those that arrived since
+                self._batch[:0] = lines
+                self._batch_counts.update(counts)
+                await asyncio.sleep(self.flush_interval)
+                self._wake.set()
+                continue
+            self.last_store_latency = self.clock() - start
+
+            self.stored += len(lines)
+            self.pending -= len(lines)
+            for name, count in counts.items():
+                self.stations[name].queued -= count
+
+    async def _stats_loop(self, interval):
+        previous = self.stored
+        while True:
+            await asyncio.sleep(interval)
+            logging.log(
+                f"Ingest: {len(self.stations)} stations, "
+                f"{round((self.stored - previous) / interval, 1)} points/s stored, "
+                f"{self.pending} pending, {self.overloaded} overloaded, "
+                f"{sum(station.throttled for station in self.stations.values())} throttled, "
+                f"{self.invalid} invalid, {self.dropped} datagrams dropped, "
+                f"last store took {round(self.last_store_latency * 1000, 1)} ms"
+            )
+            previous = self.stored
+
+    def stats(self):
+        return {
+            "stations": len(self.stations),
+            "requests": self.requests,
+            "datagrams": self.datagrams,
+            "pending": self.pending,
+            "stored": self.stored,
+            "invalid": self.invalid,
+            "overloaded": self.overloaded,
+            "dropped": self.dropped,
+            "store_failures": self.store_failures,
+            "last_store_latency": self.last_store_latency,
+            "throttled": {
+                station.name: station.throttled
+                for station in self.stations.values()
+                if station.throttled
+            },
+        }
+
+    ###########################################################################
+    # Running
+    ###########################################################################
+
+    async def serve(
+        self, host="0.0.0.0", http_port=DEFAULT_PORT, udp_port=DEFAULT_PORT, ready=None
+    ):
+        """
+        Serves until stop() is called, then writes the remaining points to
+        storage. A port of None isn't listened on, and 0 picks a free port.
+        ready is called with the HTTP and UDP ports once they're listening.
+        """
+        loop = asyncio.get_event_loop()
+        self._wake = asyncio.Event()
+        self._stopping = asyncio.Event()
+        flusher = loop.create_task(self._flush_loop())
+        stats = loop.create_task(self._stats_loop(STATS_INTERVAL))
+
+        http_server = None
+        transport = None
+        ports = [None, None]
+        if http_port is not None:
+            http_server = await asyncio.start_server(
+                self._handle_connection,
+                host,
+                http_port,
+                limit=MAX_HEADER_SIZE,
+                backlog=1024,
+            )
+            ports[0] = http_server.sockets[0].getsockname()[1]
+        if udp_port is not None:
+            transport, protocol = await loop.create_datagram_endpoint(
+                lambda: _DatagramProtocol(self), local_addr=(host, udp_port)
+            )
+            ports[1] = transport.get_extra_info("sockname")[1]
+
+        logging.log(
+            f"Ingest: listening for HTTP on port {ports[0]} and UDP on port {ports[1]}"
+        )
+        if ready is not None:
+            ready(*ports)
+
+        try:
+            await self._stopping.wait()
+        finally:
+            if http_server is not None:
+                http_server.close()
+                # Idle keep-alive connections would otherwise hold it open
+                for connection in list(self._connections):
+                    connection.close()
+                await http_server.wait_closed()
+            if transport is not None:
+                transport.close()
+            stats.cancel()
+            self._stopping.set()
+            self._wake.set()
+            await flusher
+
+    def stop(self):
+        """
+        Stops serving. This must be called from the event loop's thread.
+        """
+        self._stopping.set()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Collect the records of many weather stations into one database"
+    )
+    parser.add_argument("--host", default="0.0.0.0", help="The address to listen on")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="The HTTP port")
+    parser.add_argument(
+        "--udp-port", type=int, default=DEFAULT_PORT, help="The UDP port (0 to disable)"
+    )
+    parser.add_argument(
+        "--queue-directory",
+        default="ingest_queue",
+        help="Where the points waiting to be written to the database are kept",
+    )
+    parser.add_argument("--url", default="http://localhost:8086", help="The database url")
+    parser.add_argument("--database", default="weather", help="The database name")
+    parser.add_argument(
+        "--station-rate",
+        type=float,
+        default=STATION_RATE,
+        help="The points per second allowed from each station",
+    )
+    parser.add_argument(
+        "--log-file", help="Write the log to this file instead of to stderr"
+    )
+    args = parser.parse_args(argv)
+
+    if args.log_file:
+        logging.initialize_logger(args.log_file)
+    else:
+        logging.initialize_stream()
+
+    storage = InfluxWriter(
+        args.queue_directory, args.url, args.database, batch_size=BATCH_SIZE
+    )
+    storage.start()
+    server = IngestServer(storage, station_rate=args.station_rate)
+
+    def ready(http_port, udp_port):
+        print(f"Listening for HTTP on port {http_port} and UDP on port {udp_port}")
+
+    async def run():
+        # Finish writing the accepted points when stopped
+        loop = asyncio.get_event_loop()
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signal_number, server.stop)
+        await server.serve(args.host, args.port, args.udp_port or None, ready)
+
+    try:
+        asyncio.run(run())
+    finally:
+        storage.stop()
+
+
+if __name__ == "__main__":
+    main()
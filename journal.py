@@ -0,0 +1,125 @@
+# Journal
+#
+# Appends records to the data file so that a power loss can't corrupt it.
+#
+# Each record is appended to the .csv file and synced to the disk. Then an
+# entry holding the offset, length and CRC32 checksum of the record is
+# appended to a journal file next to it (<data_file>.journal) and synced. When
+# a data file is opened again, only the last journal entry has to be checked:
+# anything in the .csv file after the last journaled record was torn by a
+# crash and is truncated. Writing a record therefore takes the same amount of
+# time no matter how large the data file has grown.
+#
+# Daniel Hornberger
+# 2021
+
+import os
+import struct
+import zlib
+
+import logger as logging
+
+JOURNAL_SUFFIX = ".journal"
+
+# Offset of the record in the data file, length of the record and its CRC32
+ENTRY = struct.Struct("<QII")
+
+
+def _sync(file):
+    file.flush()
+    os.fsync(file.fileno())
+
+
+def recover(data_file):
+    """
+    Truncates anything after the last complete record of the data file.
+    Returns the number of bytes removed.
+    """
+    journal_file = data_file + JOURNAL_SUFFIX
+    if not os.path.exists(data_file) or not os.path.exists(journal_file):
+        return 0
+
+    with open(data_file, "rb+") as data, open(journal_file, "rb+") as journal:
+        data_size = data.seek(0, os.SEEK_END)
+        journal_size = journal.seek(0, os.SEEK_END)
+
+        # A partially written journal entry belongs to a record that wasn't
+        # completely written
+        journal_size -= journal_size % ENTRY.size
+        journal.truncate(journal_size)
+
+        end = None
+        while journal_size > 0 and end is None:
+            journal.seek(journal_size - ENTRY.size)
+            offset, length, checksum = ENTRY.unpack(journal.read(ENTRY.size))
+            data.seek(offset)
+            record = data.read(length)
+            if len(record) == length and zlib.crc32(record) == checksum:
+                end = offset + length
+            else:
+                # The journal entry reached the disk before its record did
+                journal_size -= ENTRY.size
+                journal.truncate(journal_size)
+
+        if end is None:
+            # No records have been journaled, so keep the complete lines,
+            # which will only be the labels row
+            data.seek(0)
+            contents = data.read()
+            end = contents.rfind(b"\n") + 1
+
+        if data_size > end:
+            data.truncate(end)
+            _sync(data)
+            _sync(journal)
+            logging.log(
+                f"WARNING: Removed {data_size - end} bytes of an incomplete record from {data_file}"
+            )
+        return max(data_size - end, 0)
+
+
+def recover_directory(directory):
+    """
+    Recovers every data file with a journal in the directory.
+    """
+    for name in sorted(os.listdir(directory)):
+        if name.endswith(".csv") and os.path.exists(
+            os.path.join(directory, name + JOURNAL_SUFFIX)
+        ):
+            recover(os.path.join(directory, name))
+
+
+class DataFile:
+    """
+    A data file that records are safely appended to. The labels row is
+    written when the file is created.
+    """
+
+    def __init__(self, path, labels):
+        self.path = path
+        if os.path.exists(path):
+            recover(path)
+        else:
+            with open(path, "w") as file:
+                file.write(labels)
+                _sync(file)
+
+        self._data = open(path, "ab")
+        self._journal = open(path + JOURNAL_SUFFIX, "ab")
+
+    def append(self, record):
+        """
+        Appends a record (a line of text including the newline) and syncs it
+        and its journal entry to the disk.
+        """
+        data = record.encode()
+        offset = self._data.seek(0, os.SEEK_END)
+        self._data.write(data)
+        _sync(self._data)
+
+        self._journal.write(ENTRY.pack(offset, len(data), zlib.crc32(data)))
+        _sync(self._journal)
+
+    def close(self):
+        self._data.close()
+        self._journal.close()
@@ -0,0 +1,424 @@
+# Live API
+#
+# Serves the current conditions over HTTP so anything that wants to know
+# what the wind is doing right now doesn't have to wait for the next record in
+# the database.
+#
+# The sampling loop publishes a sample on every accumulation tick and the
+# record on every log tick. They're kept in a fixed size ring of events in
+# memory, and nothing is read from the disk or the database. Publishing only
+# stores the event in the ring and wakes the server's thread, so it costs the
+# sampling loop a few microseconds no matter how many clients are connected.
+# There is a single writer and the server only reads the ring, so no lock is
+# needed (the same as timestamp_ring.py).
+#
+# The server runs its own asyncio event loop on a background thread. Each
+# event is converted to JSON once, and every client is sent those same bytes,
+# so hundreds of clients polling or streaming cost little more than one.
+#
+# GET /current             - The latest sample and record. The ETag is the
+#                            event sequence number, so a client polling with
+#                            If-None-Match gets a 304 until there is news.
+# GET /events?since=N      - The events after sequence number N that are
+#                            still in the ring.
+# GET /stream              - A Server-Sent Events stream of the events as
+#                            they happen. A client that reconnects with
+#                            Last-Event-ID (or ?since=N) first gets the events
+#                            it missed that are still in the ring.
+# GET /metrics             - The station's metrics in the Prometheus text
+#                            format (see metrics.py). They're rendered on the
+#                            server's thread, not the sampling loop's.
+#
+# Example:
+#
+#   curl http://weatherstation.local:8090/current
+#
+# Daniel Hornberger
+# 2021
+
+import asyncio
+import json
+import threading
+import urllib.parse
+
+import logger as logging
+import metrics
+
+DEFAULT_PORT = 8090
+
+# Room for an hour of samples with a 10 second accumulation interval and the
+# records logged in that time
+CAPACITY = 512
+
+MAX_HEADER_SIZE = 8192  # Bytes
+
+# Stream clients that fall this far behind are disconnected rather than
+# buffering without limit
+MAX_STREAM_BUFFER = 262144  # Bytes
+
+# A comment is sent to idle streams this often so proxies keep them open
+KEEPALIVE_INTERVAL = 15  # Seconds
+
+STATUS_TEXT = {
+    200: "OK",
+    304: "Not Modified",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    431: "Request Header Fields Too Large",
+}
+
+
+def _dumps(value):
+    return json.dumps(value, separators=(",", ":"), default=str)
+
+
+class EventRing:
+    """
+    The most recent capacity events, each a kind ("sample" or "record") and a
+    dictionary. Events are numbered from 1 in the order they're added.
+    """
+
+    def __init__(self, capacity=CAPACITY):
+        self.capacity = capacity
+        self._events = [None] * capacity
+        # The number of events ever added, which is also the sequence number
+        # of the latest
+        self.sequence = 0
+        self.latest = {}
+
+    def add(self, kind, data):
+        """
+        Adds an event and returns its sequence number. Only one thread may
+        add events.
+        """
+        sequence = self.sequence + 1
+        self._events[sequence % self.capacity] = (sequence, kind, data)
+        self.latest[kind] = (sequence, data)
+        # Readers only look at events up to the sequence, so it's updated
+        # after the event is in place
+        self.sequence = sequence
+        return sequence
+
+    def since(self, sequence):
+        """
+        Returns the (sequence, kind, data) of the events after sequence that
+        are still in the ring, oldest first.
+        """
+        end = self.sequence
+        start = max(sequence, end - self.capacity, 0)
+        events = []
+        for number in range(start + 1, end + 1):
+            event = self._events[number % self.capacity]
+            # Skip a slot overwritten while reading
+            if event is not None and event[0] == number:
+                events.append(event)
+        return events
+
+
+class LiveServer:
+    """
+    Serves the events in an EventRing over HTTP on a background thread. Call
+    start() to begin serving and publish() to add events.
+    """
+
+    def __init__(self, host="0.0.0.0", port=DEFAULT_PORT, capacity=CAPACITY):
+        self.host = host
+        self.port = port
+        self.ring = EventRing(capacity)
+
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._ready = threading.Event()
+        self._error = None
+
+        # Owned by the server's thread
+        self._encoded = {}
+        self._encoded_sequence = 0
+        self._streams = set()
+        self._current = None
+
+        # Statistics
+        self.requests = 0
+        self.not_modified = 0
+        self.dropped_streams = 0
+
+    ###########################################################################
+    # Publishing (called from the sampling loop)
+    ###########################################################################
+
+    def publish(self, kind, data):
+        """
+        Adds an event and wakes the server to send it to the streams.
+        """
+        self.ring.add(kind, data)
+        loop = self._loop
+        if loop is not None:
+            try:
+                loop.call_soon_threadsafe(self._published)
+            except RuntimeError:
+                # The server has stopped
+                pass
+
+    ###########################################################################
+    # Encoding (called on the server's thread)
+    ###########################################################################
+
+    def _encode_new(self):
+        """
+        Converts the events added since the last call to JSON and SSE once and
+        returns the new SSE messages.
+        """
+        messages = []
+        for sequence, kind, data in self.ring.since(self._encoded_sequence):
+            data_json = _dumps(data)
+            fragment = f'{{"id":{sequence},"event":"{kind}","data":{data_json}}}'
+            message = f"id: {sequence}\nevent: {kind}\ndata: {data_json}\n\n".encode()
+            self._encoded[sequence] = (fragment, message)
+            messages.append(message)
+            self._encoded_sequence = sequence
+        # Forget the events that have left the ring
+        oldest = self.ring.sequence - self.ring.capacity
+        for sequence in [s for s in self._encoded if s <= oldest]:
+            del self._encoded[sequence]
+        return messages
+
+    def _published(self):
+        messages = self._encode_new()
+        if not messages or not self._streams:
+            return
+        data = b"".join(messages)
+        for writer in list(self._streams):
+            self._send_stream(writer, data)
+
+    def _send_stream(self, writer, data):
+        transport = writer.transport
+        if transport.is_closing():
+            self._streams.discard(writer)
+        elif transport.get_write_buffer_size() > MAX_STREAM_BUFFER:
+            # A client that can't keep up is dropped instead of using up the
+            # memory. It can reconnect with Last-Event-ID.
+            self.dropped_streams += 1
+            self._streams.discard(writer)
+            writer.close()
+        else:
+            writer.write(data)
+
+    def _current_body(self):
+        sequence = self.ring.sequence
+        if self._current is None or self._current[0] != sequence:
+            latest = dict(self.ring.latest)
+            body = {"sequence": sequence}
+            for kind in ("sample", "record"):
+                event = latest.get(kind)
+                body[kind] = event[1] if event is not None else None
+            self._current = (sequence, _dumps(body).encode())
+        return self._current
+
+    def _events_body(self, since):
+        self._encode_new()
+        sequence = self._encoded_sequence
+        fragments = [
+            self._encoded[number][0]
+            for number in range(max(since, 0) + 1, sequence + 1)
+            if number in self._encoded
+        ]
+        return f'{{"sequence":{sequence},"events":[{",".join(fragments)}]}}'.encode()
+
+    ###########################################################################
+    # HTTP
+    ###########################################################################
+
+    def _response(self, status, body=b"", headers=None, keep_alive=True):
+        lines = [
+            f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}",
+            f"Content-Length: {len(body)}",
+            "Access-Control-Allow-Origin: *",
+            "Cache-Control: no-cache",
+        ]
+        if not keep_alive:
+            lines.append("Connection: close")
+        for name, value in (headers or {}).items():
+            lines.append(f"{name}: {value}")
+        return ("\r\n".join(lines) + "\r\n\r\n").encode() + body
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except asyncio.LimitOverrunError:
+                    writer.write(self._response(431, keep_alive=False))
+                    break
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+
+                request_line, *header_lines = head.decode("latin-1").split("\r\n")
+                try:
+                    method, target, version = request_line.split(" ", 2)
+                except ValueError:
+                    writer.write(self._response(400, keep_alive=False))
+                    break
+                headers = {}
+                for header in header_lines:
+                    name, colon, value = header.partition(":")
+                    if colon:
+                        headers[name.strip().lower()] = value.strip()
+                connection = headers.get("connection", "").lower()
+                if version == "HTTP/1.1":
+                    keep_alive = connection != "close"
+                else:
+                    keep_alive = connection == "keep-alive"
+                # Only GET requests are served, and they have no body
+                if "content-length" in headers or "transfer-encoding" in headers:
+                    keep_alive = False
+
+                self.requests += 1
+                url = urllib.parse.urlsplit(target)
+                query = urllib.parse.parse_qs(url.query)
+                if method not in ("GET", "HEAD"):
+                    response = self._response(405, b"", {"Allow": "GET"}, keep_alive)
+                elif url.path == "/stream":
+                    await self._stream(reader, writer, query, headers)
+                    return
+                elif url.path == "/current":
+                    sequence, body = self._current_body()
+                    etag = f'"{sequence}"'
+                    if headers.get("if-none-match") == etag:
+                        self.not_modified += 1
+                        response = self._response(304, b"", {"ETag": etag}, keep_alive)
+                    else:
+                        response = self._response(
+                            200, body, {"ETag": etag, **JSON_HEADERS}, keep_alive
+                        )
+                elif url.path == "/metrics":
+                    response = self._response(
+                        200, metrics.render().encode(), METRICS_HEADERS, keep_alive
+                    )
+                elif url.path == "/events":
+                    try:
+                        since = int(query.get("since", ["0"])[0])
+                    except ValueError:
+                        since = 0
+                    response = self._response(
+                        200, self._events_body(since), JSON_HEADERS, keep_alive
+                    )
+                else:
+                    response = self._response(404, b"", None, keep_alive)
+
+                if method == "HEAD":
+                    response = response[: response.index(b"\r\n\r\n") + 4]
+                writer.write(response)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._streams.discard(writer)
+            writer.close()
+
+    async def _stream(self, reader, writer, query, headers):
+        """
+        Sends the events to a Server-Sent Events client until it disconnects.
+        """
+        since = headers.get("last-event-id") or query.get("since", [None])[0]
+        writer.write(
+            (
+                "HTTP/1.1 200 OK\r\n"
+                "Content-Type: text/event-stream\r\n"
+                "Cache-Control: no-cache\r\n"
+                "Access-Control-Allow-Origin: *\r\n"
+                "Connection: keep-alive\r\n\r\n"
+                "retry: 2000\n\n"
+            ).encode()
+        )
+        # Catch up on the events missed since the client's last one
+        self._encode_new()
+        if since is not None:
+            try:
+                since = int(since)
+            except ValueError:
+                since = self._encoded_sequence
+            writer.write(
+                b"".join(
+                    self._encoded[number][1]
+                    for number in range(since + 1, self._encoded_sequence + 1)
+                    if number in self._encoded
+                )
+            )
+        self._streams.add(writer)
+
+        # The events are written by _published(), so this only waits for the
+        # client to go away and keeps the connection alive
+        while writer in self._streams:
+            try:
+                if not await asyncio.wait_for(reader.read(1024), KEEPALIVE_INTERVAL):
+                    break
+            except asyncio.TimeoutError:
+                if writer in self._streams:
+                    writer.write(b": keepalive\n\n")
+
+    ###########################################################################
+    # Running
+    ###########################################################################
+
+    def start(self, timeout=10.0):
+        """
+        Starts serving on a background thread. Raises the error if the server
+        couldn't be started, such as when the port is in use.
+        """
+        self._thread = threading.Thread(target=self._run, name="live_api", daemon=True)
+        self._thread.start()
+        self._ready.wait(timeout)
+        if self._error is not None:
+            raise self._error
+        logging.log(f"Live API: serving on port {self.port}")
+
+    def _run(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            self._server = loop.run_until_complete(
+                asyncio.start_server(
+                    self._handle_connection,
+                    self.host,
+                    self.port,
+                    limit=MAX_HEADER_SIZE,
+                    backlog=256,
+                )
+            )
+        except Exception as e:
+            self._error = e
+            self._ready.set()
+            loop.close()
+            return
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._loop = loop
+        self._ready.set()
+        try:
+            loop.run_forever()
+        finally:
+            self._loop = None
+            self._server.close()
+            for writer in list(self._streams):
+                writer.close()
+            # Finish the connections' tasks so they're not left pending
+            tasks = asyncio.all_tasks(loop)
+            for task in tasks:
+                task.cancel()
+            loop.run_until_complete(
+                asyncio.gather(*tasks, self._server.wait_closed(), return_exceptions=True)
+            )
+            loop.close()
+
+    def stop(self):
+        loop = self._loop
+        if loop is not None:
+            loop.call_soon_threadsafe(loop.stop)
+            self._thread.join()
+
+
+JSON_HEADERS = {"Content-Type": "application/json"}
+METRICS_HEADERS = {"Content-Type": "text/plain; version=0.0.4"}
@@ -2,39 +2,238 @@
 #
 # This file provides a function for logging messages while the weather and
 # EMF sensing station is running.
+#
+# Logging a message only adds it to an in-memory queue, so it is cheap to call
+# from the sampling loop and the sensor callbacks. A background thread formats
+# the queued messages and writes them to the log file, which is kept open.
+# Messages below the configured level are discarded before they are queued.
+# A program without a log file can have the messages written to stderr instead
+# (see initialize_stream()).
+#
+# The log file is rotated when it grows past MAX_LOG_SIZE or a new month
+# begins. The old log is renamed with the time it was rotated and gzip
+# compressed, and only the newest BACKUP_COUNT of them are kept.
 
+import atexit
+import collections
 import datetime
+import glob
+import gzip
 import os
+import shutil
+import sys
+import threading
+import time
+
+# Log levels
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+# Messages below this level are discarded
+log_level = INFO
+
+# How often the queued messages are written to the log file
+FLUSH_INTERVAL = 1.0  # Seconds
+
+# Rotate the log file when it grows larger than this many bytes
+MAX_LOG_SIZE = 10000000  # 10 MB
+
+# Rotate the log file at the beginning of every month
+ROTATE_MONTHLY = True
+
+# The number of compressed old log files to keep
+BACKUP_COUNT = 12
+
+# The oldest messages are dropped once this many are waiting, so messages
+# logged before (or without) the logger being initialized can't use up the
+# memory
+MAX_QUEUED = 100000
 
 log_file = ""
 
+_queue = collections.deque(maxlen=MAX_QUEUED)
+_stream = None
+_wake = threading.Event()
+_lock = threading.Lock()
+_thread = None
+_file = None
+_file_month = None
 
-def initialize_logger(log_file_location):
+
+def initialize_logger(log_file_location, level=INFO):
     """
     Create a log file with a timestamp as the name.
     """
     global log_file
+    global log_level
 
     # Create a new file named by the current date and time
     log_file = log_file_location
+    log_level = level
 
-    # Create the logs directory and log file if they don't already exist
-    if not os.path.exists(os.path.dirname(log_file)):
-        try:
-            os.makedirs(os.path.dirname(log_file))
-        except OSError as e:
-            if e.errno != errno.EEXIST:
-                raise
+    # Create the logs directory if it doesn't already exist. A bare file name
+    # is in the current directory.
+    if os.path.dirname(log_file):
+        os.makedirs(os.path.dirname(log_file), exist_ok=True)
 
+    _start()
 
-def log(message):
+
+def initialize_stream(stream=None, level=INFO):
     """
-    Write a log message to the previously created log file.
+    Write the messages to a stream (stderr by default) instead of a log file.
     """
-    global log_file
+    global _stream
+    global log_level
+
+    _stream = stream if stream is not None else sys.stderr
+    log_level = level
+    _start()
+
+
+def _start():
+    global _thread
+
+    if _thread is None:
+        _thread = threading.Thread(target=_run, name="logger", daemon=True)
+        _thread.start()
+        atexit.register(shutdown)
+
+
+def log(message, level=INFO):
+    """
+    Queue a log message to be written to the previously created log file.
+    """
+    if level < log_level:
+        return
+    _queue.append((time.time(), message))
+
+
+def debug(message):
+    if DEBUG < log_level:
+        return
+    _queue.append((time.time(), message))
+
+
+def warning(message):
+    log(message, WARNING)
+
+
+def error(message):
+    log(message, ERROR)
+    # Errors are written immediately in case the station is about to crash
+    _wake.set()
 
-    time = datetime.datetime.now().strftime("%m-%d-%Y--%H-%M-%S")
 
-    # Append a message to the log file
-    with open(log_file, "a") as file:
-        file.write(time + " -- " + message + "\n")
+def flush():
+    """
+    Write the queued messages to the log file now.
+    """
+    if not log_file and _stream is None:
+        return
+
+    with _lock:
+        _write_queued()
+
+
+def _write_queued():
+    lines = []
+    last_second = None
+    stamp = ""
+    while _queue:
+        timestamp, message = _queue.popleft()
+        second = int(timestamp)
+        # Most messages arrive in bursts, so the timestamp is only formatted
+        # once per second
+        if second != last_second:
+            last_second = second
+            stamp = datetime.datetime.fromtimestamp(second).strftime(
+                "%m-%d-%Y--%H-%M-%S"
+            )
+        lines.append(stamp + " -- " + message + "\n")
+
+    if not lines:
+        return
+
+    if _stream is not None:
+        _stream.write("".join(lines))
+        _stream.flush()
+        return
+
+    _rotate_if_needed()
+    if _file is None:
+        _open()
+    _file.write("".join(lines))
+    _file.flush()
+
+
+def shutdown():
+    """
+    Write any remaining messages and close the log file.
+    """
+    global _file
+
+    flush()
+    with _lock:
+        if _file is not None:
+            _file.close()
+            _file = None
+
+
+def _open():
+    global _file
+    global _file_month
+
+    _file = open(log_file, "a")
+    # A log reopened after a restart belongs to the month it was last
+    # written in, which may not be this one
+    if _file.tell():
+        written = datetime.date.fromtimestamp(os.fstat(_file.fileno()).st_mtime)
+    else:
+        written = datetime.date.today()
+    _file_month = (written.year, written.month)
+
+
+def _rotate_if_needed():
+    global _file
+
+    if _file is None:
+        if not os.path.exists(log_file):
+            return
+        _open()
+
+    today = datetime.date.today()
+    new_month = ROTATE_MONTHLY and (today.year, today.month) != _file_month
+    if _file.tell() < MAX_LOG_SIZE and not new_month:
+        return
+
+    _file.close()
+    _file = None
+
+    base = f"{log_file}.{datetime.datetime.now().strftime('%Y-%m-%d--%H-%M-%S')}"
+    rotated = base
+    suffix = 1
+    while os.path.exists(rotated + ".gz"):
+        rotated = f"{base}_{suffix}"
+        suffix += 1
+    os.replace(log_file, rotated)
+    with open(rotated, "rb") as source, gzip.open(rotated + ".gz", "wb") as dest:
+        shutil.copyfileobj(source, dest)
+    os.remove(rotated)
+
+    # Remove the oldest compressed logs
+    old_logs = sorted(glob.glob(glob.escape(log_file) + ".*.gz"))
+    for old_log in old_logs[:-BACKUP_COUNT]:
+        os.remove(old_log)
+
+
+def _run():
+    while True:
+        _wake.wait(FLUSH_INTERVAL)
+        _wake.clear()
+        try:
+            flush()
+        except Exception as e:
+            print(f"ERROR: Writing to the log file failed: {e}")
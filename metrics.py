@@ -0,0 +1,400 @@
+# Metrics
+#
+# Counters, gauges and latency histograms for seeing where the station spends
+# its time. They're kept in memory, served in the Prometheus text format at
+# /metrics by the live API (see live_api.py) and summarized in the log after
+# every record.
+#
+# The stages of the sampling loop are timed by using a histogram as a context
+# manager:
+#
+#   CSV_APPEND = metrics.stage("csv_append")
+#   ...
+#   with CSV_APPEND:
+#       data_file_writer.append(line)
+#
+# Timing a stage costs about half a microsecond on a desktop computer: it reads
+# the clock twice and appends the duration to a list. The durations are
+# counted into fixed buckets (4 per decade from a microsecond to 100 seconds)
+# in batches when the metrics are read, or once a thousand have built up.
+# Counters and gauges whose values are already kept elsewhere (such as the
+# number of anemometer pulses) read them through a function when the metrics
+# are rendered, which costs nothing in between.
+#
+# The metrics aren't locked. Each stage is only timed by one thread, and a
+# counter shared between threads could at worst miss an increment, which
+# doesn't matter for monitoring.
+#
+# Daniel Hornberger
+# 2021
+
+from bisect import bisect_left
+from time import perf_counter
+
+PREFIX = "weather_station_"
+
+# Values are counted into the buckets in batches of up to this many
+PENDING_LIMIT = 1024
+
+# The upper bounds of the histogram buckets in seconds
+BUCKETS = tuple(float(f"{10 ** (exponent / 4 - 6):.3g}") for exponent in range(33))
+
+
+def _format_value(value):
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels) + "}"
+
+
+def _short_name(metric):
+    """
+    Returns the name a metric is shown by in the summaries. The stages are
+    shown by their names alone.
+    """
+    name = metric.name[len(PREFIX):] if metric.name.startswith(PREFIX) else metric.name
+    if not metric.labels:
+        return name
+    values = ",".join(str(value) for _, value in metric.labels)
+    if name == "stage_seconds":
+        return values
+    return f"{name}[{values}]"
+
+
+def _bucket_quantile(counts, count, q):
+    """
+    Returns the upper bound of the bucket the q quantile falls in, or
+    infinity if it's above the largest bound.
+    """
+    rank = count * q
+    seen = 0
+    for bound, bucket in zip(BUCKETS, counts):
+        seen += bucket
+        if seen >= rank:
+            return bound
+    return float("inf")
+
+
+def _format_seconds(seconds):
+    if seconds < 0.001:
+        return f"{seconds * 1e6:.0f} us"
+    if seconds < 1:
+        return f"{seconds * 1000:.1f} ms"
+    return f"{seconds:.2f} s"
+
+
+class Counter:
+    """
+    A count that only goes up. If a function is given, the count is what it
+    returns.
+    """
+
+    kind = "counter"
+    __slots__ = ("name", "labels", "value", "function", "_reported")
+
+    def __init__(self, name, labels=(), function=None):
+        self.name = name
+        self.labels = labels
+        self.value = 0
+        self.function = function
+        self._reported = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def get(self):
+        return self.function() if self.function is not None else self.value
+
+    def samples(self):
+        return [(self.name + "_total", self.labels, self.get())]
+
+    def summary(self):
+        """
+        Returns the increase since the last summary.
+        """
+        value = self.get()
+        increase = value - self._reported
+        self._reported = value
+        return f"{_short_name(self)} +{_format_value(increase)}"
+
+
+class Gauge:
+    """
+    A value that can go up and down. If a function is given, the value is what
+    it returns.
+    """
+
+    kind = "gauge"
+    __slots__ = ("name", "labels", "value", "function")
+
+    def __init__(self, name, labels=(), function=None):
+        self.name = name
+        self.labels = labels
+        self.value = 0
+        self.function = function
+
+    def set(self, value):
+        self.value = value
+
+    def get(self):
+        return self.function() if self.function is not None else self.value
+
+    def samples(self):
+        return [(self.name, self.labels, self.get())]
+
+    def summary(self):
+        return f"{_short_name(self)} {_format_value(self.get())}"
+
+
+class Histogram:
+    """
+    Counts values, usually durations in seconds, in fixed buckets. It can be
+    used as a context manager to time a block, which must only be done by one
+    thread at a time.
+    """
+
+    kind = "histogram"
+    __slots__ = (
+        "name",
+        "labels",
+        "counts",
+        "sum",
+        "count",
+        "max",
+        "_pending",
+        "_start",
+        "_reported",
+    )
+
+    def __init__(self, name, labels=()):
+        self.name = name
+        self.labels = labels
+        # The last bucket counts the values above the largest bound
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+        # The largest value since the last summary
+        self.max = 0.0
+        # The values not yet counted in the buckets
+        self._pending = []
+        self._start = 0.0
+        self._reported = (list(self.counts), 0.0, 0)
+
+    def observe(self, value):
+        pending = self._pending
+        pending.append(value)
+        if len(pending) >= PENDING_LIMIT:
+            self.fold()
+
+    def __enter__(self):
+        self._start = perf_counter()
+
+    def __exit__(self, exception_type, exception, traceback):
+        # The same as observe(), which isn't called to save the time
+        pending = self._pending
+        pending.append(perf_counter() - self._start)
+        if len(pending) >= PENDING_LIMIT:
+            self.fold()
+
+    def fold(self):
+        """
+        Counts the pending values in the buckets. This is done when the
+        metrics are read, so recording a value only appends it to a list.
+        """
+        pending, self._pending = self._pending, []
+        counts = self.counts
+        for value in pending:
+            counts[bisect_left(BUCKETS, value)] += 1
+        if pending:
+            self.sum += sum(pending)
+            self.count += len(pending)
+            self.max = max(self.max, max(pending))
+
+    def quantile(self, q):
+        """
+        Returns an estimate of the q quantile (0 - 1) of all the values: the
+        upper bound of the bucket it falls in.
+        """
+        self.fold()
+        return _bucket_quantile(self.counts, self.count, q)
+
+    def samples(self):
+        self.fold()
+        samples = []
+        cumulative = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            cumulative += count
+            samples.append(
+                (self.name + "_bucket", self.labels + (("le", repr(bound)),), cumulative)
+            )
+        samples.append(
+            (self.name + "_bucket", self.labels + (("le", "+Inf"),), self.count)
+        )
+        samples.append((self.name + "_sum", self.labels, self.sum))
+        samples.append((self.name + "_count", self.labels, self.count))
+        return samples
+
+    def summary(self):
+        """
+        Returns the count, mean, 99th percentile and maximum of the values
+        since the last summary, or None if there weren't any.
+        """
+        self.fold()
+        counts, total, count = list(self.counts), self.sum, self.count
+        previous_counts, previous_total, previous_count = self._reported
+        self._reported = (counts, total, count)
+        maximum, self.max = self.max, 0.0
+
+        count -= previous_count
+        if count <= 0:
+            return None
+
+        p99 = min(
+            _bucket_quantile(
+                [now - before for now, before in zip(counts, previous_counts)],
+                count,
+                0.99,
+            ),
+            maximum,
+        )
+        mean = (total - previous_total) / count
+        return (
+            f"{_short_name(self)} {count}x mean {_format_seconds(mean)} "
+            f"p99 {_format_seconds(p99)} max {_format_seconds(maximum)}"
+        )
+
+
+class Registry:
+    """
+    Holds the metrics by name and labels so the same metric is returned each
+    time it's asked for.
+    """
+
+    def __init__(self, prefix=PREFIX):
+        self.prefix = prefix
+        self._metrics = {}
+        self._help = {}
+
+    def _get(self, cls, name, help, labels, **kwargs):
+        name = self.prefix + name
+        labels = tuple(sorted((labels or {}).items()))
+        key = (name, labels)
+        metric = self._metrics.get(key)
+        if metric is None:
+            metric = cls(name, labels, **kwargs)
+            self._metrics[key] = metric
+            self._help.setdefault(name, help)
+        elif not isinstance(metric, cls):
+            raise ValueError(f"{name} is already a {metric.kind}")
+        elif kwargs.get("function") is not None:
+            # Read the value from the latest object, such as after a subsystem
+            # is restarted
+            metric.function = kwargs["function"]
+        return metric
+
+    def counter(self, name, help, labels=None, function=None):
+        return self._get(Counter, name, help, labels, function=function)
+
+    def gauge(self, name, help, labels=None, function=None):
+        return self._get(Gauge, name, help, labels, function=function)
+
+    def histogram(self, name, help, labels=None):
+        return self._get(Histogram, name, help, labels)
+
+    def collect(self):
+        """
+        Returns the metrics sorted by name, each as (name, labels, metric)
+        where the labels are a dictionary.
+        """
+        return [
+            (name, dict(labels), metric)
+            for (name, labels), metric in sorted(self._metrics.items())
+        ]
+
+    def _read(self, metric):
+        """
+        Returns the samples of a metric, or none if its function fails, such
+        as when the object it reads from has been closed.
+        """
+        try:
+            return metric.samples()
+        except Exception:
+            return []
+
+    def render(self):
+        """
+        Returns the metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        previous_name = None
+        for (name, labels), metric in sorted(self._metrics.items()):
+            if name != previous_name:
+                lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} {metric.kind}")
+                previous_name = name
+            for sample_name, sample_labels, value in self._read(metric):
+                lines.append(
+                    f"{sample_name}{_format_labels(sample_labels)} {_format_value(value)}"
+                )
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """
+        Returns a line summarizing the metrics since the last summary: the
+        stage timings, then the counters' increases and the gauges' values.
+        """
+        parts = {"histogram": [], "counter": [], "gauge": []}
+        for _, metric in sorted(self._metrics.items()):
+            try:
+                part = metric.summary()
+            except Exception:
+                continue
+            if part is not None:
+                parts[metric.kind].append(part)
+        return "; ".join(", ".join(part) for part in parts.values() if part)
+
+
+REGISTRY = Registry()
+
+
+def counter(name, help, labels=None, function=None):
+    """
+    Returns the counter with the name and labels, creating it if needed.
+    """
+    return REGISTRY.counter(name, help, labels, function)
+
+
+def gauge(name, help, labels=None, function=None):
+    """
+    Returns the gauge with the name and labels, creating it if needed.
+    """
+    return REGISTRY.gauge(name, help, labels, function)
+
+
+def histogram(name, help, labels=None):
+    """
+    Returns the histogram with the name and labels, creating it if needed.
+    """
+    return REGISTRY.histogram(name, help, labels)
+
+
+def stage(name):
+    """
+    Returns the histogram that times a stage of the station's work.
+    """
+    return REGISTRY.histogram(
+        "stage_seconds", "How long each stage of the work took", {"stage": name}
+    )
+
+
+def render():
+    return REGISTRY.render()
+
+
+def summary():
+    return REGISTRY.summary()
@@ -0,0 +1,305 @@
+# Profiler
+#
+# A sampling profiler that can be switched on and off while the station is
+# running, for finding out where the time goes when it misbehaves in the
+# field. It's switched on and off by sending the station SIGUSR1:
+#
+#   pkill -USR1 -f weather_station.py
+#
+# or by creating and removing the control file (profile.on in the data
+# directory by default):
+#
+#   touch /mnt/usb1/data/profile.on    # Start
+#   rm /mnt/usb1/data/profile.on       # Stop
+#
+# While it's on, a background thread takes the stacks of all of the threads
+# (the sampling loop, the GPIO callbacks, the camera, the database writers,
+# the logger and so on) RATE times a second and counts how often each stack
+# is seen. The counts are written as collapsed stacks, one line per stack:
+#
+#   MainThread;main (weather_station.py);ticks (scheduler.py);sleep (sensor_backend.py) 4021
+#
+# which can be turned into a flame graph by flamegraph.pl or loaded into
+# speedscope. The file is rewritten every WRITE_INTERVAL seconds, so it's
+# useful even if the station is stopped while profiling.
+#
+# The sampling thread can only look at the other threads while it holds the
+# GIL, so the samples lean toward the places where the threads let go of it
+# (sleeping, waiting, and reading or writing files and sockets). A stack that
+# shows up often is where to look first, but py-spy gives an unbiased picture
+# where it can be installed.
+#
+# The output is bounded: only the most common MAX_STACKS stacks are counted
+# separately, a file is limited to max_file_size bytes, profiling stops by
+# itself after max_duration seconds, and only the newest max_files profiles
+# are kept.
+#
+# Nothing runs while it's off. The signal handler only starts or stops the
+# thread, and the control file is only looked for about once a second by
+# poll(), which costs the sampling loop a clock read otherwise.
+#
+# Daniel Hornberger
+# 2021
+
+import datetime
+import glob
+import os
+import signal
+import sys
+import threading
+import time
+
+import logger as logging
+
+# The signal that switches profiling on and off
+SIGNAL = getattr(signal, "SIGUSR1", None)
+
+# How often the stacks are sampled by default
+RATE = 100  # Samples per second
+
+# How often the collapsed stacks are written while profiling
+WRITE_INTERVAL = 10.0  # Seconds
+
+# How often poll() looks for the control file
+CONTROL_CHECK_INTERVAL = 1.0  # Seconds
+
+# The stacks seen after this many different ones are counted as "[other]"
+MAX_STACKS = 20000
+
+# Frames deeper than this are left out of a stack
+MAX_DEPTH = 128
+
+FILE_PATTERN = "profile-*.folded"
+
+
+def _label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)})"
+
+
+class Profiler:
+    """
+    Samples the stacks of all threads while it's running and writes them as
+    collapsed stacks to a new file in the directory each time it's started.
+    """
+
+    def __init__(
+        self,
+        directory,
+        rate=RATE,
+        max_duration=600.0,
+        max_file_size=1000000,
+        max_files=10,
+        control_file=None,
+    ):
+        self.directory = directory
+        self.interval = 1 / rate
+        self.max_duration = max_duration
+        self.max_file_size = max_file_size
+        self.max_files = max_files
+        self.control_file = control_file
+        self.path = None
+
+        # Reentrant since the signal handler runs on the main thread, which may
+        # be holding it in poll()
+        self._lock = threading.RLock()
+        self._thread = None
+        self._stop = None
+        self._control_present = False
+        self._next_check = 0.0
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def install(self):
+        """
+        Switches profiling on and off when SIGUSR1 is received. Returns False
+        if the signal can't be handled here (such as on Windows or when not
+        called from the main thread).
+        """
+        if SIGNAL is None:
+            return False
+        try:
+            signal.signal(SIGNAL, lambda number, frame: self.toggle())
+        except ValueError:
+            return False
+        return True
+
+    def poll(self):
+        """
+        Starts profiling when the control file is created and stops it when
+        the file is removed. Meant to be called on every tick, and only looks
+        for the file once every CONTROL_CHECK_INTERVAL seconds.
+        """
+        if self.control_file is None:
+            return
+        now = time.monotonic()
+        if now < self._next_check:
+            return
+        self._next_check = now + CONTROL_CHECK_INTERVAL
+
+        present = os.path.exists(self.control_file)
+        if present == self._control_present:
+            return
+        self._control_present = present
+        if present:
+            self.start("the control file was created")
+        else:
+            self.stop("the control file was removed")
+
+    def toggle(self):
+        if self.running:
+            self.stop("the signal was received")
+        else:
+            self.start("the signal was received")
+
+    def start(self, reason="it was asked to"):
+        with self._lock:
+            if self._thread is not None:
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            name = datetime.datetime.now().strftime("profile-%m-%d-%Y--%H-%M-%S")
+            self.path = os.path.join(self.directory, f"{name}.folded")
+            # Don't overwrite a profile started in the same second
+            number = 2
+            while os.path.exists(self.path):
+                self.path = os.path.join(self.directory, f"{name}-{number}.folded")
+                number += 1
+            # Each run has its own event so a run that's still finishing
+            # isn't started again
+            self._stop = threading.Event()
+            self._thread = threading.Thread(
+                target=self._run,
+                args=(self.path, self._stop),
+                name="profiler",
+                daemon=True,
+            )
+            self._thread.start()
+        logging.log(
+            f"Profiling started since {reason}, sampling {round(1 / self.interval)} "
+            f"times a second to {self.path}"
+        )
+
+    def stop(self, reason="it was asked to"):
+        """
+        Stops profiling. The thread writes the stacks one last time as it
+        finishes, which isn't waited for so this can be called from a signal
+        handler.
+        """
+        with self._lock:
+            if self._thread is None:
+                return
+            self._stop.set()
+            self._thread = None
+        logging.log(f"Profiling stopped since {reason}")
+
+    ###########################################################################
+    # Sampling
+    ###########################################################################
+
+    def _run(self, path, stopped):
+        counts = {}
+        labels = {}
+        names = {}
+        own = threading.get_ident()
+        samples = 0
+        sampling_time = 0.0
+        started = time.monotonic()
+        next_write = started + WRITE_INTERVAL
+        deadline = started + self.max_duration
+        next_sample = started
+
+        try:
+            while not stopped.is_set():
+                now = time.monotonic()
+                if now >= deadline:
+                    logging.log(
+                        f"Profiling stopped after the limit of {self.max_duration} seconds"
+                    )
+                    with self._lock:
+                        if self._thread is threading.current_thread():
+                            self._thread = None
+                    break
+
+                begin = time.perf_counter()
+                frames = sys._current_frames()
+                for ident, frame in frames.items():
+                    if ident == own:
+                        continue
+                    name = names.get(ident)
+                    if name is None:
+                        names.update(
+                            (thread.ident, thread.name) for thread in threading.enumerate()
+                        )
+                        name = names.get(ident, str(ident))
+                    stack = []
+                    while frame is not None and len(stack) < MAX_DEPTH:
+                        code = frame.f_code
+                        label = labels.get(code)
+                        if label is None:
+                            label = labels[code] = _label(code)
+                        stack.append(label)
+                        frame = frame.f_back
+                    stack.append(name)
+                    key = ";".join(reversed(stack))
+                    if key not in counts and len(counts) >= MAX_STACKS:
+                        key = f"{name};[other]"
+                    counts[key] = counts.get(key, 0) + 1
+                del frames, frame
+                samples += 1
+                sampling_time += time.perf_counter() - begin
+
+                if now >= next_write:
+                    self._write(path, counts)
+                    next_write = now + WRITE_INTERVAL
+                    # The thread ids are reused, so look up the names again
+                    names.clear()
+
+                next_sample += self.interval
+                if next_sample < now:
+                    # Fell behind, so skip the missed samples
+                    next_sample = now + self.interval
+                stopped.wait(next_sample - now)
+        except Exception as e:
+            logging.log(f"ERROR: Profiling failed: {e}")
+        finally:
+            self._write(path, counts)
+            self._remove_old()
+            elapsed = time.monotonic() - started
+            logging.log(
+                f"Profile written to {path}: {samples} samples over {round(elapsed, 1)} "
+                f"seconds, {round(sampling_time / max(elapsed, 1e-9) * 100, 2)}% of the "
+                f"time spent sampling"
+            )
+
+    def _write(self, path, counts):
+        """
+        Writes the collapsed stacks, the most common first, stopping before
+        the file grows past max_file_size. Written to a temporary file first
+        so a flame graph can be made from the file while it's being updated.
+        """
+        size = 0
+        temporary = path + ".tmp"
+        try:
+            with open(temporary, "w") as file:
+                for stack, count in sorted(
+                    counts.items(), key=lambda item: item[1], reverse=True
+                ):
+                    line = f"{stack} {count}\n"
+                    size += len(line)
+                    if size > self.max_file_size:
+                        break
+                    file.write(line)
+            os.replace(temporary, path)
+        except OSError as e:
+            logging.log(f"ERROR: Writing the profile failed: {e}")
+
+    def _remove_old(self):
+        profiles = sorted(
+            glob.glob(os.path.join(self.directory, FILE_PATTERN)), key=os.path.getmtime
+        )
+        for old in profiles[: max(len(profiles) - self.max_files, 0)]:
+            try:
+                os.remove(old)
+            except OSError:
+                pass
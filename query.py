@@ -0,0 +1,525 @@
+# Query
+#
+# A command line tool for querying and exporting the data files written by the
+# weather station. It reads the timestamped .csv data files in a directory,
+# or the binary chunk files in its columnar directory, filters the records by
+# time and field, and either exports them as .csv or calculates the min, max,
+# mean and sum of each field per hour, day or month.
+#
+# The files are read one record at a time so memory use doesn't grow with the
+# amount of data. When aggregating, the files are spread across a pool of
+# processes and the partial results are combined.
+#
+# Examples:
+#
+# Export the temperature and pressure for August:
+#   python3 query.py /mnt/usb1 --start 2021-08-01 --end 2021-09-01 \
+#       --fields "Temperature (F),Pressure (mbars)"
+#
+# Daily maximum wind gust and total precipitation. The precipitation is the
+# running total since midnight, so its daily maximum is the day's total (the
+# rollups in rollup.py sum what fell between the records for any period):
+#   python3 query.py /mnt/usb1 --aggregate day --functions max \
+#       --fields "Wind Gust (MPH),Precipitation (Inches)"
+#
+# Hourly lowest feels like temperature, calculated from the binary chunk files
+# (see derived.py):
+#   python3 query.py /mnt/usb1 --source columnar --derived --aggregate hour \
+#       --functions min --fields feels_like
+#
+# Daniel Hornberger
+# 2021
+
+import argparse
+import csv
+import datetime
+import glob
+import math
+import multiprocessing
+import os
+import sys
+
+import columnar_store
+import config
+import derived
+
+# The labels row written by weather_station.py
+CSV_LABELS = [
+    "Record Number",
+    "Time",
+    "Temperature (F)",
+    "Pressure (mbars)",
+    "Relative Humidity (%)",
+    "Wind Direction (Degrees)",
+    "Wind Direction (String)",
+    "Wind Speed (MPH)",
+    "Wind Gust (MPH)",
+    "Precipitation (Inches)",
+    "Image",
+]
+STRING_FIELDS = ["Wind Direction (String)", "Image"]
+NUMERIC_FIELDS = [
+    label for label in CSV_LABELS if label not in STRING_FIELDS and label != "Time"
+]
+# The fields calculated by derived.py that --derived adds
+DERIVED_LABELS = list(derived.LABELS.values())
+DERIVED_NUMERIC_FIELDS = [derived.LABELS[name] for name in derived.NUMERIC_NAMES]
+# Directions are averaged as vectors so 350 and 10 degrees average to 0
+DIRECTION_FIELD = "Wind Direction (Degrees)"
+
+# The station writes this when the BME280 sensor couldn't be read
+MISSING_VALUE = -1000.0
+
+# The data files are named by the time the station was started
+FILE_TIME_FORMAT = "%m-%d-%Y--%H-%M-%S"
+
+FUNCTIONS = ["min", "max", "mean", "sum", "count"]
+PERIODS = ["hour", "day", "month"]
+
+
+def bucket_start(time, period):
+    """
+    Returns the start of the hour, day or month the time falls in.
+    """
+    if period == "hour":
+        return time.replace(minute=0, second=0, microsecond=0)
+    if period == "day":
+        return time.replace(hour=0, minute=0, second=0, microsecond=0)
+    return time.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+###############################################################################
+# Reading
+###############################################################################
+
+
+def file_start_time(path):
+    """
+    Returns the time the data file was started from its name, or None.
+    """
+    name = os.path.splitext(os.path.basename(path))[0]
+    try:
+        return datetime.datetime.strptime(name, FILE_TIME_FORMAT)
+    except ValueError:
+        return None
+
+
+def csv_files(directory, end=None):
+    """
+    Returns the data files in the directory in the order they were started,
+    skipping any started after end.
+    """
+    files = []
+    for path in glob.glob(os.path.join(glob.escape(directory), "*.csv")):
+        started = file_start_time(path)
+        if started is None or (end is not None and started > end):
+            continue
+        files.append((started, path))
+    return [path for started, path in sorted(files)]
+
+
+def read_csv(path, start=None, end=None):
+    """
+    Yields the records of a data file between start and end as dictionaries
+    keyed by the labels, with the time parsed and the readings as floats. A
+    file without the weather station's labels row is skipped.
+    """
+    with open(path, newline="") as file:
+        reader = csv.reader(file)
+        labels = next(reader, None)
+        if labels != CSV_LABELS:
+            print(
+                f"Skipping {path} since it doesn't have the weather station labels row",
+                file=sys.stderr,
+            )
+            return
+
+        for row in reader:
+            if len(row) != len(CSV_LABELS):
+                continue
+            record = dict(zip(CSV_LABELS, row))
+            try:
+                record["Time"] = datetime.datetime.fromisoformat(record["Time"])
+                for label in NUMERIC_FIELDS:
+                    record[label] = float(record[label])
+            except ValueError:
+                continue
+            if start is not None and record["Time"] < start:
+                continue
+            if end is not None and record["Time"] >= end:
+                continue
+            yield record
+
+
+def columnar_range(directory):
+    """
+    Returns the start of the first day and the end of the last day stored in
+    the columnar directory, or None if it is empty.
+    """
+    if not os.path.isdir(directory):
+        return None
+    days = sorted(
+        name[: -len(columnar_store.CHUNK_SUFFIX)]
+        for name in os.listdir(directory)
+        if name.endswith(columnar_store.CHUNK_SUFFIX)
+    )
+    if not days:
+        return None
+    first = datetime.datetime.strptime(days[0], "%Y-%m-%d")
+    last = datetime.datetime.strptime(days[-1], "%Y-%m-%d")
+    return first, last + datetime.timedelta(days=1)
+
+
+def _derived_columns(derived_cache, chunk):
+    """
+    Returns the derived fields of the chunk's records from the cache by label,
+    with MISSING_VALUE for the ones that couldn't be calculated.
+    """
+    day = datetime.datetime.strptime(
+        os.path.basename(chunk.path)[: -len(columnar_store.CHUNK_SUFFIX)], "%Y-%m-%d"
+    ).date()
+    result = derived_cache.chunk(day)
+    columns = {}
+    for name in derived.NUMERIC_NAMES:
+        columns[derived.LABELS[name]] = [
+            MISSING_VALUE if math.isnan(value) else round(value, 1)
+            for value in result[name].tolist()
+        ]
+    columns[derived.LABELS["pressure_tendency_string"]] = [
+        "nan" if math.isnan(change) else derived.tendency_description(change)
+        for change in result["pressure_tendency"].tolist()
+    ]
+    return columns
+
+
+def read_columnar(directory, start, end, derived_cache=None):
+    """
+    Yields the records stored in the chunk files of the columnar directory
+    between start and end in the same format as read_csv(). The derived
+    fields are added from the derived.DerivedCache if one is given.
+    """
+    stored = columnar_range(directory)
+    if stored is None:
+        return
+    start = max(start, stored[0]) if start else stored[0]
+    end = min(end, stored[1]) if end else stored[1]
+    start_time = start.timestamp()
+    end_time = end.timestamp()
+
+    for chunk in columnar_store.chunks_between(directory, start, end):
+        columns = {
+            columnar_store.LABELS[name]: (
+                chunk.strings(name)
+                if name in columnar_store.STRING_COLUMNS
+                else chunk.column(name).tolist()
+            )
+            for name in columnar_store.COLUMN_NAMES
+        }
+        if derived_cache is not None:
+            columns.update(_derived_columns(derived_cache, chunk))
+        chunk.close()
+        for i, timestamp in enumerate(columns["Time"]):
+            if timestamp < start_time or timestamp >= end_time:
+                continue
+            record = {label: values[i] for label, values in columns.items()}
+            record["Time"] = datetime.datetime.fromtimestamp(timestamp)
+            # The readings are stored as float32, so round off the noise
+            # from converting them back
+            for label in NUMERIC_FIELDS:
+                record[label] = round(float(record[label]), 4)
+            yield record
+
+
+###############################################################################
+# Aggregation
+###############################################################################
+
+
+class Aggregate:
+    """
+    The running min, max, sum and count of a field within a bucket.
+    """
+
+    __slots__ = ["count", "total", "minimum", "maximum", "sin_sum", "cos_sum"]
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.minimum = math.inf
+        self.maximum = -math.inf
+        self.sin_sum = 0.0
+        self.cos_sum = 0.0
+
+    def add(self, value, direction=False, weight=1.0):
+        """
+        Adds a value. Directions are also added to the vector sums, scaled by
+        the weight (such as the wind speed).
+        """
+        self.count += 1
+        self.total += value
+        self.minimum = min(self.minimum, value)
+        self.maximum = max(self.maximum, value)
+        if direction:
+            self.sin_sum += weight * math.sin(math.radians(value))
+            self.cos_sum += weight * math.cos(math.radians(value))
+
+    def merge(self, other):
+        self.count += other.count
+        self.total += other.total
+        self.minimum = min(self.minimum, other.minimum)
+        self.maximum = max(self.maximum, other.maximum)
+        self.sin_sum += other.sin_sum
+        self.cos_sum += other.cos_sum
+
+    def to_list(self):
+        return [getattr(self, name) for name in self.__slots__]
+
+    @classmethod
+    def from_list(cls, values):
+        aggregate = cls()
+        for name, value in zip(cls.__slots__, values):
+            setattr(aggregate, name, value)
+        return aggregate
+
+    def result(self, function, direction=False):
+        if self.count == 0:
+            return ""
+        if function == "min":
+            return self.minimum
+        if function == "max":
+            return self.maximum
+        if function == "sum":
+            return round(self.total, 4)
+        if function == "count":
+            return self.count
+        if direction:
+            return round(math.degrees(math.atan2(self.sin_sum, self.cos_sum)), 1) % 360.0
+        return round(self.total / self.count, 2)
+
+
+def aggregate_records(records, fields, period):
+    """
+    Returns a dictionary mapping each bucket start to a dictionary of the
+    Aggregate of each field.
+    """
+    buckets = {}
+    for record in records:
+        key = bucket_start(record["Time"], period)
+        aggregates = buckets.get(key)
+        if aggregates is None:
+            aggregates = buckets[key] = {field: Aggregate() for field in fields}
+        for field in fields:
+            value = record[field]
+            if value == MISSING_VALUE:
+                continue
+            aggregates[field].add(value, field == DIRECTION_FIELD)
+    return buckets
+
+
+def _aggregate_file(job):
+    """
+    Aggregates a single file. This runs in a worker process.
+    """
+    source, path, start, end, fields, period, calibration = job
+    if source == "columnar":
+        derived_cache = None
+        if calibration is not None:
+            derived_cache = derived.DerivedCache.from_settings(path, calibration)
+        records = read_columnar(path, start, end, derived_cache)
+    else:
+        records = read_csv(path, start, end)
+    return aggregate_records(records, fields, period)
+
+
+def _columnar_jobs(directory, start, end):
+    """
+    Splits a query of the columnar store into one job per month so they can
+    run in parallel.
+    """
+    stored = columnar_range(directory)
+    if stored is None:
+        return
+    first = max(start, stored[0]) if start else stored[0]
+    last = min(end, stored[1]) if end else stored[1]
+    month = bucket_start(first, "month")
+    while month < last:
+        next_month = (month + datetime.timedelta(days=32)).replace(day=1)
+        yield max(month, first), min(next_month, last)
+        month = next_month
+
+
+def aggregate(
+    directory, source, start, end, fields, period, processes=None, calibration=None
+):
+    """
+    Aggregates the records across all of the files using a pool of processes
+    and returns the merged buckets in time order. The derived fields are
+    calculated from the columnar store with the calibration settings if
+    they're given.
+    """
+    if source == "columnar":
+        columnar_directory = os.path.join(directory, "columnar")
+        jobs = [
+            (
+                "columnar",
+                columnar_directory,
+                job_start,
+                job_end,
+                fields,
+                period,
+                calibration,
+            )
+            for job_start, job_end in _columnar_jobs(columnar_directory, start, end)
+        ]
+    else:
+        jobs = [
+            ("csv", path, start, end, fields, period, None)
+            for path in csv_files(directory, end)
+        ]
+
+    merged = {}
+    with multiprocessing.Pool(processes) as pool:
+        for buckets in pool.imap_unordered(_aggregate_file, jobs):
+            for key, aggregates in buckets.items():
+                if key not in merged:
+                    merged[key] = aggregates
+                    continue
+                for field, value in aggregates.items():
+                    merged[key][field].merge(value)
+    return sorted(merged.items())
+
+
+###############################################################################
+# Command Line
+###############################################################################
+
+
+def parse_time(value):
+    return datetime.datetime.fromisoformat(value)
+
+
+def parse_fields(value):
+    """
+    Accepts the .csv labels or the short columnar names separated by commas,
+    including the derived ones.
+    """
+    if not value:
+        return None
+    fields = []
+    for field in value.split(","):
+        field = field.strip()
+        field = columnar_store.LABELS.get(field, field)
+        field = derived.LABELS.get(field, field)
+        if field not in CSV_LABELS and field not in DERIVED_LABELS:
+            raise argparse.ArgumentTypeError(f"Unknown field: {field}")
+        fields.append(field)
+    return fields
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Query and export the weather station data files"
+    )
+    parser.add_argument("directory", help="The directory holding the data files")
+    parser.add_argument("--start", type=parse_time, help="e.g. 2021-08-01 or 2021-08-01T06:00")
+    parser.add_argument("--end", type=parse_time, help="Records before this time are included")
+    parser.add_argument("--fields", type=parse_fields, help="Comma separated fields to include")
+    parser.add_argument(
+        "--source",
+        choices=["csv", "columnar"],
+        default="csv",
+        help="Read the .csv files or the binary chunk files",
+    )
+    parser.add_argument("--aggregate", choices=PERIODS, help="Aggregate the records per period")
+    parser.add_argument(
+        "--functions",
+        default="min,max,mean,sum",
+        help=f"Comma separated aggregate functions from {','.join(FUNCTIONS)}",
+    )
+    parser.add_argument(
+        "--derived",
+        action="store_true",
+        help="Add the dew point, feels like temperature, pressure tendency and so "
+        "on (only with --source columnar)",
+    )
+    parser.add_argument(
+        "--config",
+        metavar="FILE",
+        help="Read the calibration for --derived from FILE instead of the default",
+    )
+    parser.add_argument("--processes", type=int, help="Number of worker processes")
+    parser.add_argument("--output", help="Write to this file instead of stdout")
+    args = parser.parse_args(argv)
+
+    calibration = None
+    labels = CSV_LABELS
+    numeric_fields = NUMERIC_FIELDS
+    if args.derived:
+        if args.source != "columnar":
+            parser.error("--derived needs --source columnar")
+        calibration = config.load(args.config).calibration
+        labels = CSV_LABELS + DERIVED_LABELS
+        numeric_fields = NUMERIC_FIELDS + DERIVED_NUMERIC_FIELDS
+    elif args.fields and any(field in DERIVED_LABELS for field in args.fields):
+        parser.error("The derived fields need --derived")
+
+    output = open(args.output, "w", newline="") if args.output else sys.stdout
+    writer = csv.writer(output)
+
+    if args.aggregate:
+        fields = [f for f in (args.fields or numeric_fields) if f in numeric_fields]
+        functions = [f.strip() for f in args.functions.split(",")]
+        for function in functions:
+            if function not in FUNCTIONS:
+                parser.error(f"Unknown function: {function}")
+
+        writer.writerow(
+            [args.aggregate.capitalize()]
+            + [f"{field} {function}" for field in fields for function in functions]
+        )
+        for key, aggregates in aggregate(
+            args.directory,
+            args.source,
+            args.start,
+            args.end,
+            fields,
+            args.aggregate,
+            args.processes,
+            calibration,
+        ):
+            writer.writerow(
+                [key]
+                + [
+                    aggregates[field].result(function, field == DIRECTION_FIELD)
+                    for field in fields
+                    for function in functions
+                ]
+            )
+    else:
+        fields = ["Time"] + [f for f in (args.fields or labels) if f != "Time"]
+        writer.writerow(fields)
+        if args.source == "columnar":
+            columnar_directory = os.path.join(args.directory, "columnar")
+            derived_cache = None
+            if calibration is not None:
+                derived_cache = derived.DerivedCache.from_settings(
+                    columnar_directory, calibration
+                )
+            sources = [
+                read_columnar(columnar_directory, args.start, args.end, derived_cache)
+            ]
+        else:
+            sources = (
+                read_csv(path, args.start, args.end)
+                for path in csv_files(args.directory, args.end)
+            )
+        for records in sources:
+            for record in records:
+                writer.writerow([record[field] for field in fields])
+
+    if args.output:
+        output.close()
+
+
+if __name__ == "__main__":
+    main()
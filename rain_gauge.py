@@ -0,0 +1,199 @@
+# Rain Gauge
+#
+# Calculates the rainfall, rain rate and rain events from the times of the
+# rain gauge's bucket tips.
+#
+# The sensor callback only adds the time of each tip to a TimestampRing kept
+# in a memory mapped file, so a tip costs a single store into memory even
+# during a storm. The number of tips in the file is saved by flush(), which
+# the main loop calls on every tick, so the tips survive a restart and the
+# day's total is simply the number of tips since midnight. A tip that comes
+# sooner than DEBOUNCE seconds after the previous one is switch bounce and is
+# ignored.
+#
+# The tips are stored as wall clock times (epoch seconds) rather than the
+# monotonic time used for the wind, since they have to mean the same thing
+# after a restart.
+#
+# A rain event is a series of tips with no gap longer than EVENT_GAP.
+#
+# Ensure the following connections to the Raspberry Pi 3 Model B:
+#
+# Pin 3 on the RJ11 connector to Ground
+# Pin 4 on the RJ11 connector to BCM 6
+
+import collections
+import datetime
+import math
+import mmap
+import os
+import struct
+
+from timestamp_ring import TimestampRing
+
+BUCKET_SIZE = 0.011  # Inches per bucket tip
+
+# Tips closer together than this are switch bounce
+DEBOUNCE = 0.5  # Seconds
+
+# A gap between tips longer than this ends a rain event
+EVENT_GAP = 3600  # Seconds
+
+# The window the rain rate is averaged over and the window used for the
+# highest rain rate (the intensity) within a log interval
+RATE_WINDOW = 3600  # Seconds
+INTENSITY_WINDOW = 300  # Seconds
+INTENSITY_STEP = 60  # Seconds
+
+# Room for enough tips to hold years of rain
+CAPACITY = 65536
+
+MAGIC = b"WXRAIN\x00\x01"
+# magic, capacity, count
+HEADER = struct.Struct("<8sIxxxxQ")
+HEADER_SIZE = 64
+
+# The start and end times (epoch seconds) of a rain event, its total rainfall
+# in inches and whether it's still going on
+RainEvent = collections.namedtuple("RainEvent", ["start", "end", "total", "ongoing"])
+
+
+class RainEngine:
+    """
+    Records the bucket tips in the file at path and calculates the rainfall
+    from them in inches.
+    """
+
+    def __init__(
+        self, path, bucket_size=BUCKET_SIZE, debounce=DEBOUNCE, capacity=CAPACITY
+    ):
+        self.path = path
+        self.bucket_size = bucket_size
+        self.debounce = debounce
+        self.bounces = 0
+
+        ring = TimestampRing(capacity)
+        size = HEADER_SIZE + 8 * ring.capacity
+        if os.path.exists(path) and os.path.getsize(path) == size:
+            with open(path, "rb") as file:
+                magic, stored_capacity, count = HEADER.unpack(file.read(HEADER.size))
+            if magic != MAGIC or stored_capacity != ring.capacity:
+                count = None
+        else:
+            count = None
+
+        if count is None:
+            # Start a new file
+            count = 0
+            with open(path + ".tmp", "wb") as file:
+                file.truncate(size)
+                file.write(HEADER.pack(MAGIC, ring.capacity, 0))
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(path + ".tmp", path)
+
+        self._file = open(path, "r+b")
+        self._map = mmap.mmap(self._file.fileno(), size)
+        # The views have to be released before the map can be closed
+        self._views = [memoryview(self._map)]
+        self._views.append(self._views[0][HEADER_SIZE:])
+        self._views.append(self._views[1].cast("d"))
+        self.tips = TimestampRing(ring.capacity, self._views[2], count)
+        self._saved_count = count
+
+    def tip(self, timestamp):
+        """
+        Records a bucket tip. This is called from the sensor callback.
+        """
+        latest = self.tips.latest()
+        if latest is not None:
+            if 0 <= timestamp - latest < self.debounce:
+                self.bounces += 1
+                return
+            # Keep the tips in order if the clock was set back
+            if timestamp < latest:
+                timestamp = latest
+        self.tips.push(timestamp)
+
+    def flush(self):
+        """
+        Saves the tips recorded so far to the disk.
+        """
+        count = self.tips.count
+        if count == self._saved_count:
+            return
+        self._map.flush()
+        HEADER.pack_into(self._map, 0, MAGIC, self.tips.capacity, count)
+        self._map.flush()
+        self._saved_count = count
+
+    def close(self):
+        self.flush()
+        self.tips = None
+        for view in reversed(self._views):
+            view.release()
+        self._map.close()
+        self._file.close()
+
+    def rainfall(self, start, end):
+        """
+        Returns the rainfall in inches between the start and end times.
+        """
+        return self.tips.count_between(start, end) * self.bucket_size
+
+    def daily_total(self, now):
+        """
+        Returns the rainfall since midnight of the local datetime now.
+        """
+        midnight = datetime.datetime.combine(now.date(), datetime.time())
+        return self.rainfall(midnight.timestamp(), math.inf)
+
+    def rate(self, end, window=RATE_WINDOW):
+        """
+        Returns the rain rate in inches per hour over the window seconds
+        before the end time.
+        """
+        return self.rainfall(end - window, end) * 3600 / window
+
+    def max_rate(self, start, end, window=INTENSITY_WINDOW, step=INTENSITY_STEP):
+        """
+        Returns the highest rain rate in inches per hour over window seconds
+        between the start and end times.
+        """
+        if end - start <= window:
+            return self.rate(end, end - start) if end > start else 0.0
+
+        times = self.tips.between(start, end)
+        total = len(times)
+        highest = 0
+        entered = 0
+        left = 0
+        for i in range(int((end - start - window) / step) + 1):
+            window_end = start + window + i * step
+            window_start = window_end - window
+            while entered < total and times[entered] < window_end:
+                entered += 1
+            while left < entered and times[left] < window_start:
+                left += 1
+            highest = max(highest, entered - left)
+        return highest * self.bucket_size * 3600 / window
+
+    def last_event(self, now, gap=EVENT_GAP, lookback=7 * 24 * 3600):
+        """
+        Returns the most recent RainEvent that started within lookback
+        seconds of now, or None if it hasn't rained in that time.
+        """
+        times = self.tips.between(now - lookback, math.inf)
+        if not times:
+            return None
+
+        first = len(times) - 1
+        while first > 0 and times[first] - times[first - 1] <= gap:
+            first -= 1
+        tips = len(times) - first
+        return RainEvent(
+            times[first],
+            times[-1],
+            tips * self.bucket_size,
+            now - times[-1] <= gap,
+        )
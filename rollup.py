@@ -0,0 +1,333 @@
+# Rollup
+#
+# Keeps hourly, daily and monthly summaries of the weather records up to date
+# so long range graphs don't have to read every 15 minute record.
+#
+# Every record is added to the open hour, day and month buckets as it is
+# logged, which takes the same amount of time no matter how much data has been
+# collected. The open buckets are written to the database after every record,
+# replacing the previous point for the same bucket, so the rollup measurements
+# (weather_hourly, weather_daily and weather_monthly) are always current. When
+# a bucket closes it is appended to hourly.csv, daily.csv or monthly.csv in
+# the rollup directory. The open buckets are saved to state.json so a restart
+# picks up where it left off.
+#
+# The precipitation recorded by the station is the running total for the day,
+# so the amount that fell since the previous record is what gets summed.
+#
+# If the station was off for a while, or the rollups need to be recalculated,
+# they can be rebuilt from the data files:
+#
+#   python3 rollup.py /mnt/usb1 --start 2021-08-01 --end 2021-09-01
+#
+# Daniel Hornberger
+# 2021
+
+import argparse
+import csv
+import datetime
+import json
+import os
+import shutil
+
+import columnar_store
+import query
+from query import Aggregate
+
+PERIODS = ["hour", "day", "month"]
+FILE_NAMES = {"hour": "hourly.csv", "day": "daily.csv", "month": "monthly.csv"}
+MEASUREMENTS = {
+    "hour": "weather_hourly",
+    "day": "weather_daily",
+    "month": "weather_monthly",
+}
+STATE_FILE = "state.json"
+
+# The fields that are summarized and the summaries kept for each
+FIELDS = [
+    ("temperature", ["min", "max", "mean"]),
+    ("pressure", ["min", "max", "mean"]),
+    ("humidity", ["min", "max", "mean"]),
+    ("wind_speed", ["min", "max", "mean"]),
+    ("wind_gust", ["min", "max", "mean"]),
+    ("wind_direction", ["mean"]),
+    ("precipitation", ["sum"]),
+]
+FIELD_NAMES = [name for name, functions in FIELDS]
+LABELS = [
+    f"{columnar_store.LABELS[name]} {function}"
+    for name, functions in FIELDS
+    for function in functions
+]
+
+
+class Bucket:
+    """
+    The aggregates of every field over one hour, day or month.
+    """
+
+    def __init__(self, start):
+        self.start = start
+        self.aggregates = {name: Aggregate() for name in FIELD_NAMES}
+
+    def add(self, record, rainfall):
+        for name in FIELD_NAMES:
+            if name == "precipitation":
+                self.aggregates[name].add(rainfall)
+                continue
+            value = record[name]
+            if value == query.MISSING_VALUE:
+                continue
+            # Directions are weighted by the wind speed
+            self.aggregates[name].add(
+                value, name == "wind_direction", record["wind_speed"]
+            )
+
+    def results(self):
+        """
+        Returns a dictionary of each summary keyed by its label.
+        """
+        results = {}
+        for name, functions in FIELDS:
+            aggregate = self.aggregates[name]
+            for function in functions:
+                result = aggregate.result(function, name == "wind_direction")
+                results[f"{columnar_store.LABELS[name]} {function}"] = result
+        return results
+
+    def to_dict(self):
+        return {
+            "start": self.start.isoformat(),
+            "aggregates": {
+                name: aggregate.to_list() for name, aggregate in self.aggregates.items()
+            },
+        }
+
+    @classmethod
+    def from_dict(cls, values):
+        bucket = cls(datetime.datetime.fromisoformat(values["start"]))
+        for name, aggregate in values["aggregates"].items():
+            bucket.aggregates[name] = Aggregate.from_list(aggregate)
+        return bucket
+
+
+class RollupEngine:
+    """
+    Adds records to the open buckets, writes the closed buckets to the rollup
+    files and the open buckets to the database writer, if one is given.
+    """
+
+    def __init__(self, directory, writer=None, tags=None):
+        self.directory = directory
+        self.writer = writer
+        self.tags = tags or {}
+        self.buckets = {}
+        self.previous_precipitation = None
+
+        os.makedirs(directory, exist_ok=True)
+        self._load_state()
+
+    def _load_state(self):
+        try:
+            with open(os.path.join(self.directory, STATE_FILE)) as file:
+                state = json.load(file)
+        except (OSError, ValueError):
+            return
+        self.buckets = {
+            period: Bucket.from_dict(bucket)
+            for period, bucket in state["buckets"].items()
+        }
+        self.previous_precipitation = state["previous_precipitation"]
+
+    def _save_state(self):
+        path = os.path.join(self.directory, STATE_FILE)
+        state = {
+            "buckets": {
+                period: bucket.to_dict() for period, bucket in self.buckets.items()
+            },
+            "previous_precipitation": self.previous_precipitation,
+        }
+        with open(path + ".tmp", "w") as file:
+            json.dump(state, file)
+        os.replace(path + ".tmp", path)
+
+    def _rainfall(self, record):
+        """
+        Returns the precipitation since the previous record. When the
+        station's total drops, it has been reset and everything in the new
+        total fell since the previous record.
+        """
+        total = record["precipitation"]
+        previous = self.previous_precipitation
+        self.previous_precipitation = total
+        if previous is None or total < previous:
+            return total
+        return total - previous
+
+    def _close(self, period, bucket):
+        path = os.path.join(self.directory, FILE_NAMES[period])
+        new_file = not os.path.exists(path)
+        with open(path, "a", newline="") as file:
+            writer = csv.writer(file)
+            if new_file:
+                writer.writerow(["Start"] + LABELS)
+            results = bucket.results()
+            writer.writerow([bucket.start] + [results[label] for label in LABELS])
+
+    def _point(self, period, bucket):
+        fields = {
+            label: float(value)
+            for label, value in bucket.results().items()
+            if value != ""
+        }
+        return {
+            "measurement": MEASUREMENTS[period],
+            "tags": self.tags,
+            "time": datetime.datetime.utcfromtimestamp(bucket.start.timestamp()),
+            "fields": fields,
+        }
+
+    def add(self, record, save=True):
+        """
+        Adds a record given as a dictionary keyed by the columnar store's
+        COLUMN_NAMES with a local datetime as the time.
+        """
+        rainfall = self._rainfall(record)
+        points = []
+        for period in PERIODS:
+            start = query.bucket_start(record["time"], period)
+            bucket = self.buckets.get(period)
+            if bucket is None or bucket.start != start:
+                if bucket is not None:
+                    self._close(period, bucket)
+                bucket = self.buckets[period] = Bucket(start)
+            bucket.add(record, rainfall)
+            points.append(self._point(period, bucket))
+
+        if self.writer is not None:
+            self.writer.write_points(points)
+        if save:
+            self._save_state()
+
+    def close_all(self):
+        """
+        Closes the open buckets, writing them to the rollup files.
+        """
+        for period, bucket in self.buckets.items():
+            self._close(period, bucket)
+        self.buckets = {}
+        self._save_state()
+
+
+###############################################################################
+# Rebuilding
+###############################################################################
+
+
+def _records(data_directory, start, end):
+    """
+    Yields the records of the data files in time order in the format used by
+    RollupEngine.add().
+    """
+    names = {label: name for name, label in columnar_store.LABELS.items()}
+    for path in query.csv_files(data_directory, end):
+        for record in query.read_csv(path, start, end):
+            yield {names[label]: value for label, value in record.items()}
+
+
+def _read_rows(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, newline="") as file:
+        reader = csv.reader(file)
+        next(reader, None)
+        return list(reader)
+
+
+def rebuild(
+    data_directory, rollup_directory, start=None, end=None, writer=None, tags=None
+):
+    """
+    Recalculates the rollups from the data files between start and end and
+    replaces the rows of the rollup files for that time. The start and end
+    should fall on month boundaries so no bucket is only partly rebuilt.
+    """
+    # The buckets are rebuilt in their own directory, left over if an
+    # earlier rebuild was interrupted
+    rebuilt_directory = os.path.join(rollup_directory, "rebuild")
+    shutil.rmtree(rebuilt_directory, ignore_errors=True)
+
+    engine = RollupEngine(rebuilt_directory, writer, tags)
+    for record in _records(data_directory, start, end):
+        engine.add(record, save=False)
+    engine.close_all()
+
+    # All of the new rollup files are written before any of them replaces the
+    # old one, so a failure can't leave them partly rebuilt
+    paths = []
+    for period, name in FILE_NAMES.items():
+        rebuilt = _read_rows(os.path.join(rebuilt_directory, name))
+        rebuilt_starts = {row[0] for row in rebuilt}
+        kept = [
+            row
+            for row in _read_rows(os.path.join(rollup_directory, name))
+            if row[0] not in rebuilt_starts
+            and not (
+                (start is None or row[0] >= str(start))
+                and (end is None or row[0] < str(end))
+            )
+        ]
+        path = os.path.join(rollup_directory, name)
+        with open(path + ".tmp", "w", newline="") as file:
+            csv_writer = csv.writer(file)
+            csv_writer.writerow(["Start"] + LABELS)
+            csv_writer.writerows(sorted(kept + rebuilt))
+        paths.append(path)
+    for path in paths:
+        os.replace(path + ".tmp", path)
+    shutil.rmtree(rebuilt_directory)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Rebuild the hourly, daily and monthly rollups from the data files"
+    )
+    parser.add_argument("directory", help="The directory holding the data files")
+    parser.add_argument(
+        "--rollup-directory",
+        help="Where the rollup files are kept (default: <directory>/rollups)",
+    )
+    parser.add_argument("--start", type=query.parse_time, help="e.g. 2021-08-01")
+    parser.add_argument("--end", type=query.parse_time, help="e.g. 2021-09-01")
+    parser.add_argument(
+        "--influx",
+        metavar="URL",
+        help="Also write the rebuilt rollups to the database, e.g. http://localhost:8086",
+    )
+    parser.add_argument("--location", default="backyard", help="The location tag")
+    args = parser.parse_args(argv)
+
+    rollup_directory = args.rollup_directory or os.path.join(args.directory, "rollups")
+    writer = None
+    if args.influx:
+        from influx_writer import InfluxWriter
+
+        writer = InfluxWriter(os.path.join(rollup_directory, "influx_queue"), args.influx)
+        writer.start()
+
+    rebuild(
+        args.directory,
+        rollup_directory,
+        args.start,
+        args.end,
+        writer,
+        {"location": args.location},
+    )
+
+    if writer is not None:
+        # Give the writer time to send the queued points
+        writer.stop(timeout=60.0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+# Running Statistics
+#
+# Keeps the count, mean, minimum, maximum and variance of a series of values
+# as they are added, without storing the values. The mean and variance are
+# updated with Welford's method, which stays accurate over many values.
+#
+# Daniel Hornberger
+# 2021
+
+import math
+
+
+class RunningStats:
+    """
+    The statistics of the values added since the last reset.
+    """
+
+    __slots__ = ["count", "mean", "min", "max", "_m2"]
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.mean = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self._m2 = 0.0
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        """
+        Adds the values of another RunningStats to this one.
+        """
+        if other.count == 0:
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self._m2 += other._m2 + delta * delta * self.count * other.count / count
+        self.mean += delta * other.count / count
+        self.count = count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def variance(self):
+        """
+        Returns the population variance, or 0 if there are no values.
+        """
+        return self._m2 / self.count if self.count else 0.0
+
+    def std_dev(self):
+        return math.sqrt(self.variance())
@@ -0,0 +1,123 @@
+# Scheduler
+#
+# Fires the accumulation and log ticks of the weather station on fixed
+# deadlines. The deadlines are aligned to wall clock boundaries (a 900 second
+# log interval fires at :00, :15, :30 and :45) but are tracked with the
+# monotonic clock, so time spent taking pictures or writing the data doesn't
+# make the schedule drift and changes to the system time don't disturb it.
+#
+# If a tick is handled so late that one or more deadlines have already passed,
+# the missed ticks are fired immediately one after another rather than
+# skipped, so every slot is accounted for. The lateness of every tick is
+# reported so overruns can be logged. The lateness and how long each tick's
+# work took are also kept in the metrics (see metrics.py).
+#
+# Daniel Hornberger
+# 2021
+
+import collections
+import math
+from time import perf_counter
+
+import metrics
+
+LATENESS = metrics.histogram(
+    "tick_lateness_seconds", "How long after its deadline each tick fired"
+)
+OVERRUNS = metrics.counter(
+    "tick_overruns", "Ticks that fired after the following deadline had passed"
+)
+# The time from when a tick fires until the loop asks for the next one, kept
+# separately for the log ticks since they also write the record
+TICK_WORK = metrics.stage("tick")
+LOG_TICK_WORK = metrics.stage("log_tick")
+
+# A single scheduled tick
+#
+# number   - The number of the slot counted from the epoch. Consecutive ticks
+#            always have consecutive numbers.
+# deadline - The monotonic time the tick was scheduled for
+# time     - The monotonic time the tick actually fired
+# lateness - How many seconds after the deadline the tick fired
+# is_log   - True if the readings should be logged on this tick
+Tick = collections.namedtuple(
+    "Tick", ["number", "deadline", "time", "lateness", "is_log"]
+)
+
+
+class Scheduler:
+    """
+    Generates ticks every accumulation_interval seconds. Every tick that
+    lands on a multiple of log_interval is a log tick. The clock must provide
+    time(), monotonic() and sleep() such as a sensor backend.
+    """
+
+    def __init__(self, accumulation_interval, log_interval, clock):
+        ticks_per_log = log_interval / accumulation_interval
+        if accumulation_interval <= 0 or ticks_per_log != int(ticks_per_log):
+            raise ValueError(
+                "The log interval must be a multiple of the accumulation interval"
+            )
+
+        self.accumulation_interval = accumulation_interval
+        self.log_interval = log_interval
+        self.ticks_per_log = int(ticks_per_log)
+        self.clock = clock
+        self.reset_stats()
+
+    def reset_stats(self):
+        """
+        Clears the lateness statistics.
+        """
+        self.tick_count = 0
+        self.overruns = 0
+        self.total_lateness = 0.0
+        self.max_lateness = 0.0
+
+    def summary(self):
+        """
+        Returns a string summarizing the lateness of the ticks since the
+        statistics were last reset.
+        """
+        mean = self.total_lateness / self.tick_count if self.tick_count else 0.0
+        return (
+            f"{self.tick_count} ticks, {self.overruns} overruns, "
+            f"mean lateness {mean * 1000:.1f} ms, "
+            f"max lateness {self.max_lateness * 1000:.1f} ms"
+        )
+
+    def ticks(self):
+        """
+        Yields a Tick at every deadline, sleeping until it arrives.
+        """
+        interval = self.accumulation_interval
+
+        # The offset between the two clocks is only measured once so the
+        # deadlines stay fixed on the monotonic clock
+        wall_offset = self.clock.time() - self.clock.monotonic()
+        number = math.floor((self.clock.monotonic() + wall_offset) / interval) + 1
+
+        while True:
+            deadline = number * interval - wall_offset
+            delay = deadline - self.clock.monotonic()
+            if delay > 0:
+                self.clock.sleep(delay)
+
+            now = self.clock.monotonic()
+            lateness = max(now - deadline, 0.0)
+
+            self.tick_count += 1
+            self.total_lateness += lateness
+            self.max_lateness = max(self.max_lateness, lateness)
+            LATENESS.observe(lateness)
+            # The tick fired after the following deadline had passed
+            if lateness >= interval:
+                self.overruns += 1
+                OVERRUNS.inc()
+
+            is_log = number % self.ticks_per_log == 0
+            started = perf_counter()
+            yield Tick(number, deadline, now, lateness, is_log)
+            (LOG_TICK_WORK if is_log else TICK_WORK).observe(perf_counter() - started)
+
+            number += 1
@@ -0,0 +1,456 @@
+# Sensor Backend
+#
+# Provides a common interface to the weather station hardware so the rest of
+# the station doesn't have to talk to gpiozero, smbus2, bme280 or picamera
+# directly. Three backends are available:
+#
+# HardwareBackend  - Talks to the real sensors on the Raspberry Pi. The
+#                    hardware libraries are only imported when a sensor is
+#                    first used.
+# RecordingBackend - Wraps another backend and records every raw reading
+#                    (anemometer and rain gauge edge timestamps, ADC codes,
+#                    BME280 samples and camera frames) to a file.
+# ReplayBackend    - Feeds a recording back to the station using a virtual
+#                    clock, optionally much faster than real time. This allows
+#                    the whole pipeline to run on an ordinary Linux machine.
+#
+# A recording is a JSON lines file (gzip compressed if the name ends in .gz).
+# The first line is a header holding the wall clock and monotonic clock at the
+# start of the recording. Camera frames are stored as separate jpeg files in a
+# directory next to the recording named <recording>.frames.
+#
+# Daniel Hornberger
+# 2021
+
+import collections
+import datetime
+import gzip
+import json
+import os
+import shutil
+import threading
+import time
+from io import BytesIO
+
+# The MCP3208 is a 12 bit ADC
+ADC_MAX_CODE = 4095
+
+RECORDING_VERSION = 1
+
+# The backend in use by the station. Use get_backend() to access it.
+backend = None
+
+
+class ReplayFinished(Exception):
+    """
+    Raised by the ReplayBackend when the recording has no more readings.
+    """
+
+
+def _open_recording(path, mode):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t")
+    return open(path, mode)
+
+
+###############################################################################
+# Hardware
+###############################################################################
+
+
+class HardwareBackend:
+    """
+    Reads the real sensors connected to the Raspberry Pi.
+    """
+
+    def __init__(self):
+        self._buttons = {}
+        self._adcs = {}
+        self._buses = {}
+        self._calibrations = {}
+        self._camera = None
+
+    def time(self):
+        return time.time()
+
+    def monotonic(self):
+        return time.monotonic()
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def now(self):
+        return datetime.datetime.now()
+
+    def utcnow(self):
+        return datetime.datetime.utcnow()
+
+    def on_edge(self, pin, callback):
+        """
+        Calls the callback every time the switch connected to the BCM pin
+        closes.
+        """
+        from gpiozero import Button
+
+        if pin not in self._buttons:
+            self._buttons[pin] = Button(pin)
+        self._buttons[pin].when_pressed = callback
+
+    def read_adc(self, channel):
+        """
+        Returns the raw code (0 - 4095) read from the MCP3208 channel.
+        """
+        from gpiozero import MCP3208
+
+        if channel not in self._adcs:
+            self._adcs[channel] = MCP3208(channel=channel)
+        return self._adcs[channel].raw_value
+
+    def read_bme280(self, port, address, oversampling=1):
+        """
+        Samples the BME280 sensor and returns the uncalibrated humidity,
+        pressure and temperature (C). The sensor takes a single measurement
+        in forced mode, averaging oversampling (1, 2, 4, 8 or 16) readings of
+        each value in hardware, and sleeps in between.
+        """
+        import bme280
+        import smbus2
+
+        if port not in self._buses:
+            self._buses[port] = smbus2.SMBus(port)
+        bus = self._buses[port]
+        if (port, address) not in self._calibrations:
+            self._calibrations[(port, address)] = bme280.load_calibration_params(
+                bus, address
+            )
+        data = bme280.sample(
+            bus,
+            address,
+            self._calibrations[(port, address)],
+            getattr(bme280.oversampling, f"x{oversampling}"),
+        )
+        return data.humidity, data.pressure, data.temperature
+
+    def camera(self):
+        """
+        Returns the PiCamera. Only a single camera object may exist for the
+        duration of the program.
+        """
+        from picamera import PiCamera
+
+        if self._camera is None:
+            self._camera = PiCamera()
+        return self._camera
+
+    def close(self):
+        if self._camera is not None:
+            self._camera.close()
+
+
+###############################################################################
+# Recording
+###############################################################################
+
+
+class _RecordingCamera:
+    """
+    Wraps a camera so every captured frame is also stored in the recording.
+    """
+
+    def __init__(self, recorder, camera_obj):
+        object.__setattr__(self, "_recorder", recorder)
+        object.__setattr__(self, "_camera", camera_obj)
+
+    def __getattr__(self, name):
+        return getattr(self._camera, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._camera, name, value)
+
+    def capture(self, output, format=None, **kwargs):
+        if isinstance(output, str):
+            self._camera.capture(output, format=format, **kwargs)
+            self._recorder._record_frame(output)
+        else:
+            stream = BytesIO()
+            self._camera.capture(stream, format=format or "jpeg", **kwargs)
+            output.write(stream.getvalue())
+            self._recorder._record_frame(stream)
+
+
+class RecordingBackend:
+    """
+    Passes every call through to another backend and records the raw
+    readings to the recording file at path.
+    """
+
+    def __init__(self, inner, path):
+        self._inner = inner
+        self._lock = threading.Lock()
+        self._frames_directory = path + ".frames"
+        self._frame_count = 0
+        os.makedirs(self._frames_directory, exist_ok=True)
+        self._file = _open_recording(path, "w")
+        self._write(
+            {
+                "type": "header",
+                "version": RECORDING_VERSION,
+                "wall": inner.time(),
+                "mono": inner.monotonic(),
+            }
+        )
+
+    def _write(self, event):
+        line = json.dumps(event, separators=(",", ":")) + "\n"
+        with self._lock:
+            self._file.write(line)
+
+    def _record_frame(self, source):
+        with self._lock:
+            self._frame_count += 1
+            name = f"{self._frame_count:08d}.jpeg"
+        destination = os.path.join(self._frames_directory, name)
+        if isinstance(source, str):
+            shutil.copyfile(source, destination)
+        else:
+            with open(destination, "wb") as file:
+                file.write(source.getvalue())
+        self._write({"type": "frame", "t": self._inner.monotonic(), "file": name})
+
+    def time(self):
+        return self._inner.time()
+
+    def monotonic(self):
+        return self._inner.monotonic()
+
+    def sleep(self, seconds):
+        # Readings are buffered between sleeps so the recording doesn't slow
+        # down the sampling
+        with self._lock:
+            self._file.flush()
+        self._inner.sleep(seconds)
+
+    def now(self):
+        return self._inner.now()
+
+    def utcnow(self):
+        return self._inner.utcnow()
+
+    def on_edge(self, pin, callback):
+        monotonic = self._inner.monotonic
+
+        def recorded_edge():
+            self._write({"type": "edge", "t": monotonic(), "pin": pin})
+            callback()
+
+        self._inner.on_edge(pin, recorded_edge)
+
+    def read_adc(self, channel):
+        code = self._inner.read_adc(channel)
+        self._write(
+            {"type": "adc", "t": self._inner.monotonic(), "channel": channel, "code": code}
+        )
+        return code
+
+    def read_bme280(self, port, address, oversampling=1):
+        humidity, pressure, temperature = self._inner.read_bme280(
+            port, address, oversampling
+        )
+        self._write(
+            {
+                "type": "bme280",
+                "t": self._inner.monotonic(),
+                "humidity": humidity,
+                "pressure": pressure,
+                "temperature": temperature,
+            }
+        )
+        return humidity, pressure, temperature
+
+    def camera(self):
+        return _RecordingCamera(self, self._inner.camera())
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+        self._inner.close()
+
+
+###############################################################################
+# Replay
+###############################################################################
+
+
+class _ReplayCamera:
+    """
+    Stands in for the PiCamera and returns the recorded frames in order.
+    Settings such as resolution and rotation are accepted and ignored.
+    """
+
+    def __init__(self, replay):
+        self._replay = replay
+
+    def capture(self, output, format=None, **kwargs):
+        frame = self._replay._next_reading("frame")
+        path = os.path.join(self._replay.frames_directory, frame["file"])
+        if isinstance(output, str):
+            shutil.copyfile(path, output)
+        else:
+            with open(path, "rb") as file:
+                output.write(file.read())
+
+    def close(self):
+        pass
+
+
+class ReplayBackend:
+    """
+    Plays back a recording made by the RecordingBackend.
+
+    Time is virtual: sleep() advances the clock and fires the recorded edges
+    that fall within the slept period before returning. The real time spent
+    sleeping is divided by speed. A speed of 0 replays as fast as possible.
+    """
+
+    def __init__(self, path, speed=1000.0):
+        self.speed = speed
+        self.frames_directory = path + ".frames"
+        self._file = _open_recording(path, "r")
+
+        header = json.loads(self._file.readline())
+        if header.get("type") != "header":
+            raise ValueError(f"{path} is not a weather station recording")
+
+        self._monotonic = header["mono"]
+        self._wall_offset = header["wall"] - header["mono"]
+        self._callbacks = {}
+        self._pending_edges = collections.deque()
+        self._readings = collections.defaultdict(collections.deque)
+        self._last_event_time = self._monotonic
+        self._end_of_file = False
+        # The camera may be read from another thread
+        self._lock = threading.RLock()
+
+    def _read_event(self):
+        """
+        Reads the next event from the recording. Edges are queued to be fired
+        by sleep() and readings are queued for the read functions.
+        Returns False at the end of the recording.
+        """
+        if self._end_of_file:
+            return False
+        line = self._file.readline()
+        if not line:
+            self._end_of_file = True
+            return False
+        event = json.loads(line)
+        self._last_event_time = event["t"]
+        if event["type"] == "edge":
+            self._pending_edges.append(event)
+        else:
+            self._readings[self._reading_key(event)].append(event)
+        return True
+
+    def _reading_key(self, event):
+        if event["type"] == "adc":
+            return ("adc", event["channel"])
+        return event["type"]
+
+    def _next_reading(self, key):
+        with self._lock:
+            queue = self._readings[key]
+            while not queue:
+                if not self._read_event():
+                    raise ReplayFinished()
+            return queue.popleft()
+
+    def time(self):
+        return self._monotonic + self._wall_offset
+
+    def monotonic(self):
+        return self._monotonic
+
+    def sleep(self, seconds):
+        seconds = max(seconds, 0.0)
+        with self._lock:
+            self._advance(self._monotonic + seconds)
+        if self.speed:
+            time.sleep(seconds / self.speed)
+
+    def _advance(self, target):
+        """
+        Fires the edges recorded up to the target time.
+        """
+        while True:
+            # Only read as far ahead in the recording as needed
+            while not self._pending_edges and self._last_event_time <= target:
+                if not self._read_event():
+                    break
+            if not self._pending_edges or self._pending_edges[0]["t"] > target:
+                break
+            edge = self._pending_edges.popleft()
+            self._monotonic = max(self._monotonic, edge["t"])
+            callback = self._callbacks.get(edge["pin"])
+            if callback is not None:
+                callback()
+
+        self._monotonic = target
+
+    def now(self):
+        return datetime.datetime.fromtimestamp(self.time())
+
+    def utcnow(self):
+        return datetime.datetime.utcfromtimestamp(self.time())
+
+    def on_edge(self, pin, callback):
+        self._callbacks[pin] = callback
+
+    def read_adc(self, channel):
+        return self._next_reading(("adc", channel))["code"]
+
+    def read_bme280(self, port, address, oversampling=1):
+        reading = self._next_reading("bme280")
+        return reading["humidity"], reading["pressure"], reading["temperature"]
+
+    def camera(self):
+        return _ReplayCamera(self)
+
+    def close(self):
+        self._file.close()
+
+
+###############################################################################
+# Backend Selection
+###############################################################################
+
+
+def initialize_backend(record_path=None, replay_path=None, speed=1000.0):
+    """
+    Selects the backend used by the station. By default the real hardware is
+    used. If record_path is given, the readings are also recorded to it. If
+    replay_path is given, a previous recording is played back instead.
+    """
+    global backend
+
+    if replay_path:
+        backend = ReplayBackend(replay_path, speed)
+    else:
+        backend = HardwareBackend()
+
+    if record_path:
+        backend = RecordingBackend(backend, record_path)
+
+    return backend
+
+
+def get_backend():
+    """
+    Returns the backend in use, defaulting to the real hardware if one hasn't
+    been initialized.
+    """
+    global backend
+
+    if backend is None:
+        backend = HardwareBackend()
+    return backend
@@ -0,0 +1,156 @@
+# Startup
+#
+# Times the phases of the weather station's startup and starts the slow or
+# unreliable subsystems (such as the camera and the database) without holding
+# up the rest of the station.
+#
+# A Subsystem is started on a background thread by start(), or the first time
+# get() is called. Until it's ready, get() returns None, so the station keeps
+# sampling without it. If starting it fails, the error is logged and it's
+# tried again by the next get() after retry_interval seconds.
+#
+# Daniel Hornberger
+# 2021
+
+import contextlib
+import threading
+import time
+
+import logger as logging
+
+
+class StartupTimer:
+    """
+    Records how long each phase of the startup took and logs it.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.started = clock()
+        self.phases = []
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds):
+        with self._lock:
+            self.phases.append((name, seconds))
+        logging.log(
+            f"Startup: {name} took {round(seconds * 1000, 1)} ms "
+            f"({round(self.elapsed(), 3)} seconds since the start)"
+        )
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """
+        Times the code in the with block as a phase named name.
+        """
+        start = self.clock()
+        try:
+            yield
+        except Exception:
+            elapsed = self.clock() - start
+            logging.error(f"Startup: {name} failed after {round(elapsed * 1000, 1)} ms")
+            raise
+        self.record(name, self.clock() - start)
+
+    def elapsed(self):
+        return self.clock() - self.started
+
+    def summary(self):
+        """
+        Returns a string listing the phases recorded so far, slowest first.
+        """
+        with self._lock:
+            phases = sorted(self.phases, key=lambda phase: -phase[1])
+        return ", ".join(
+            f"{name} {round(seconds * 1000, 1)} ms" for name, seconds in phases
+        )
+
+
+class Subsystem:
+    """
+    A part of the station created by calling factory, which is started in
+    the background so it can't delay or stop the rest of the station.
+    """
+
+    def __init__(
+        self, name, factory, timer=None, retry_interval=300.0, clock=time.monotonic
+    ):
+        self.name = name
+        self.factory = factory
+        self.timer = timer
+        self.retry_interval = retry_interval
+        self.clock = clock
+        self.value = None
+        self.error = None
+        self.failures = 0
+        self._failed_at = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """
+        Starts the subsystem on a background thread if it isn't ready or
+        already starting.
+        """
+        with self._lock:
+            if self.value is not None or self._thread is not None:
+                return
+            self._thread = threading.Thread(
+                target=self._run, name=f"start_{self.name}", daemon=True
+            )
+            self._thread.start()
+
+    def get(self):
+        """
+        Returns the subsystem, or None if it isn't ready. A failed subsystem
+        is started again once retry_interval seconds have passed.
+        """
+        value = self.value
+        if value is not None:
+            return value
+        failed_at = self._failed_at
+        if failed_at is None or self.clock() - failed_at >= self.retry_interval:
+            self.start()
+        return None
+
+    def wait(self, timeout=None):
+        """
+        Waits for the subsystem to finish starting and returns it, or None if
+        it failed or didn't finish in time.
+        """
+        self.start()
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+        return self.value
+
+    def stop(self, closer):
+        """
+        Calls closer with the subsystem if it was started.
+        """
+        if self.value is not None:
+            closer(self.value)
+
+    def _run(self):
+        start = self.clock()
+        try:
+            value = self.factory()
+        except Exception as e:
+            self.error = e
+            self.failures += 1
+            logging.error(
+                f"Starting the {self.name} failed after "
+                f"{round((self.clock() - start) * 1000, 1)} ms and will be tried "
+                f"again in {self.retry_interval} seconds: {str(e.args)}"
+            )
+            with self._lock:
+                self._failed_at = self.clock()
+                self._thread = None
+            return
+
+        with self._lock:
+            self.value = value
+            self.error = None
+            self._thread = None
+        if self.timer is not None:
+            self.timer.record(self.name, self.clock() - start)
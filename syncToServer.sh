@@ -1,7 +1,10 @@
-# This is an rsync command that can be used to backup a directory
-# of files to a server. This could be run as a cronjob regularly.
-# Each time this command is executed, only the new or changed
-# files will be uploaded to the server.
+# This script can be used to backup a directory of files to a
+# server. This could be run as a cronjob regularly.
+# Each time this script is executed, only the data added or changed
+# since the previous run is uploaded to the server by sync_agent.py,
+# which keeps track of what has already been sent. The repository
+# must also be cloned on the server so the agent can be started there
+# over ssh (see REMOTE_SYNC_AGENT below).
 #
 # This script expects a file named .env to be present in the
 # /home/pi/WeatherStation directory. The contents of this file
@@ -16,6 +19,7 @@
 # BACKUP_USER=<place login username here>
 # LOCAL_BACKUP_PATH=<path to local folder to backup>
 # REMOTE_BACKUP_PATH=<where on the server to copy the local files>
+# REMOTE_SYNC_AGENT=<optional, how to run sync_agent.py on the server>
 #
 # Additionally, an ssh key should be copied to the server so
 # an ssh connection can be made without the use of a password.
@@ -31,12 +35,12 @@ echo Local backup path: $LOCAL_BACKUP_PATH
 echo Remote user: $BACKUP_USER
 echo Backup server: $BACKUP_SERVER
 echo Remote backup path: $REMOTE_BACKUP_PATH
-# Export a backup of the influx database
+# Export the new points in the influx database
 /home/pi/WeatherStation/influxBackup.sh
-# Sync the files to the remote server, except for the database files
-rsync -avh --exclude 'influxBackupPrev' --exclude 'influxBackupLatest' $LOCAL_BACKUP_PATH $BACKUP_USER@$BACKUP_SERVER:$REMOTE_BACKUP_PATH
-# Sync the latest database backup files, and delete the old database files
-# from the remote
-rsync -avh $LOCAL_BACKUP_PATH/influxBackupLatest $BACKUP_USER@$BACKUP_SERVER:$REMOTE_BACKUP_PATH --delete
+# Send the new and changed data, including the database exports, to the
+# remote server
+python3 /home/pi/WeatherStation/sync_agent.py send $LOCAL_BACKUP_PATH \
+    --ssh $BACKUP_USER@$BACKUP_SERVER --remote-directory $REMOTE_BACKUP_PATH \
+    --remote-command "${REMOTE_SYNC_AGENT:-python3 WeatherStation/sync_agent.py}"
 date
 
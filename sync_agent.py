@@ -0,0 +1,793 @@
+# Sync Agent
+#
+# Copies the data collected by the weather station to a backup server, sending
+# only what has changed since the last time it was run.
+#
+# The sender keeps a manifest of what has already been sent: the size,
+# modification time and block hashes of every file, and the modification time
+# and contents of every directory. A directory is only listed again when its
+# modification time has changed (a file was added or removed). Writing to a
+# file doesn't change its directory, so the files that are being written are
+# found another way. The manifest also keeps the files that were open (such
+# as the data file, its journal and the rain gauge's tips) or modified in the
+# last ACTIVE_PERIOD when the agent last ran, and those and the files open now
+# are stat'ed too. The open files are found in /proc, and where it isn't
+# available every file that was sent is stat'ed. Only the files whose size or
+# modification time changed are read, so the work done by each run depends on
+# the amount of new data rather than the size of the whole archive. When a
+# file has grown and the start and end of what was already sent are
+# unchanged, only the appended bytes are sent. Otherwise the blocks of the
+# file are compared and only the changed blocks are sent. Running with --full
+# checks every file and compares every block.
+#
+# The changed byte ranges are packed into gzip compressed bundles of up to
+# BUNDLE_SIZE bytes in an outbox before they are sent. A bundle that was only
+# partly sent is resumed from where it stopped the next time the agent runs.
+# The receiver checks the hash of every bundle and of every range it writes
+# before the bundle is acknowledged, and the manifest is only updated once a
+# bundle has been acknowledged.
+#
+# The receiver can be a directory (e.g. a mounted drive or for testing), a
+# receiver listening on a socket, or a receiver started over ssh:
+#
+#   python3 sync_agent.py send /mnt/usb1 --directory /mnt/backup
+#   python3 sync_agent.py send /mnt/usb1 --ssh pi@192.168.0.10 \
+#       --remote-directory /data/WeatherStation
+#
+#   python3 sync_agent.py receive /data/WeatherStation --port 8765
+#   python3 sync_agent.py send /mnt/usb1 --socket 192.168.0.10:8765
+#
+# Daniel Hornberger
+# 2021
+
+import argparse
+import fnmatch
+import gzip
+import hashlib
+import json
+import os
+import shlex
+import socket
+import socketserver
+import subprocess
+import sys
+import time
+
+# Files are compared in blocks of this many bytes
+BLOCK_SIZE = 1 << 20  # 1 MB
+
+# The most data (before compression) packed into one bundle
+BUNDLE_SIZE = 16 << 20  # 16 MB
+
+# Bundles are sent in pieces of this many bytes
+SEND_SIZE = 1 << 20  # 1 MB
+
+# Files modified within this many seconds are checked for changes next run
+ACTIVE_PERIOD = 2 * 24 * 60 * 60  # 2 days
+
+# The sender and receiver keep their state in this directory
+STATE_DIRECTORY = ".sync"
+
+# The full database backups made by older versions of influxBackup.sh
+DEFAULT_EXCLUDES = ["influxBackupPrev", "influxBackupLatest"]
+
+
+class SyncError(Exception):
+    pass
+
+
+def _hash(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def _hash_file(path):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _sync(file):
+    file.flush()
+    os.fsync(file.fileno())
+
+
+def _join(directory, name):
+    return f"{directory}/{name}" if directory else name
+
+
+def open_files(root):
+    """
+    Returns the names of the files under root that are open in any process
+    the agent may look at, or None if that can't be found out.
+    """
+    if not os.path.isdir("/proc/self/fd"):
+        return None
+    root = os.path.realpath(root) + os.sep
+    names = set()
+    for pid in os.listdir("/proc"):
+        if not pid.isdigit():
+            continue
+        descriptors = os.path.join("/proc", pid, "fd")
+        try:
+            fds = os.listdir(descriptors)
+        except OSError:
+            # Another user's process, or it has exited
+            continue
+        for fd in fds:
+            try:
+                target = os.readlink(os.path.join(descriptors, fd))
+            except OSError:
+                continue
+            if target.startswith(root):
+                names.add(target[len(root) :].replace(os.sep, "/"))
+    return names
+
+
+###############################################################################
+# Manifest
+###############################################################################
+
+
+class Manifest:
+    """
+    What has been sent to the receiver. It is kept in an append only file of
+    JSON lines where the last line for a file or directory wins, and it is
+    compacted once most of the lines are out of date.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.files = {}
+        self.directories = {}
+        self.active = []
+        self.next_bundle = 1
+        self._lines = 0
+
+        if os.path.exists(path):
+            with open(path) as file:
+                for line in file:
+                    try:
+                        self._apply(json.loads(line))
+                    except ValueError:
+                        # The last line may be torn by a power loss
+                        continue
+                    self._lines += 1
+
+    def _apply(self, update):
+        if "file" in update:
+            if update["entry"] is None:
+                self.files.pop(update["file"], None)
+            else:
+                self.files[update["file"]] = update["entry"]
+        elif "directory" in update:
+            if update["entry"] is None:
+                self.directories.pop(update["directory"], None)
+            else:
+                self.directories[update["directory"]] = update["entry"]
+        elif "next_bundle" in update:
+            self.next_bundle = update["next_bundle"]
+        elif "active" in update:
+            self.active = update["active"]
+
+    def commit(self, updates):
+        """
+        Applies a list of updates and appends them to the manifest file.
+        """
+        for update in updates:
+            self._apply(update)
+        with open(self.path, "a") as file:
+            file.write("".join(json.dumps(update) + "\n" for update in updates))
+            _sync(file)
+        self._lines += len(updates)
+        if self._lines > 2 * (len(self.files) + len(self.directories)) + 1000:
+            self._compact()
+
+    def _compact(self):
+        updates = [{"next_bundle": self.next_bundle}, {"active": self.active}]
+        updates += [
+            {"directory": name, "entry": entry}
+            for name, entry in self.directories.items()
+        ]
+        updates += [{"file": name, "entry": entry} for name, entry in self.files.items()]
+        with open(self.path + ".tmp", "w") as file:
+            file.write("".join(json.dumps(update) + "\n" for update in updates))
+            _sync(file)
+        os.replace(self.path + ".tmp", self.path)
+        self._lines = len(updates)
+
+
+###############################################################################
+# Sending
+###############################################################################
+
+
+class Bundle:
+    """
+    Packs byte ranges of files into a compressed bundle file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.size = 0
+        self.updates = []
+        self._file = gzip.open(path + ".tmp", "wb", compresslevel=6)
+
+    def add(self, name, offset, data):
+        header = {"path": name, "offset": offset, "length": len(data), "hash": _hash(data)}
+        self._file.write(json.dumps(header).encode() + b"\n")
+        self._file.write(data)
+        self.size += len(data)
+
+    def truncate(self, name, size):
+        self._file.write(json.dumps({"path": name, "truncate": size}).encode() + b"\n")
+
+    def close(self):
+        """
+        Finishes the bundle and saves the manifest updates to apply once it
+        has been acknowledged.
+        """
+        self._file.close()
+        with open(self.path + ".manifest", "w") as file:
+            file.write("".join(json.dumps(update) + "\n" for update in self.updates))
+            _sync(file)
+        os.replace(self.path + ".tmp", self.path)
+
+
+class Sender:
+    """
+    Sends the changes to the files under root to a transport.
+    """
+
+    def __init__(self, root, transport, excludes=DEFAULT_EXCLUDES, full=False):
+        self.root = root
+        self.transport = transport
+        self.excludes = list(excludes) + [STATE_DIRECTORY]
+        self.full = full
+
+        self.state_directory = os.path.join(root, STATE_DIRECTORY)
+        self.outbox = os.path.join(self.state_directory, "outbox")
+        os.makedirs(self.outbox, exist_ok=True)
+        self.manifest = Manifest(os.path.join(self.state_directory, "manifest.jsonl"))
+
+        self.files_changed = 0
+        self.bytes_packed = 0
+        self.bytes_sent = 0
+        self.bundles_sent = 0
+
+    def _excluded(self, name):
+        return name.endswith(".tmp") or any(
+            fnmatch.fnmatch(name, pattern) or fnmatch.fnmatch(os.path.basename(name), pattern)
+            for pattern in self.excludes
+        )
+
+    def _path(self, name):
+        return os.path.join(self.root, *name.split("/"))
+
+    def scan(self):
+        """
+        Returns a dictionary of the files that may have changed with their
+        os.stat results (None if removed) and a list of directory updates.
+        """
+        candidates = {}
+        updates = []
+        pending = [""]
+        while pending:
+            name = pending.pop()
+            try:
+                directory_stat = os.stat(self._path(name))
+            except FileNotFoundError:
+                self._removed_directory(name, candidates, updates)
+                continue
+
+            old = self.manifest.directories.get(name)
+            if not self.full and old and old["mtime_ns"] == directory_stat.st_mtime_ns:
+                pending.extend(old["directories"])
+                continue
+
+            entry = {"mtime_ns": directory_stat.st_mtime_ns, "directories": [], "files": []}
+            with os.scandir(self._path(name)) as entries:
+                for dir_entry in entries:
+                    child = _join(name, dir_entry.name)
+                    if self._excluded(child):
+                        continue
+                    if dir_entry.is_dir(follow_symlinks=False):
+                        entry["directories"].append(child)
+                    elif dir_entry.is_file(follow_symlinks=False):
+                        entry["files"].append(dir_entry.name)
+                        candidates[child] = dir_entry.stat()
+            pending.extend(entry["directories"])
+            updates.append({"directory": name, "entry": entry})
+
+            if old:
+                for file_name in set(old["files"]) - set(entry["files"]):
+                    candidates[_join(name, file_name)] = None
+                for directory in set(old["directories"]) - set(entry["directories"]):
+                    self._removed_directory(directory, candidates, updates)
+
+        # Files in unchanged directories may still have been written to since
+        # the last run if they were open or recently modified then, or are
+        # open now
+        opened = open_files(self.root)
+        if opened is None:
+            # Which files are open isn't known, so check all of them
+            opened = set()
+            check = set(self.manifest.files)
+        else:
+            opened = {name for name in opened if not self._excluded(name)}
+            check = set(self.manifest.active) | opened
+        for name in check & set(self.manifest.files):
+            if name in candidates:
+                continue
+            try:
+                candidates[name] = os.stat(self._path(name))
+            except FileNotFoundError:
+                candidates[name] = None
+
+        now = time.time_ns()
+        active = sorted(
+            name
+            for name, stat in candidates.items()
+            if stat is not None
+            and (name in opened or now - stat.st_mtime_ns < ACTIVE_PERIOD * 1000000000)
+        )
+        if active != self.manifest.active:
+            updates.append({"active": active})
+        return candidates, updates
+
+    def _removed_directory(self, name, candidates, updates):
+        """
+        Forgets a directory that was removed. The files sent from it are kept
+        by the receiver.
+        """
+        old = self.manifest.directories.get(name)
+        if old is None:
+            return
+        updates.append({"directory": name, "entry": None})
+        for file_name in old["files"]:
+            candidates[_join(name, file_name)] = None
+        for directory in old["directories"]:
+            self._removed_directory(directory, candidates, updates)
+
+    def _changes(self, name, stat, old):
+        """
+        Yields the (offset, data) ranges of a file that have changed, and
+        returns its new manifest entry.
+        """
+        entry = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "blocks": []}
+        with open(self._path(name), "rb") as file:
+            # A file that has grown is assumed to have been appended to, so
+            # only its first block and the last block that was sent are
+            # checked. The first block holds the header of the binary files.
+            if not self.full and old and old["blocks"] and stat.st_size > old["size"]:
+                last = len(old["blocks"]) - 1
+                first = file.read(min(BLOCK_SIZE, old["size"]))
+                file.seek(last * BLOCK_SIZE)
+                block = file.read(old["size"] - last * BLOCK_SIZE)
+                if _hash(first) == old["blocks"][0] and _hash(block) == old["blocks"][-1]:
+                    entry["blocks"] = old["blocks"][:last]
+                    data = file.read(stat.st_size - old["size"])
+                    block += data
+                    if data:
+                        yield old["size"], data
+                    for start in range(0, len(block), BLOCK_SIZE):
+                        entry["blocks"].append(_hash(block[start : start + BLOCK_SIZE]))
+                    return entry
+                file.seek(0)
+
+            # Otherwise send the blocks that differ
+            old_blocks = old["blocks"] if old else []
+            offset = 0
+            while offset < stat.st_size:
+                block = file.read(min(BLOCK_SIZE, stat.st_size - offset))
+                if not block:
+                    break
+                index = offset // BLOCK_SIZE
+                block_hash = _hash(block)
+                entry["blocks"].append(block_hash)
+                if index >= len(old_blocks) or old_blocks[index] != block_hash:
+                    yield offset, block
+                offset += len(block)
+            entry["size"] = offset
+        return entry
+
+    def _new_bundle(self, bundles):
+        """
+        Starts the next bundle. Each bundle advances the manifest's bundle
+        number when it's acknowledged, so the bundles of a pack that was
+        interrupted part way aren't numbered again by the next one.
+        """
+        numbers = [
+            int(name[: -len(".bundle")])
+            for name in os.listdir(self.outbox)
+            if name.endswith(".bundle") and name[: -len(".bundle")].isdigit()
+        ]
+        sequence = max(numbers + [self.manifest.next_bundle - 1]) + 1
+        bundle = Bundle(os.path.join(self.outbox, f"{sequence:08d}.bundle"))
+        bundle.updates.append({"next_bundle": sequence + 1})
+        bundles.append(bundle)
+        return bundle
+
+    def pack(self):
+        """
+        Packs the changes since the last run into bundles in the outbox.
+        Returns the number of bundles.
+        """
+        candidates, updates = self.scan()
+        bundles = []
+        bundle = None
+
+        for name in sorted(candidates):
+            stat = candidates[name]
+            old = self.manifest.files.get(name)
+            if stat is None:
+                if old is not None:
+                    updates.append({"file": name, "entry": None})
+                continue
+            if old and old["size"] == stat.st_size and old["mtime_ns"] == stat.st_mtime_ns:
+                continue
+
+            try:
+                changes = self._changes(name, stat, old)
+                while True:
+                    try:
+                        offset, data = next(changes)
+                    except StopIteration as stop:
+                        entry = stop.value
+                        break
+                    if bundle is None or bundle.size >= BUNDLE_SIZE:
+                        if bundle is not None:
+                            bundle.close()
+                        bundle = self._new_bundle(bundles)
+                    bundle.add(name, offset, data)
+                    self.bytes_packed += len(data)
+            except FileNotFoundError:
+                updates.append({"file": name, "entry": None})
+                continue
+
+            if old is None or entry["size"] < old["size"]:
+                if bundle is None:
+                    bundle = self._new_bundle(bundles)
+                # Creates empty files and shortens files that shrank
+                bundle.truncate(name, entry["size"])
+            if bundle is not None:
+                bundle.updates.append({"file": name, "entry": entry})
+            else:
+                updates.append({"file": name, "entry": entry})
+            self.files_changed += 1
+
+        if bundle is None:
+            # Nothing has to be sent, so the directories are up to date now
+            if updates:
+                self.manifest.commit(updates)
+            return 0
+
+        # The directories are only up to date once every bundle is received
+        bundle.updates.extend(updates)
+        bundle.close()
+        return len(bundles)
+
+    def send(self):
+        """
+        Sends the bundles in the outbox in order, resuming any that were only
+        partly sent. Returns the number of bundles sent.
+        """
+        sent = 0
+        for name in sorted(os.listdir(self.outbox)):
+            if not name.endswith(".bundle"):
+                continue
+            path = os.path.join(self.outbox, name)
+            size = os.path.getsize(path)
+
+            offset = self.transport.offset(name)
+            if offset > size:
+                offset = 0
+            with open(path, "rb") as file:
+                file.seek(offset)
+                while offset < size:
+                    data = file.read(SEND_SIZE)
+                    self.transport.write(name, offset, data)
+                    offset += len(data)
+                    self.bytes_sent += len(data)
+            self.transport.commit(name, size, _hash_file(path))
+
+            with open(path + ".manifest") as file:
+                updates = [json.loads(line) for line in file]
+            self.manifest.commit(updates)
+            os.remove(path)
+            os.remove(path + ".manifest")
+            sent += 1
+            self.bundles_sent += 1
+        return sent
+
+    def run(self):
+        """
+        Sends any bundles left by a previous run and then the new changes.
+        """
+        started = time.monotonic()
+        self.send()
+        self.pack()
+        self.send()
+        elapsed = time.monotonic() - started
+        print(
+            f"Synced {self.files_changed} changed files: packed {self.bytes_packed} bytes, "
+            f"sent {self.bytes_sent} bytes in {self.bundles_sent} bundles in {elapsed:.1f} s"
+        )
+
+
+###############################################################################
+# Receiving
+###############################################################################
+
+
+class Receiver:
+    """
+    Receives bundles into an incoming directory and applies them to the
+    files under directory once they are complete and verified.
+    """
+
+    def __init__(self, directory):
+        self.directory = os.path.abspath(directory)
+        self.incoming = os.path.join(self.directory, STATE_DIRECTORY, "incoming")
+        self.applied_path = os.path.join(self.directory, STATE_DIRECTORY, "applied")
+        os.makedirs(self.incoming, exist_ok=True)
+
+    def _part(self, name):
+        if os.path.basename(name) != name or not name.endswith(".bundle"):
+            raise SyncError(f"Invalid bundle name: {name}")
+        return os.path.join(self.incoming, name + ".part")
+
+    def _last_applied(self):
+        try:
+            with open(self.applied_path) as file:
+                return file.read().strip()
+        except FileNotFoundError:
+            return ""
+
+    def offset(self, name):
+        """
+        Returns how much of a bundle has been received.
+        """
+        part = self._part(name)
+        return os.path.getsize(part) if os.path.exists(part) else 0
+
+    def write(self, name, offset, data):
+        part = self._part(name)
+        with open(part, "ab") as file:
+            if file.tell() != offset:
+                file.truncate(offset)
+            file.write(data)
+
+    def commit(self, name, size, digest):
+        """
+        Verifies a received bundle and applies it.
+        """
+        part = self._part(name)
+        if name <= self._last_applied():
+            # The acknowledgement of this bundle was lost
+            if os.path.exists(part):
+                os.remove(part)
+            return
+        if not os.path.exists(part) or os.path.getsize(part) != size:
+            raise SyncError(f"{name} is incomplete")
+        if _hash_file(part) != digest:
+            os.remove(part)
+            raise SyncError(f"{name} was corrupted while it was sent")
+
+        self.apply(part)
+        with open(self.applied_path + ".tmp", "w") as file:
+            file.write(name)
+            _sync(file)
+        os.replace(self.applied_path + ".tmp", self.applied_path)
+        os.remove(part)
+
+    def _target(self, name):
+        path = os.path.abspath(os.path.join(self.directory, *name.split("/")))
+        if not path.startswith(self.directory + os.sep) or STATE_DIRECTORY in name.split("/"):
+            raise SyncError(f"Invalid path in bundle: {name}")
+        return path
+
+    def apply(self, bundle_path):
+        """
+        Writes the ranges in a bundle to their files. Applying a bundle again
+        gives the same result, so one interrupted part way is applied again.
+        """
+        with gzip.open(bundle_path, "rb") as bundle:
+            for line in bundle:
+                header = json.loads(line)
+                path = self._target(header["path"])
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                mode = "r+b" if os.path.exists(path) else "w+b"
+                with open(path, mode) as file:
+                    if "truncate" in header:
+                        file.truncate(header["truncate"])
+                        continue
+                    data = bundle.read(header["length"])
+                    if len(data) != header["length"] or _hash(data) != header["hash"]:
+                        raise SyncError(f"A range of {header['path']} is corrupt")
+                    file.seek(header["offset"])
+                    file.write(data)
+                    _sync(file)
+
+                    # Check what was written to the disk
+                    file.seek(header["offset"])
+                    if _hash(file.read(header["length"])) != header["hash"]:
+                        raise SyncError(f"{header['path']} couldn't be written")
+
+
+###############################################################################
+# Transports
+###############################################################################
+
+
+def serve_stream(receiver, rfile, wfile):
+    """
+    Answers the requests of a StreamTransport. Each request is a line of JSON
+    followed by the data being written, if any, and each response is a line
+    of JSON.
+    """
+    for line in rfile:
+        request = json.loads(line)
+        try:
+            if request["op"] == "offset":
+                response = {"offset": receiver.offset(request["name"])}
+            elif request["op"] == "write":
+                data = rfile.read(request["length"])
+                receiver.write(request["name"], request["offset"], data)
+                response = {}
+            elif request["op"] == "commit":
+                receiver.commit(request["name"], request["size"], request["hash"])
+                response = {}
+            else:
+                response = {"error": f"Unknown request: {request['op']}"}
+        except (OSError, ValueError, SyncError) as e:
+            response = {"error": str(e)}
+        wfile.write(json.dumps(response).encode() + b"\n")
+        wfile.flush()
+
+
+class StreamTransport:
+    """
+    Sends bundles to a receiver over a pair of byte streams.
+    """
+
+    def __init__(self, rfile, wfile):
+        self.rfile = rfile
+        self.wfile = wfile
+
+    def _request(self, request, data=b""):
+        self.wfile.write(json.dumps(request).encode() + b"\n")
+        self.wfile.write(data)
+        self.wfile.flush()
+        line = self.rfile.readline()
+        if not line:
+            raise SyncError("The receiver closed the connection")
+        response = json.loads(line)
+        if "error" in response:
+            raise SyncError(response["error"])
+        return response
+
+    def offset(self, name):
+        return self._request({"op": "offset", "name": name})["offset"]
+
+    def write(self, name, offset, data):
+        request = {"op": "write", "name": name, "offset": offset, "length": len(data)}
+        self._request(request, data)
+
+    def commit(self, name, size, digest):
+        self._request({"op": "commit", "name": name, "size": size, "hash": digest})
+
+    def close(self):
+        self.wfile.close()
+
+
+class SocketTransport(StreamTransport):
+    def __init__(self, host, port, timeout=60):
+        self.socket = socket.create_connection((host, port), timeout)
+        super().__init__(self.socket.makefile("rb"), self.socket.makefile("wb"))
+
+    def close(self):
+        super().close()
+        self.socket.close()
+
+
+class SshTransport(StreamTransport):
+    """
+    Starts a receiver on the server over ssh and talks to it through the
+    ssh connection.
+    """
+
+    def __init__(self, destination, remote_directory, remote_command):
+        command = f"{remote_command} receive {shlex.quote(remote_directory)} --stdio"
+        self.process = subprocess.Popen(
+            ["ssh", destination, command], stdin=subprocess.PIPE, stdout=subprocess.PIPE
+        )
+        super().__init__(self.process.stdout, self.process.stdin)
+
+    def close(self):
+        super().close()
+        self.process.wait()
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        serve_stream(self.server.receiver, self.rfile, self.wfile)
+
+
+def serve(directory, host, port):
+    """
+    Receives bundles on a socket until interrupted.
+    """
+    server = socketserver.TCPServer((host, port), _Handler)
+    server.receiver = Receiver(directory)
+    print(f"Receiving into {directory} on {host}:{port}")
+    with server:
+        server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Send the weather station data to a backup server"
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    send = subparsers.add_parser("send", help="Send the changes to a receiver")
+    send.add_argument("root", help="The directory to back up")
+    receivers = send.add_mutually_exclusive_group(required=True)
+    receivers.add_argument("--directory", help="Write directly into this directory")
+    receivers.add_argument("--socket", metavar="HOST:PORT", help="A listening receiver")
+    receivers.add_argument("--ssh", metavar="USER@HOST", help="Start a receiver over ssh")
+    send.add_argument("--remote-directory", help="The backup directory on the ssh server")
+    send.add_argument(
+        "--remote-command",
+        default="python3 WeatherStation/sync_agent.py",
+        help="How to run the sync agent on the ssh server",
+    )
+    send.add_argument(
+        "--exclude",
+        action="append",
+        default=list(DEFAULT_EXCLUDES),
+        help="A file name or path pattern to leave out",
+    )
+    send.add_argument(
+        "--full",
+        action="store_true",
+        help="Check every file, not just new files and recently modified ones",
+    )
+
+    receive = subparsers.add_parser("receive", help="Receive changes from a sender")
+    receive.add_argument("directory", help="Where the backup is kept")
+    receive.add_argument("--host", default="127.0.0.1", help="The address to listen on")
+    receive.add_argument("--port", type=int, default=8765, help="The port to listen on")
+    receive.add_argument(
+        "--stdio", action="store_true", help="Receive on stdin and stdout (used by ssh)"
+    )
+    args = parser.parse_args(argv)
+
+    if args.command == "receive":
+        if args.stdio:
+            serve_stream(Receiver(args.directory), sys.stdin.buffer, sys.stdout.buffer)
+        else:
+            serve(args.directory, args.host, args.port)
+        return
+
+    if args.directory:
+        transport = Receiver(args.directory)
+    elif args.socket:
+        host, port = args.socket.rsplit(":", 1)
+        transport = SocketTransport(host, int(port))
+    else:
+        if not args.remote_directory:
+            parser.error("--remote-directory is required with --ssh")
+        transport = SshTransport(args.ssh, args.remote_directory, args.remote_command)
+
+    try:
+        Sender(args.root, transport, args.exclude, args.full).run()
+    finally:
+        if hasattr(transport, "close"):
+            transport.close()
+
+
+if __name__ == "__main__":
+    main()
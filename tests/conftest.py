@@ -0,0 +1,12 @@
+# Test Configuration
+#
+# Lets the tests import the station's modules, which are in the directory
+# above this one.
+#
+# Daniel Hornberger
+# 2021
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,87 @@
+# Anemometer Tests
+#
+# Daniel Hornberger
+# 2021
+
+import pytest
+
+from anemometer import WindEngine
+from timestamp_ring import TimestampRing
+
+
+def steady(start, end, per_second):
+    """
+    Returns pulse times at a steady rate, offset from the window steps.
+    """
+    count = int((end - start) * per_second)
+    return [start + 0.1 + n / per_second for n in range(count)]
+
+
+def engine_with(times):
+    engine = WindEngine()
+    for time in times:
+        engine.pulse(time)
+    return engine
+
+
+def test_steady_wind_has_no_gust():
+    engine = engine_with(steady(0.0, 60.0, 2))
+    speed = 2 * engine.mph_per_pulse_per_sec
+
+    assert engine.speed(0.0, 60.0) == pytest.approx(speed)
+    gust, lull = engine.gust_and_lull(0.0, 60.0)
+    assert gust == pytest.approx(speed)
+    assert lull == pytest.approx(speed)
+
+
+def test_gust_is_averaged_over_three_seconds():
+    # Two pulses a second, with a one second burst of twenty pulses
+    times = [time for time in steady(0.0, 60.0, 2) if not 20.0 <= time < 21.0]
+    times = sorted(times + [20.025 + n * 0.05 for n in range(20)])
+    engine = engine_with(times)
+
+    gust, lull = engine.gust_and_lull(0.0, 60.0)
+    # The burst and two seconds of the steady wind around it
+    assert gust == pytest.approx(24 / 3 * engine.mph_per_pulse_per_sec)
+    assert lull == pytest.approx(2 * engine.mph_per_pulse_per_sec)
+
+
+def test_lull_finds_a_calm():
+    times = [time for time in steady(0.0, 60.0, 2) if not 30.0 <= time < 36.0]
+    engine = engine_with(times)
+
+    gust, lull = engine.gust_and_lull(0.0, 60.0)
+    assert gust == pytest.approx(2 * engine.mph_per_pulse_per_sec)
+    assert lull == 0.0
+
+
+def test_short_interval_uses_the_average():
+    engine = engine_with(steady(0.0, 2.0, 4))
+
+    gust, lull = engine.gust_and_lull(0.0, 2.0)
+    assert gust == lull == pytest.approx(engine.speed(0.0, 2.0))
+
+
+def test_pulses_outside_the_interval_are_ignored():
+    engine = engine_with(steady(0.0, 10.0, 2) + steady(10.0, 20.0, 10))
+
+    assert engine.speed(0.0, 10.0) == pytest.approx(2 * engine.mph_per_pulse_per_sec)
+    gust, lull = engine.gust_and_lull(0.0, 10.0)
+    assert gust == pytest.approx(2 * engine.mph_per_pulse_per_sec)
+
+
+def test_ring_keeps_the_newest_timestamps():
+    ring = TimestampRing(5)
+    assert ring.capacity == 8
+    assert ring.latest() is None
+    for time in range(20):
+        ring.push(float(time))
+
+    assert ring.latest() == 19.0
+    # The oldest timestamps were overwritten
+    assert list(ring.between(0.0, 100.0)) == [float(time) for time in range(12, 20)]
+    assert ring.count_between(0.0, 100.0) == 8
+    # A range that wraps around the end of the buffer
+    assert list(ring.between(14.0, 18.0)) == [14.0, 15.0, 16.0, 17.0]
+    assert ring.count_between(14.5, 17.0) == 2
+    assert list(ring.between(30.0, 40.0)) == []
@@ -0,0 +1,90 @@
+# Circular Statistics Tests
+#
+# Daniel Hornberger
+# 2021
+
+import pytest
+
+from circular_stats import DirectionAccumulator
+from circular_stats import batch_stats
+from circular_stats import windowed_stats
+
+
+def accumulate(angles, speeds=None):
+    accumulator = DirectionAccumulator()
+    for i, angle in enumerate(angles):
+        accumulator.add(angle, 1.0 if speeds is None else speeds[i])
+    return accumulator
+
+
+@pytest.mark.parametrize(
+    "angles, mean",
+    [
+        ([350.0, 10.0], 0.0),
+        ([359.0, 1.0], 0.0),
+        ([355.0, 5.0, 0.0], 0.0),
+        ([340.0, 350.0], 345.0),
+        ([10.0, 20.0], 15.0),
+        ([90.0, 180.0], 135.0),
+    ],
+)
+def test_mean_wraps_around_north(angles, mean):
+    assert accumulate(angles).mean() == pytest.approx(mean, abs=1e-9)
+    assert batch_stats(angles).mean == pytest.approx(mean, abs=1e-9)
+    means, std_devs = windowed_stats(angles, len(angles))
+    assert float(means[0]) == pytest.approx(mean, abs=1e-9)
+    assert 0.0 <= float(means[0]) < 360.0
+
+
+def test_std_dev_doesnt_depend_on_wrapping_around_north():
+    wrapped = accumulate([350.0, 355.0, 0.0, 5.0, 10.0]).std_dev()
+    unwrapped = accumulate([80.0, 85.0, 90.0, 95.0, 100.0]).std_dev()
+    assert wrapped == pytest.approx(unwrapped)
+    # About the ordinary standard deviation for a narrow spread
+    assert wrapped == pytest.approx(7.07, abs=0.1)
+
+
+def test_std_dev_of_a_single_direction_is_zero():
+    assert accumulate([270.0] * 10).std_dev() == pytest.approx(0.0, abs=1e-6)
+    assert DirectionAccumulator().std_dev() == 0.0
+
+
+def test_vector_mean_is_weighted_by_speed():
+    accumulator = accumulate([0.0, 90.0], speeds=[10.0, 0.0])
+    direction, speed = accumulator.vector_mean()
+    assert direction == pytest.approx(0.0, abs=1e-9)
+    assert speed == pytest.approx(5.0)
+
+    stats = batch_stats([0.0, 90.0], [10.0, 0.0])
+    assert stats.vector_mean_direction == pytest.approx(0.0, abs=1e-9)
+    assert stats.vector_mean_speed == pytest.approx(5.0)
+
+
+def test_merged_accumulators_match_one_accumulator():
+    merged = accumulate([350.0, 355.0])
+    merged.merge(accumulate([5.0, 20.0]))
+    single = accumulate([350.0, 355.0, 5.0, 20.0])
+    assert merged.stats() == pytest.approx(single.stats())
+
+
+def test_batch_matches_the_accumulator():
+    angles = [(i * 37.0) % 360.0 for i in range(50)]
+    speeds = [1.0 + i % 7 for i in range(50)]
+    assert tuple(batch_stats(angles, speeds)) == pytest.approx(
+        tuple(accumulate(angles, speeds).stats())
+    )
+
+
+def test_windowed_stats_match_each_window():
+    angles = [340.0, 350.0, 355.0, 5.0, 15.0, 20.0, 10.0, 0.0]
+    means, std_devs = windowed_stats(angles, 3)
+    assert len(means) == len(angles) - 2
+    for i in range(len(means)):
+        stats = accumulate(angles[i : i + 3]).stats()
+        assert float(means[i]) == pytest.approx(stats.mean, abs=1e-9)
+        assert float(std_devs[i]) == pytest.approx(stats.std_dev, abs=1e-6)
+
+
+def test_windowed_stats_with_too_few_samples():
+    means, std_devs = windowed_stats([10.0, 20.0], 3)
+    assert len(means) == len(std_devs) == 0
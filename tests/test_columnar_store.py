@@ -0,0 +1,138 @@
+# Columnar Store Tests
+#
+# Daniel Hornberger
+# 2021
+
+import datetime
+import os
+
+import columnar_store
+
+
+def make_record(number, time):
+    return {
+        "record_number": number,
+        "time": time,
+        "temperature": 70.5 + number,
+        "pressure": 1013.25,
+        "humidity": 40.0,
+        "wind_direction": 337.5,
+        "wind_direction_string": "NNW" if number % 2 else "N",
+        "wind_speed": 3.5,
+        "wind_gust": 7.0,
+        "precipitation": 0.01 * number,
+        "image": f"image{number}.jpg",
+    }
+
+
+def write_records(directory, count, start=datetime.datetime(2021, 6, 1, 0, 0)):
+    writer = columnar_store.ColumnarWriter(directory)
+    records = [
+        make_record(number, start + datetime.timedelta(minutes=number))
+        for number in range(count)
+    ]
+    for record in records:
+        writer.append(record)
+    writer.close()
+    return records
+
+
+def test_round_trip(tmp_path):
+    records = write_records(str(tmp_path), 10)
+
+    results = columnar_store.query(
+        str(tmp_path), records[0]["time"], records[-1]["time"]
+    )
+    assert list(results["record_number"]) == list(range(10))
+    assert list(results["time"]) == [record["time"].timestamp() for record in records]
+    assert list(results["temperature"]) == [70.5 + number for number in range(10)]
+    assert results["wind_direction_string"] == [
+        record["wind_direction_string"] for record in records
+    ]
+    assert results["image"] == [record["image"] for record in records]
+
+
+def test_query_only_returns_the_range(tmp_path):
+    records = write_records(str(tmp_path), 10)
+
+    results = columnar_store.query(
+        str(tmp_path), records[3]["time"], records[5]["time"], ["record_number"]
+    )
+    assert list(results["record_number"]) == [3, 4, 5]
+
+
+def test_records_are_split_by_day(tmp_path):
+    start = datetime.datetime(2021, 6, 1, 23, 58)
+    records = write_records(str(tmp_path), 4, start)
+
+    assert sorted(os.listdir(str(tmp_path))) == [
+        "2021-06-01.wsc",
+        "2021-06-01.wsc.dict",
+        "2021-06-02.wsc",
+        "2021-06-02.wsc.dict",
+    ]
+    results = columnar_store.query(
+        str(tmp_path), records[0]["time"], records[-1]["time"], ["record_number"]
+    )
+    assert list(results["record_number"]) == [0, 1, 2, 3]
+
+
+def test_chunk_grows_when_full(tmp_path, monkeypatch):
+    monkeypatch.setattr(columnar_store, "CAPACITY", 4)
+    records = write_records(str(tmp_path), 10)
+
+    chunk = columnar_store.Chunk(os.path.join(str(tmp_path), "2021-06-01.wsc"))
+    assert chunk.count == 10
+    assert chunk.capacity == 16
+    assert list(chunk.column("record_number")) == list(range(10))
+    assert chunk.strings("image") == [record["image"] for record in records]
+    chunk.close()
+
+
+def test_writing_resumes_an_existing_chunk(tmp_path):
+    start = datetime.datetime(2021, 6, 1, 0, 0)
+    write_records(str(tmp_path), 3, start)
+
+    writer = columnar_store.ColumnarWriter(str(tmp_path))
+    writer.append(make_record(1, start + datetime.timedelta(minutes=3)))
+    writer.close()
+
+    chunk = columnar_store.Chunk(os.path.join(str(tmp_path), "2021-06-01.wsc"))
+    assert chunk.count == 4
+    # The strings already in the dictionary aren't added again
+    assert chunk.dictionary == ["N", "image0.jpg", "NNW", "image1.jpg", "image2.jpg"]
+    assert chunk.strings("image") == [
+        "image0.jpg",
+        "image1.jpg",
+        "image2.jpg",
+        "image1.jpg",
+    ]
+    chunk.close()
+
+
+def test_partly_written_record_is_ignored(tmp_path):
+    start = datetime.datetime(2021, 6, 1, 0, 0)
+    write_records(str(tmp_path), 3, start)
+    path = os.path.join(str(tmp_path), "2021-06-01.wsc")
+
+    # Write the values of a fourth record without committing it in the header,
+    # as if the power was lost part way through appending it
+    writer = columnar_store.ColumnarWriter(str(tmp_path))
+    writer._open(start.date())
+    header = bytes(writer._map[: columnar_store.HEADER_SIZE])
+    writer.append(make_record(3, start + datetime.timedelta(minutes=3)))
+    writer._map[: columnar_store.HEADER_SIZE] = header
+    writer.close()
+
+    chunk = columnar_store.Chunk(path)
+    assert chunk.count == 3
+    assert list(chunk.column("record_number")) == [0, 1, 2]
+    chunk.close()
+
+    # The next record is written over it
+    writer = columnar_store.ColumnarWriter(str(tmp_path))
+    writer.append(make_record(4, start + datetime.timedelta(minutes=4)))
+    writer.close()
+    chunk = columnar_store.Chunk(path)
+    assert list(chunk.column("record_number")) == [0, 1, 2, 4]
+    chunk.close()
@@ -0,0 +1,100 @@
+# Influx Export Tests
+#
+# Daniel Hornberger
+# 2021
+
+import datetime
+import re
+
+import influx_export
+
+SECOND = 1000000000
+
+
+class FakeDatabase:
+    """
+    Answers the exporter's queries from a list of points.
+    """
+
+    def __init__(self):
+        self.points = []
+
+    def query(self, statement):
+        if statement == "SHOW MEASUREMENTS":
+            measurements = sorted({point[0] for point in self.points})
+            return iter([{"values": [[name] for name in measurements]}])
+        if statement.startswith("SHOW FIELD KEYS"):
+            return iter([{"values": [["temperature", "float"]]}])
+        match = re.search(r"WHERE time > (-?\d+)", statement)
+        after = int(match.group(1)) if match else None
+        values = [
+            [time, temperature]
+            for measurement, time, temperature in sorted(self.points)
+            if after is None or time > after
+        ]
+        return iter([{"columns": ["time", "temperature"], "values": values}])
+
+
+def export(directory, database):
+    exporter = influx_export.InfluxExporter(directory)
+    exporter._query = database.query
+    return exporter.export(datetime.datetime(2021, 6, 1))
+
+
+def exported(directory):
+    return [
+        line
+        for path in influx_export.chunk_files(directory)
+        for line in influx_export.read_chunk(path)
+    ]
+
+
+def test_only_new_points_are_exported(tmp_path):
+    database = FakeDatabase()
+    database.points = [("weather", 100 * SECOND, 70.0), ("weather", 160 * SECOND, 71.0)]
+    assert export(str(tmp_path), database) == 2
+
+    database.points.append(("weather", 220 * SECOND, 72.0))
+    assert export(str(tmp_path), database) == 1
+    assert export(str(tmp_path), database) == 0
+    assert exported(str(tmp_path)) == [
+        f"weather temperature=70.0 {100 * SECOND}",
+        f"weather temperature=71.0 {160 * SECOND}",
+        f"weather temperature=72.0 {220 * SECOND}",
+    ]
+
+
+def test_late_point_is_exported(tmp_path):
+    database = FakeDatabase()
+    database.points = [("weather", 100 * SECOND, 70.0), ("weather", 220 * SECOND, 72.0)]
+    export(str(tmp_path), database)
+
+    # A point older than the newest one is written when a queued backlog is
+    # sent after an outage
+    database.points.append(("weather", 160 * SECOND, 71.0))
+    assert export(str(tmp_path), database) == 1
+    assert exported(str(tmp_path))[-1] == f"weather temperature=71.0 {160 * SECOND}"
+
+
+def test_changed_point_is_exported_again(tmp_path):
+    database = FakeDatabase()
+    database.points = [("weather_hourly", 3600 * SECOND, 70.0)]
+    export(str(tmp_path), database)
+
+    # The open bucket of a rollup is rewritten with every record
+    database.points = [("weather_hourly", 3600 * SECOND, 70.5)]
+    assert export(str(tmp_path), database) == 1
+    assert exported(str(tmp_path))[-1] == f"weather_hourly temperature=70.5 {3600 * SECOND}"
+
+
+def test_points_outside_the_lookback_are_forgotten(tmp_path):
+    database = FakeDatabase()
+    database.points = [("weather", 100 * SECOND, 70.0)]
+    export(str(tmp_path), database)
+
+    day = 24 * 60 * 60 * SECOND
+    database.points.append(("weather", 100 * SECOND + 3 * day, 71.0))
+    export(str(tmp_path), database)
+
+    exporter = influx_export.InfluxExporter(str(tmp_path))
+    assert list(exporter.state["recent"]["weather"]) == [str(100 * SECOND + 3 * day)]
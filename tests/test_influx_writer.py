@@ -0,0 +1,108 @@
+# InfluxDB Writer Tests
+#
+# Daniel Hornberger
+# 2021
+
+import os
+
+import influx_writer
+
+
+def lines(start, count):
+    return [f"weather value={number}i" for number in range(start, start + count)]
+
+
+def test_queue_round_trip(tmp_path):
+    queue = influx_writer.WriteAheadQueue(str(tmp_path))
+    queue.append(lines(0, 5))
+    assert queue.depth == 5
+
+    batch, position = queue.peek(3)
+    assert batch == lines(0, 3)
+    queue.remove(len(batch), position)
+    assert queue.depth == 2
+
+    batch, position = queue.peek(10)
+    assert batch == lines(3, 2)
+    queue.remove(len(batch), position)
+    assert queue.depth == 0
+    assert queue.peek(10)[0] == []
+    queue.close()
+
+
+def test_queue_spans_segments(tmp_path):
+    queue = influx_writer.WriteAheadQueue(str(tmp_path), segment_size=50)
+    for start in range(0, 20, 4):
+        queue.append(lines(start, 4))
+    assert len(queue._segments()) > 1
+
+    batch, position = queue.peek(20)
+    assert batch == lines(0, 20)
+    queue.remove(len(batch), position)
+    # The segments that were completely sent are deleted
+    assert len(queue._segments()) == 1
+    queue.close()
+
+
+def test_queue_survives_a_restart(tmp_path):
+    queue = influx_writer.WriteAheadQueue(str(tmp_path))
+    queue.append(lines(0, 5))
+    batch, position = queue.peek(2)
+    queue.remove(len(batch), position)
+    queue.close()
+
+    queue = influx_writer.WriteAheadQueue(str(tmp_path))
+    assert queue.depth == 3
+    assert queue.peek(10)[0] == lines(2, 3)
+    queue.close()
+
+
+def test_queue_removes_a_torn_line(tmp_path):
+    queue = influx_writer.WriteAheadQueue(str(tmp_path))
+    queue.append(lines(0, 2))
+    queue.close()
+
+    # A line only partly written when the power was lost
+    with open(os.path.join(str(tmp_path), "0000000000.lp"), "ab") as file:
+        file.write(b"weather val")
+
+    queue = influx_writer.WriteAheadQueue(str(tmp_path))
+    assert queue.depth == 2
+    queue.append(lines(2, 1))
+    assert queue.peek(10)[0] == lines(0, 3)
+    queue.close()
+
+
+def test_line_protocol_escaping():
+    point = {
+        "measurement": "weather station,v2",
+        "tags": {"location": "back yard", "a=b": "c,d"},
+        "fields": {"note": 'said "hi" \\o/', "count": 3, "ok": True, "gap": None},
+        "time": 1.5,
+    }
+    assert influx_writer.to_line_protocol(point) == (
+        "weather\\ station\\,v2,a\\=b=c\\,d,location=back\\ yard "
+        'note="said \\"hi\\" \\\\o/",count=3i,ok=true 1500000000'
+    )
+
+
+def test_rejected_batch_keeps_the_good_points(tmp_path):
+    writer = influx_writer.InfluxWriter(str(tmp_path), batch_size=10, name="test")
+    sent = []
+
+    def send(batch):
+        if any("bad" in line for line in batch):
+            raise influx_writer.WriteRejected("invalid field")
+        sent.extend(batch)
+
+    writer._send = send
+    good = lines(0, 8)
+    writer.write_lines(good[:5] + ["weather bad"] + good[5:] + ["weather bad"])
+
+    assert writer.flush() == 10
+    assert sorted(sent) == sorted(good)
+    assert writer.points_written == 8
+    assert writer.points_rejected == 2
+    with open(os.path.join(str(tmp_path), influx_writer.REJECTED_FILE)) as file:
+        assert file.read() == "weather bad\nweather bad\n"
+    writer.queue.close()
@@ -0,0 +1,129 @@
+# Ingest Server Tests
+#
+# Daniel Hornberger
+# 2021
+
+import pytest
+
+import ingest_server
+from ingest_server import InvalidPoint
+from ingest_server import validate_line
+
+
+def test_station_tag_is_added():
+    assert validate_line("weather temperature=70.5 1", "home") == (
+        "home",
+        "weather,station=home temperature=70.5 1",
+    )
+
+
+def test_station_tag_goes_after_the_other_tags():
+    assert validate_line("weather,location=back\\ yard temperature=70.5", "home") == (
+        "home",
+        "weather,location=back\\ yard,station=home temperature=70.5",
+    )
+
+
+def test_station_tag_in_the_line_is_used():
+    line = "weather,station=home temperature=70.5"
+    assert validate_line(line) == ("home", line)
+    assert validate_line(line, "home") == ("home", line)
+
+
+def test_station_tag_must_match():
+    with pytest.raises(InvalidPoint):
+        validate_line("weather,station=home temperature=70.5", "cabin")
+
+
+def test_station_is_required():
+    with pytest.raises(InvalidPoint):
+        validate_line("weather temperature=70.5")
+
+
+def test_escaped_station_text_isnt_a_station_tag():
+    assert validate_line("weather,note=station\\=cabin temperature=70.5", "home") == (
+        "home",
+        "weather,note=station\\=cabin,station=home temperature=70.5",
+    )
+
+
+@pytest.mark.parametrize(
+    "line",
+    [
+        "weather\\ station temperature=70.5",
+        "weather\\,v2 temperature=70.5",
+        "weather,a\\,b=c\\=d\\ e temperature=70.5",
+        'weather note="a \\"quoted\\" value, with = and spaces"',
+        'weather note="a backslash \\\\"',
+        "weather count=3i,ok=true,level=-1.5e3 1600000000000000000",
+    ],
+)
+def test_escaped_lines_are_valid(line):
+    assert validate_line(line, "home")[0] == "home"
+
+
+@pytest.mark.parametrize(
+    "line",
+    [
+        "",
+        "weather",
+        "weather temperature=",
+        "weather,location=back yard temperature=70.5",
+        "weather temperature=70.5 tomorrow",
+        'weather note="unterminated',
+        'weather note="escaped end\\"',
+        "weather,location= temperature=70.5",
+        "weather temperature=70.5\\",
+        "weather temperature=70.5\nweather temperature=71.0",
+    ],
+)
+def test_invalid_lines_are_rejected(line):
+    with pytest.raises(InvalidPoint):
+        validate_line(line, "home")
+
+
+@pytest.mark.parametrize(
+    "precision, time",
+    [
+        ("ns", "1600000000000000000"),
+        ("u", "1600000000000000"),
+        ("ms", "1600000000000"),
+        ("s", "1600000000"),
+        ("h", "444444"),
+    ],
+)
+def test_timestamps_are_converted_to_nanoseconds(precision, time):
+    station, line = validate_line(f"weather temperature=70.5 {time}", "home", precision)
+    expected = int(time) * ingest_server.PRECISIONS[precision]
+    assert line == f"weather,station=home temperature=70.5 {expected}"
+
+
+def test_precision_doesnt_change_a_line_without_a_timestamp():
+    assert validate_line("weather temperature=70.5", "home", "s") == (
+        "home",
+        "weather,station=home temperature=70.5",
+    )
+
+
+def test_write_endpoint_uses_the_precision():
+    server = ingest_server.IngestServer(None)
+    submitted = []
+
+    def submit(lines):
+        submitted.append(dict(lines))
+        return 204, 0
+
+    server.submit = submit
+
+    status, body, headers = server.handle_request(
+        "POST", "/write?station=home&precision=s", {}, b"weather temperature=70.5 1600000000"
+    )
+    assert status == 204
+    assert submitted == [
+        {"home": ["weather,station=home temperature=70.5 1600000000000000000"]}
+    ]
+
+    status, body, headers = server.handle_request(
+        "POST", "/write?station=home&precision=fortnights", {}, b"weather temperature=70.5 1"
+    )
+    assert status == 400
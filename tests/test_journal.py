@@ -0,0 +1,85 @@
+# Journal Tests
+#
+# Daniel Hornberger
+# 2021
+
+import os
+
+import journal
+
+LABELS = "Record Number,Temperature (F)\n"
+
+
+def read(path):
+    with open(path) as file:
+        return file.read()
+
+
+def test_records_are_appended(tmp_path):
+    path = os.path.join(str(tmp_path), "data.csv")
+    data_file = journal.DataFile(path, LABELS)
+    data_file.append("0,70.5\n")
+    data_file.append("1,71.0\n")
+    data_file.close()
+
+    assert read(path) == LABELS + "0,70.5\n1,71.0\n"
+    assert os.path.getsize(path + journal.JOURNAL_SUFFIX) == 2 * journal.ENTRY.size
+
+
+def test_torn_record_is_removed(tmp_path):
+    path = os.path.join(str(tmp_path), "data.csv")
+    data_file = journal.DataFile(path, LABELS)
+    data_file.append("0,70.5\n")
+    data_file.close()
+
+    # A record written without its journal entry
+    with open(path, "a") as file:
+        file.write("1,7")
+
+    data_file = journal.DataFile(path, LABELS)
+    data_file.append("1,71.0\n")
+    data_file.close()
+    assert read(path) == LABELS + "0,70.5\n1,71.0\n"
+
+
+def test_journal_entry_without_its_record_is_removed(tmp_path):
+    path = os.path.join(str(tmp_path), "data.csv")
+    data_file = journal.DataFile(path, LABELS)
+    data_file.append("0,70.5\n")
+    data_file.append("1,71.0\n")
+    data_file.close()
+
+    # The journal entry of the second record reached the disk, but the
+    # record itself didn't completely
+    with open(path, "r+") as file:
+        file.truncate(len(LABELS) + len("0,70.5\n1,7"))
+
+    assert journal.recover(path) == len("1,7")
+    assert read(path) == LABELS + "0,70.5\n"
+    assert os.path.getsize(path + journal.JOURNAL_SUFFIX) == journal.ENTRY.size
+
+
+def test_torn_journal_entry_is_removed(tmp_path):
+    path = os.path.join(str(tmp_path), "data.csv")
+    data_file = journal.DataFile(path, LABELS)
+    data_file.append("0,70.5\n")
+    data_file.close()
+
+    with open(path, "a") as file:
+        file.write("1,71.0\n")
+    with open(path + journal.JOURNAL_SUFFIX, "ab") as file:
+        file.write(b"\x01\x02\x03")
+
+    journal.recover(path)
+    assert read(path) == LABELS + "0,70.5\n"
+    assert os.path.getsize(path + journal.JOURNAL_SUFFIX) == journal.ENTRY.size
+
+
+def test_labels_are_kept_without_records(tmp_path):
+    path = os.path.join(str(tmp_path), "data.csv")
+    journal.DataFile(path, LABELS).close()
+    with open(path, "a") as file:
+        file.write("0,70")
+
+    journal.recover_directory(str(tmp_path))
+    assert read(path) == LABELS
@@ -0,0 +1,105 @@
+# Metrics Tests
+#
+# Daniel Hornberger
+# 2021
+
+import pytest
+
+import metrics
+from metrics import Registry
+
+
+def test_same_metric_is_returned_for_the_same_name_and_labels():
+    registry = Registry()
+    first = registry.counter("samples", "Samples", {"sensor": "bme280"})
+    assert registry.counter("samples", "Samples", {"sensor": "bme280"}) is first
+    assert registry.counter("samples", "Samples", {"sensor": "wind"}) is not first
+    with pytest.raises(ValueError):
+        registry.gauge("samples", "Samples", {"sensor": "bme280"})
+
+
+def test_counter_reads_the_latest_function():
+    registry = Registry()
+    counter = registry.counter("points", "Points", function=lambda: 5)
+    assert counter.get() == 5
+    # Registered again by a restarted subsystem
+    registry.counter("points", "Points", function=lambda: 7)
+    assert counter.get() == 7
+
+
+def test_histogram_buckets_and_quantiles():
+    registry = Registry()
+    histogram = registry.histogram("latency", "Latency")
+    for value in [0.0001] * 90 + [0.5] * 10:
+        histogram.observe(value)
+
+    assert histogram.quantile(0.5) == 0.0001
+    assert histogram.quantile(0.95) == pytest.approx(0.562)
+    assert histogram.count == 100
+    assert histogram.sum == pytest.approx(0.009 + 5.0)
+
+
+def test_values_are_counted_once_enough_are_pending():
+    histogram = Registry().histogram("latency", "Latency")
+    for n in range(metrics.PENDING_LIMIT - 1):
+        histogram.observe(0.001)
+    assert histogram.count == 0
+    histogram.observe(0.001)
+    assert histogram.count == metrics.PENDING_LIMIT
+
+
+def test_stage_is_timed_as_a_context_manager():
+    histogram = Registry().histogram("stage_seconds", "Stages", {"stage": "test"})
+    with histogram:
+        pass
+    histogram.fold()
+    assert histogram.count == 1
+    assert 0.0 <= histogram.sum < 1.0
+
+
+def test_render_in_the_prometheus_format():
+    registry = Registry(prefix="test_")
+    registry.counter("writes", "Writes", {"queue": "database"}).inc(3)
+    registry.gauge("depth", "Depth", function=lambda: 2.5)
+    histogram = registry.histogram("latency", "Latency")
+    histogram.observe(0.002)
+
+    lines = registry.render().splitlines()
+    assert "# HELP test_writes Writes" in lines
+    assert "# TYPE test_writes counter" in lines
+    assert 'test_writes_total{queue="database"} 3' in lines
+    assert "# TYPE test_depth gauge" in lines
+    assert "test_depth 2.5" in lines
+    assert 'test_latency_bucket{le="0.00178"} 0' in lines
+    assert 'test_latency_bucket{le="0.00316"} 1' in lines
+    assert 'test_latency_bucket{le="+Inf"} 1' in lines
+    assert "test_latency_count 1" in lines
+
+
+def test_failing_function_is_left_out():
+    registry = Registry(prefix="test_")
+
+    def closed():
+        raise ValueError("closed")
+
+    registry.gauge("depth", "Depth", function=closed)
+    registry.gauge("other", "Other").set(1)
+    lines = registry.render().splitlines()
+    assert "test_other 1" in lines
+    assert not [line for line in lines if line.startswith("test_depth")]
+    assert registry.summary() == "test_other 1"
+
+
+def test_summary_shows_the_changes_since_the_last_one():
+    registry = Registry()
+    counter = registry.counter("samples", "Samples")
+    histogram = registry.histogram("stage_seconds", "Stages", {"stage": "csv"})
+    counter.inc(4)
+    histogram.observe(0.002)
+    histogram.observe(0.004)
+
+    assert registry.summary() == (
+        "csv 2x mean 3.0 ms p99 4.0 ms max 4.0 ms; samples +4"
+    )
+    counter.inc()
+    assert registry.summary() == "samples +1"
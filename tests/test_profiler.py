@@ -0,0 +1,95 @@
+# Profiler Tests
+#
+# Daniel Hornberger
+# 2021
+
+import os
+import threading
+import time
+
+import profiler
+from profiler import Profiler
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_stacks_are_written_when_stopped(tmp_path):
+    busy = threading.Event()
+
+    def worker():
+        busy.wait(5.0)
+
+    thread = threading.Thread(target=worker, name="worker", daemon=True)
+    thread.start()
+    profile = Profiler(str(tmp_path), rate=200)
+    profile.start()
+    time.sleep(0.1)
+    profile.stop()
+    busy.set()
+    thread.join()
+
+    wait_for(lambda: os.path.exists(profile.path))
+    wait_for(lambda: not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")])
+    with open(profile.path) as file:
+        lines = file.read().splitlines()
+    assert profile.path.endswith(".folded")
+    assert any(line.startswith("worker;") and "worker (test_profiler.py)" in line for line in lines)
+    for line in lines:
+        stack, count = line.rsplit(" ", 1)
+        assert int(count) > 0
+
+
+def test_written_file_is_limited(tmp_path):
+    profile = Profiler(str(tmp_path), max_file_size=30)
+    path = str(tmp_path / "profile.folded")
+    profile._write(path, {"MainThread;a (a.py)": 1, "MainThread;b (b.py)": 5})
+    with open(path) as file:
+        assert file.read() == "MainThread;b (b.py) 5\n"
+
+
+def test_only_the_newest_profiles_are_kept(tmp_path):
+    for number in range(5):
+        path = tmp_path / f"profile-{number}.folded"
+        path.write_text("")
+        os.utime(path, (1000 + number, 1000 + number))
+    (tmp_path / "other.txt").write_text("")
+
+    Profiler(str(tmp_path), max_files=2)._remove_old()
+    assert sorted(os.listdir(tmp_path)) == [
+        "other.txt",
+        "profile-3.folded",
+        "profile-4.folded",
+    ]
+
+
+def test_control_file_starts_and_stops_profiling(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiler, "CONTROL_CHECK_INTERVAL", 0.0)
+    control = tmp_path / "profile.on"
+    profile = Profiler(str(tmp_path / "profiles"), control_file=str(control))
+
+    profile.poll()
+    assert not profile.running
+    control.write_text("")
+    profile.poll()
+    assert profile.running
+    control.unlink()
+    profile.poll()
+    assert not profile.running
+
+
+def test_control_file_is_only_checked_occasionally(tmp_path):
+    control = tmp_path / "profile.on"
+    profile = Profiler(str(tmp_path / "profiles"), control_file=str(control))
+    profile.poll()
+    control.write_text("")
+    profile.poll()
+    assert not profile.running
+
+
+def test_label():
+    assert profiler._label(test_label.__code__) == "test_label (test_profiler.py)"
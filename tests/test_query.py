@@ -0,0 +1,128 @@
+# Query Tests
+#
+# Daniel Hornberger
+# 2021
+
+import datetime
+import os
+
+import pytest
+
+import query
+
+START = datetime.datetime(2021, 6, 1, 10, 0)
+
+
+def row(number, time, temperature=70.0, direction=0.0, precipitation=0.0):
+    return [
+        number,
+        time.isoformat(),
+        temperature,
+        1013.2,
+        40.0,
+        direction,
+        "N",
+        3.0,
+        6.0,
+        precipitation,
+        "",
+    ]
+
+
+def write_file(directory, started, rows, labels=query.CSV_LABELS):
+    path = os.path.join(directory, started.strftime(query.FILE_TIME_FORMAT) + ".csv")
+    with open(path, "w") as file:
+        file.write(",".join(labels) + "\n")
+        for values in rows:
+            file.write(",".join(str(value) for value in values) + "\n")
+    return path
+
+
+def test_files_are_in_the_order_they_were_started(tmp_path):
+    later = write_file(str(tmp_path), START + datetime.timedelta(days=1), [])
+    earlier = write_file(str(tmp_path), START, [])
+    (tmp_path / "notes.csv").write_text("not a data file\n")
+
+    assert query.csv_files(str(tmp_path)) == [earlier, later]
+    assert query.csv_files(str(tmp_path), START + datetime.timedelta(hours=1)) == [earlier]
+
+
+def test_records_are_filtered_by_time(tmp_path):
+    rows = [row(n, START + datetime.timedelta(minutes=15 * n)) for n in range(8)]
+    path = write_file(str(tmp_path), START, rows)
+
+    records = list(
+        query.read_csv(
+            path, START + datetime.timedelta(minutes=30), START + datetime.timedelta(hours=1)
+        )
+    )
+    assert [record["Record Number"] for record in records] == [2.0, 3.0]
+    assert records[0]["Time"] == START + datetime.timedelta(minutes=30)
+    assert records[0]["Temperature (F)"] == 70.0
+
+
+def test_malformed_rows_are_skipped(tmp_path):
+    path = write_file(
+        str(tmp_path),
+        START,
+        [row(0, START), ["1", "not a time"], row(2, START) + ["extra"], row(3, START)],
+    )
+    assert [record["Record Number"] for record in query.read_csv(path)] == [0.0, 3.0]
+
+
+def test_file_without_the_labels_is_skipped(tmp_path, capsys):
+    path = write_file(str(tmp_path), START, [row(0, START)], labels=["a", "b"])
+    assert list(query.read_csv(path)) == []
+    assert "Skipping" in capsys.readouterr().err
+
+
+def test_records_are_aggregated_by_hour():
+    records = [
+        {
+            "Time": START + datetime.timedelta(minutes=20 * n),
+            "Temperature (F)": 60.0 + n,
+            "Wind Direction (Degrees)": [350.0, 10.0, 20.0, 340.0][n % 4],
+        }
+        for n in range(6)
+    ]
+    # A reading the sensor couldn't take
+    records[1]["Temperature (F)"] = query.MISSING_VALUE
+
+    buckets = query.aggregate_records(
+        records, ["Temperature (F)", "Wind Direction (Degrees)"], "hour"
+    )
+    assert sorted(buckets) == [START, START + datetime.timedelta(hours=1)]
+    first = buckets[START]
+    assert first["Temperature (F)"].result("count") == 2
+    assert first["Temperature (F)"].result("min") == 60.0
+    assert first["Temperature (F)"].result("max") == 62.0
+    assert first["Temperature (F)"].result("mean") == 61.0
+    # 350, 10 and 20 degrees average across north
+    mean = first["Wind Direction (Degrees)"].result("mean", direction=True)
+    assert mean == pytest.approx(6.7, abs=0.05)
+
+
+def test_aggregates_are_merged_across_files(tmp_path):
+    write_file(
+        str(tmp_path),
+        START,
+        [row(n, START + datetime.timedelta(minutes=15 * n), 60.0 + n) for n in range(4)],
+    )
+    later = START + datetime.timedelta(minutes=45)
+    write_file(
+        str(tmp_path),
+        later,
+        [row(n, later + datetime.timedelta(minutes=5 * n), 70.0) for n in range(1, 4)],
+    )
+
+    buckets = query.aggregate(
+        str(tmp_path), "csv", None, None, ["Temperature (F)"], "hour", processes=2
+    )
+    assert [start for start, aggregates in buckets] == [
+        START,
+        START + datetime.timedelta(hours=1),
+    ]
+    first = buckets[0][1]["Temperature (F)"]
+    assert first.result("count") == 6
+    assert first.result("max") == 70.0
+    assert first.result("sum") == 60.0 + 61.0 + 62.0 + 63.0 + 70.0 + 70.0
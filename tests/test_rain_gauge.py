@@ -0,0 +1,123 @@
+# Rain Gauge Tests
+#
+# Daniel Hornberger
+# 2021
+
+import datetime
+import os
+
+import pytest
+
+from rain_gauge import RainEngine
+
+START = datetime.datetime(2021, 6, 1, 12, 0).timestamp()
+
+
+def test_tips_persist_across_reopen(tmp_path):
+    path = str(tmp_path / "rain_tips.bin")
+    rain = RainEngine(path, capacity=16)
+    for i in range(3):
+        rain.tip(START + i * 60)
+    rain.flush()
+    rain.tip(START + 180)
+    rain.close()
+
+    rain = RainEngine(path, capacity=16)
+    assert rain.tips.count == 4
+    assert list(rain.tips.between(0, float("inf"))) == [START + i * 60 for i in range(4)]
+    rain.close()
+
+
+def test_unflushed_tips_are_lost_on_a_crash(tmp_path):
+    path = str(tmp_path / "rain_tips.bin")
+    rain = RainEngine(path, capacity=16)
+    rain.tip(START)
+    rain.flush()
+    rain.tip(START + 60)
+    # Reopened without flushing, as after a power loss
+    reopened = RainEngine(path, capacity=16)
+    assert reopened.tips.count == 1
+    reopened.close()
+    rain.close()
+
+
+def test_ring_wraps_around_after_reopen(tmp_path):
+    path = str(tmp_path / "rain_tips.bin")
+    rain = RainEngine(path, capacity=8)
+    for i in range(6):
+        rain.tip(START + i * 60)
+    rain.close()
+
+    rain = RainEngine(path, capacity=8)
+    for i in range(6, 12):
+        rain.tip(START + i * 60)
+    rain.close()
+
+    rain = RainEngine(path, capacity=8)
+    assert list(rain.tips.between(0, float("inf"))) == [START + i * 60 for i in range(4, 12)]
+    rain.close()
+
+
+def test_file_of_another_capacity_is_started_again(tmp_path):
+    path = str(tmp_path / "rain_tips.bin")
+    rain = RainEngine(path, capacity=8)
+    rain.tip(START)
+    rain.close()
+
+    rain = RainEngine(path, capacity=16)
+    assert rain.tips.count == 0
+    rain.close()
+    assert os.path.getsize(path) == 64 + 16 * 8
+
+
+def test_bounces_are_ignored(tmp_path):
+    rain = RainEngine(str(tmp_path / "rain_tips.bin"), capacity=16)
+    rain.tip(START)
+    rain.tip(START + 0.1)
+    rain.tip(START + 2.0)
+    assert rain.tips.count == 2
+    assert rain.bounces == 1
+    rain.close()
+
+
+def test_tips_stay_in_order_when_the_clock_is_set_back(tmp_path):
+    rain = RainEngine(str(tmp_path / "rain_tips.bin"), capacity=16)
+    rain.tip(START)
+    rain.tip(START - 100)
+    assert list(rain.tips.between(0, float("inf"))) == [START, START]
+    rain.close()
+
+
+def test_rainfall_and_rates(tmp_path):
+    rain = RainEngine(str(tmp_path / "rain_tips.bin"), bucket_size=0.01, capacity=64)
+    # A tip a minute for 10 minutes, then a tip every 10 minutes for an hour
+    times = [START + i * 60 for i in range(10)]
+    times += [START + 600 + i * 600 for i in range(6)]
+    for time in times:
+        rain.tip(time)
+
+    now = datetime.datetime.fromtimestamp(START + 4000)
+    assert rain.daily_total(now) == pytest.approx(0.16)
+    assert rain.rainfall(START, START + 600) == pytest.approx(0.10)
+    assert rain.rate(START + 3600) == pytest.approx(0.15)
+    # The highest 5 minute rate is during the first ten minutes
+    assert rain.max_rate(START - 300, START + 3600) == pytest.approx(0.05 * 12)
+    rain.close()
+
+
+def test_last_event(tmp_path):
+    rain = RainEngine(str(tmp_path / "rain_tips.bin"), bucket_size=0.01, capacity=64)
+    for i in range(3):
+        rain.tip(START + i * 60)
+    # A separate shower two hours later
+    for i in range(4):
+        rain.tip(START + 7200 + i * 60)
+
+    event = rain.last_event(START + 7500)
+    assert event.start == START + 7200
+    assert event.end == START + 7380
+    assert event.total == pytest.approx(0.04)
+    assert event.ongoing
+    assert not rain.last_event(START + 7380 + 3601).ongoing
+    assert rain.last_event(START + 30 * 24 * 3600) is None
+    rain.close()
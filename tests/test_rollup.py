@@ -0,0 +1,50 @@
+# Rollup Tests
+#
+# Daniel Hornberger
+# 2021
+
+import csv
+import datetime
+import os
+
+import rollup
+
+
+def write_rows(path, rows):
+    with open(path, "w", newline="") as file:
+        csv_writer = csv.writer(file)
+        csv_writer.writerow(["Start"] + rollup.LABELS)
+        csv_writer.writerows(rows)
+
+
+def read_starts(path):
+    with open(path, newline="") as file:
+        return [row[0] for row in list(csv.reader(file))[1:]]
+
+
+def test_rebuild_of_a_range_without_records(tmp_path):
+    data_directory = tmp_path / "data"
+    rollup_directory = tmp_path / "rollups"
+    data_directory.mkdir()
+    rollup_directory.mkdir()
+    blank = [""] * len(rollup.LABELS)
+    write_rows(
+        str(rollup_directory / "monthly.csv"),
+        [["2021-07-01 00:00:00"] + blank, ["2021-08-01 00:00:00"] + blank],
+    )
+    # Left by an interrupted rebuild
+    (rollup_directory / "rebuild").mkdir()
+    (rollup_directory / "rebuild" / "daily.csv").write_text("partial")
+
+    rollup.rebuild(
+        str(data_directory),
+        str(rollup_directory),
+        datetime.datetime(2021, 8, 1),
+        datetime.datetime(2021, 9, 1),
+    )
+
+    # The rows of the rebuilt range are removed and the others are kept
+    assert read_starts(str(rollup_directory / "monthly.csv")) == ["2021-07-01 00:00:00"]
+    for name in rollup.FILE_NAMES.values():
+        assert os.path.exists(str(rollup_directory / name))
+    assert not os.path.exists(str(rollup_directory / "rebuild"))
@@ -0,0 +1,75 @@
+# Scheduler Tests
+#
+# Daniel Hornberger
+# 2021
+
+import pytest
+
+from scheduler import Scheduler
+
+
+class FakeClock:
+    """
+    A clock whose time only moves when it's slept or advanced.
+    """
+
+    def __init__(self, time, monotonic=1000.0):
+        self.offset = time - monotonic
+        self.now = monotonic
+        self.sleeps = []
+
+    def time(self):
+        return self.now + self.offset
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def test_ticks_are_aligned_to_the_wall_clock():
+    clock = FakeClock(time=1000000.5)
+    ticks = Scheduler(5, 15, clock).ticks()
+
+    first = next(ticks)
+    assert clock.time() == 1000005.0
+    assert first.number == 200001
+    assert first.lateness == 0.0
+    # The log ticks are the ones at multiples of 15 seconds
+    assert first.is_log
+    assert [next(ticks).is_log for n in range(4)] == [False, False, True, False]
+
+
+def test_log_interval_must_be_a_multiple():
+    with pytest.raises(ValueError):
+        Scheduler(5, 12, FakeClock(time=0.0))
+
+
+def test_missed_ticks_are_caught_up():
+    clock = FakeClock(time=1000000.0)
+    scheduler = Scheduler(5, 15, clock)
+    ticks = scheduler.ticks()
+    first = next(ticks)
+
+    # The work of the first tick takes long enough to miss three deadlines
+    clock.now += 17.0
+    sleeps = len(clock.sleeps)
+    caught_up = [next(ticks) for n in range(3)]
+    assert [tick.number for tick in caught_up] == [
+        first.number + 1,
+        first.number + 2,
+        first.number + 3,
+    ]
+    assert [tick.lateness for tick in caught_up] == [12.0, 7.0, 2.0]
+    # They fire immediately one after another
+    assert len(clock.sleeps) == sleeps
+    assert scheduler.overruns == 2
+
+    # Then the schedule continues without drifting
+    following = next(ticks)
+    assert following.number == first.number + 4
+    assert following.deadline == first.deadline + 20.0
+    assert following.lateness == 0.0
+    assert clock.sleeps[-1] == pytest.approx(3.0)
@@ -0,0 +1,119 @@
+# Sync Agent Tests
+#
+# Daniel Hornberger
+# 2021
+
+import os
+
+import pytest
+
+import sync_agent
+
+
+def sync(root, backup):
+    sender = sync_agent.Sender(str(root), sync_agent.Receiver(str(backup)))
+    sender.run()
+    return sender
+
+
+def test_files_are_copied(tmp_path):
+    root = tmp_path / "root"
+    backup = tmp_path / "backup"
+    (root / "data").mkdir(parents=True)
+    (root / "data" / "06-01-2021.csv").write_bytes(b"a,b\n1,2\n")
+    (root / "notes.txt").write_bytes(b"hello")
+
+    sync(root, backup)
+
+    assert (backup / "data" / "06-01-2021.csv").read_bytes() == b"a,b\n1,2\n"
+    assert (backup / "notes.txt").read_bytes() == b"hello"
+
+
+def test_appended_open_file_in_an_unchanged_directory_is_sent(tmp_path):
+    root = tmp_path / "root"
+    backup = tmp_path / "backup"
+    (root / "data").mkdir(parents=True)
+    path = root / "data" / "rain_tips.bin"
+    path.write_bytes(b"tip\n")
+    # Sent while it's open, long after it was last changed
+    os.utime(str(path), (1000000000, 1000000000))
+    with open(str(path), "ab") as file:
+        sync(root, backup)
+
+        # Appending doesn't change the directory's modification time
+        directory_stat = os.stat(str(root / "data"))
+        file.write(b"tip\n")
+    os.utime(
+        str(root / "data"), ns=(directory_stat.st_atime_ns, directory_stat.st_mtime_ns)
+    )
+
+    # Found since it was open during the last run, though it isn't now
+    sender = sync(root, backup)
+    assert sender.files_changed == 1
+    assert (backup / "data" / "rain_tips.bin").read_bytes() == b"tip\ntip\n"
+
+
+def test_idle_files_in_unchanged_directories_arent_checked(tmp_path):
+    root = tmp_path / "root"
+    backup = tmp_path / "backup"
+    (root / "data").mkdir(parents=True)
+    (root / "data" / "old.csv").write_bytes(b"old")
+    (root / "data" / "recent.csv").write_bytes(b"recent")
+    os.utime(str(root / "data" / "old.csv"), (1000000000, 1000000000))
+    sync(root, backup)
+
+    sender = sync_agent.Sender(str(root), sync_agent.Receiver(str(backup)))
+    candidates, updates = sender.scan()
+    assert list(candidates) == ["data/recent.csv"]
+
+
+def test_only_changed_blocks_are_sent(tmp_path, monkeypatch):
+    monkeypatch.setattr(sync_agent, "BLOCK_SIZE", 4)
+    root = tmp_path / "root"
+    backup = tmp_path / "backup"
+    root.mkdir()
+    (root / "file").write_bytes(b"aaaabbbbcccc")
+    sync(root, backup)
+
+    (root / "file").write_bytes(b"aaaaBBBBcccc")
+    sender = sync(root, backup)
+    assert (backup / "file").read_bytes() == b"aaaaBBBBcccc"
+    assert sender.bytes_packed == 4
+
+
+def test_removed_file_is_kept_by_the_receiver(tmp_path):
+    root = tmp_path / "root"
+    backup = tmp_path / "backup"
+    root.mkdir()
+    (root / "file").write_bytes(b"data")
+    sync(root, backup)
+
+    (root / "file").unlink()
+    sync(root, backup)
+    assert (backup / "file").read_bytes() == b"data"
+
+
+def test_interrupted_pack_doesnt_reuse_bundle_numbers(tmp_path, monkeypatch):
+    monkeypatch.setattr(sync_agent, "BUNDLE_SIZE", 10)
+    root = tmp_path / "root"
+    backup = tmp_path / "backup"
+    root.mkdir()
+    for name in ["a.csv", "b.csv", "c.csv"]:
+        (root / name).write_bytes(name.encode() * 5)
+
+    # The pack fails after the first bundle was finished
+    changes = sync_agent.Sender._changes
+
+    def failing_changes(sender, name, stat, old):
+        if name == "c.csv":
+            raise OSError("read error")
+        return changes(sender, name, stat, old)
+
+    monkeypatch.setattr(sync_agent.Sender, "_changes", failing_changes)
+    with pytest.raises(OSError):
+        sync(root, backup)
+    monkeypatch.setattr(sync_agent.Sender, "_changes", changes)
+
+    sync(root, backup)
+    for name in ["a.csv", "b.csv", "c.csv"]:
+        assert (backup / name).read_bytes() == name.encode() * 5
@@ -0,0 +1,57 @@
+# Wind Direction Tests
+#
+# Daniel Hornberger
+# 2021
+
+import pytest
+
+import wind_direction
+from wind_direction import DirectionDecoder
+
+MAX_CODE = 4095
+
+
+def closest_heading(code, calibration):
+    """
+    Decodes an ADC code by searching the calibration, as the station did
+    before the lookup table.
+    """
+    voltage = round(code / MAX_CODE * wind_direction.VREF, 3)
+    closest_voltage = min(calibration, key=lambda x: abs(x - voltage))
+    return calibration[closest_voltage]
+
+
+def test_table_matches_the_closest_voltage_for_every_code():
+    decoder = DirectionDecoder(wind_direction.volts, max_code=MAX_CODE)
+    for code in range(MAX_CODE + 1):
+        assert decoder.angle(code) == closest_heading(code, wind_direction.volts), code
+
+
+def test_table_with_another_calibration():
+    calibration = {3.0: 90.0, 0.5: 0.0, 1.75: 180.0}
+    decoder = DirectionDecoder(calibration, max_code=MAX_CODE)
+    for code in range(MAX_CODE + 1):
+        assert decoder.angle(code) == closest_heading(code, calibration), code
+
+
+def test_codes_of_each_calibrated_voltage():
+    decoder = DirectionDecoder(wind_direction.volts, max_code=MAX_CODE)
+    for voltage, heading in wind_direction.volts.items():
+        code = round(voltage / wind_direction.VREF * MAX_CODE)
+        assert decoder.angle(code) == heading
+        assert decoder.direction(code) == wind_direction.directions[heading]
+
+
+def test_decoding_a_sequence():
+    decoder = DirectionDecoder(wind_direction.volts, max_code=MAX_CODE)
+    codes = [0, 500, 2000, 4095]
+    assert decoder.decode_angles(codes) == [decoder.angle(code) for code in codes]
+    assert list(decoder.decode_indexes(codes)) == [decoder.index(code) for code in codes]
+
+
+@pytest.mark.parametrize(
+    "angle, direction",
+    [(0.0, "N"), (11.0, "N"), (12.0, "NNE"), (180.0, "S"), (340.0, "NNW"), (355.0, "NNW")],
+)
+def test_direction_strings(angle, direction):
+    assert wind_direction.get_direction_as_string(angle) == direction
@@ -0,0 +1,445 @@
+# Time-lapse
+#
+# A command line tool that turns the sky images taken by the weather station
+# into a contact sheet of thumbnails for every day and a sequence of resized
+# time-lapse frames, and measures the brightness, colour and cloud cover of
+# every image.
+#
+# The images are spread across a pool of processes. Each worker opens an
+# image, decodes it at a reduced size (JPEG draft mode), and writes its
+# thumbnail and frame, so only the statistics are sent back. The days are
+# processed in order and only a limited number of images are queued at once,
+# so a year of images can be processed with the same memory as a day.
+#
+# Every processed image is listed in a manifest for its day (with its
+# statistics), and images already in the manifest are skipped when the tool is
+# run again, so it can be run periodically to process only the new images.
+# The output directory holds:
+#
+#   manifest/YYYY-MM-DD.jsonl   The processed images and their statistics
+#   stats/YYYY-MM-DD.csv        The same statistics as a .csv file
+#   thumbnails/YYYY-MM-DD/      A thumbnail of every image
+#   frames/YYYY-MM-DD/          A time-lapse frame of every image
+#   sheets/YYYY-MM-DD.jpeg      The contact sheet of the day's thumbnails
+#
+# A day's frames can be made into a video with ffmpeg:
+#   ffmpeg -framerate 12 -pattern_type glob -i 'frames/2021-08-01/*.jpeg' \
+#       -c:v libx264 -pix_fmt yuv420p 2021-08-01.mp4
+#
+# Examples:
+#
+# Process all of the images:
+#   python3 timelapse.py /mnt/usb1/weather_images --output /mnt/usb1/timelapse
+#
+# Only August, without the time-lapse frames:
+#   python3 timelapse.py /mnt/usb1/weather_images --output /mnt/usb1/timelapse \
+#       --start 2021-08-01 --end 2021-09-01 --no-frames
+#
+# Daniel Hornberger
+# 2021
+
+import argparse
+import collections
+import csv
+import datetime
+import json
+import multiprocessing
+import os
+import threading
+import time
+
+from PIL import Image
+from PIL import ImageDraw
+from PIL import ImageStat
+
+import query
+from image_store import IMAGE_EXTENSIONS
+from image_store import NAME_TIME_FORMAT
+
+DAY_FORMAT = "%Y-%m-%d"
+
+# The statistics measured for every image
+STATISTICS = ["brightness", "red", "green", "blue", "cloud_cover"]
+
+# A pixel is counted as cloud when its red to blue ratio is above this. Clear
+# sky scatters much more blue than red while clouds are close to white.
+CLOUD_RATIO = 0.8
+
+# The statistics are measured on an image of about this size
+STATISTICS_SIZE = (64, 64)
+
+# The number of images queued for each worker process
+QUEUED_PER_PROCESS = 16
+
+
+def image_time(name):
+    """
+    Returns the time an image was taken from its name, or None if the name
+    isn't a time.
+    """
+    stem = os.path.splitext(os.path.basename(name))[0]
+    try:
+        return datetime.datetime.strptime(stem, NAME_TIME_FORMAT)
+    except ValueError:
+        return None
+
+
+def images_by_day(directory, start=None, end=None):
+    """
+    Yields each day between the datetimes start and end with a sorted list of
+    the names (relative to the directory) of its images. The images are in a
+    directory per day, or directly in the directory for older stations.
+    """
+    days = collections.defaultdict(list)
+    for entry in os.scandir(directory):
+        if entry.is_dir():
+            try:
+                datetime.datetime.strptime(entry.name, DAY_FORMAT)
+            except ValueError:
+                continue
+            # The day's images are only listed when its turn comes
+            days[entry.name]
+        elif entry.name.lower().endswith(IMAGE_EXTENSIONS):
+            taken = image_time(entry.name)
+            if taken is not None:
+                days[taken.strftime(DAY_FORMAT)].append(entry.name)
+
+    for day in sorted(days):
+        day_start = datetime.datetime.strptime(day, DAY_FORMAT)
+        if start is not None and day_start + datetime.timedelta(days=1) <= start:
+            continue
+        if end is not None and day_start >= end:
+            continue
+
+        names = list(days.pop(day))
+        day_directory = os.path.join(directory, day)
+        if os.path.isdir(day_directory):
+            names.extend(
+                f"{day}/{name}"
+                for name in os.listdir(day_directory)
+                if name.lower().endswith(IMAGE_EXTENSIONS)
+            )
+
+        images = []
+        for name in names:
+            taken = image_time(name)
+            if taken is None:
+                continue
+            if (start is None or taken >= start) and (end is None or taken < end):
+                images.append((taken, name))
+        if images:
+            yield day, [name for taken, name in sorted(images)]
+
+
+###############################################################################
+# Image Processing
+###############################################################################
+
+
+def measure(image):
+    """
+    Returns a dictionary of the brightness, average colour and cloud cover
+    (the fraction of the pixels that look like cloud) of an RGB image.
+    """
+    small = image.resize(STATISTICS_SIZE)
+    red, green, blue = ImageStat.Stat(small).mean
+    brightness = ImageStat.Stat(small.convert("L")).mean[0]
+
+    cloud = 0
+    pixels = small.tobytes()
+    for r, b in zip(pixels[0::3], pixels[2::3]):
+        if r > CLOUD_RATIO * max(b, 1):
+            cloud += 1
+
+    return {
+        "brightness": round(brightness, 2),
+        "red": round(red, 2),
+        "green": round(green, 2),
+        "blue": round(blue, 2),
+        "cloud_cover": round(cloud / (len(pixels) // 3), 4),
+    }
+
+
+def _process(job):
+    """
+    Writes the thumbnail and time-lapse frame of an image and returns its
+    manifest entry. This runs in the worker processes.
+    """
+    name, path, thumbnail_path, frame_path, thumbnail_size, frame_size, statistics = job
+    entry = {"name": name}
+    try:
+        image = Image.open(path)
+        # Decode the image at the smallest size that is needed
+        size = frame_size if frame_path else thumbnail_size
+        image.draft("RGB", (size, size))
+        image = image.convert("RGB")
+
+        if frame_path:
+            frame = image.copy()
+            frame.thumbnail((frame_size, frame_size))
+            frame.save(frame_path, quality=90)
+
+        image.thumbnail((thumbnail_size, thumbnail_size))
+        image.save(thumbnail_path, quality=85)
+
+        if statistics:
+            entry.update(measure(image))
+    except Exception as e:
+        # Images can be left incomplete by a power loss
+        entry["error"] = str(e)
+    return entry
+
+
+def _read_manifest(path):
+    entries = {}
+    if os.path.exists(path):
+        with open(path) as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                entries[entry["name"]] = entry
+    return entries
+
+
+def contact_sheet(thumbnails, path, columns=8, size=256):
+    """
+    Writes a contact sheet of the (label, thumbnail path) pairs given in
+    order, with the label drawn on each thumbnail.
+    """
+    rows = (len(thumbnails) + columns - 1) // columns
+    sheet = Image.new("RGB", (columns * size, rows * size))
+    draw = ImageDraw.Draw(sheet)
+    for index, (label, thumbnail_path) in enumerate(thumbnails):
+        x = (index % columns) * size
+        y = (index // columns) * size
+        try:
+            with Image.open(thumbnail_path) as thumbnail:
+                sheet.paste(thumbnail, (x, y))
+        except OSError:
+            continue
+        draw.text((x + 4, y + 4), label, fill=(255, 255, 0))
+    sheet.save(path + ".tmp.jpeg", quality=85)
+    os.replace(path + ".tmp.jpeg", path)
+
+
+###############################################################################
+# Processing the Days
+###############################################################################
+
+
+class Day:
+    """
+    The images of a day and the results of processing them.
+    """
+
+    def __init__(self, name, images, manifest, pending):
+        self.name = name
+        self.images = images
+        self.manifest = manifest
+        self.pending = pending
+        self.started = time.monotonic()
+        self.processed = 0
+
+
+class TimeLapse:
+    """
+    Processes the images in image_directory into output_directory.
+    """
+
+    def __init__(
+        self,
+        image_directory,
+        output_directory,
+        thumbnail_size=256,
+        frame_size=1024,
+        frames=True,
+        statistics=True,
+        columns=8,
+        processes=None,
+        force=False,
+    ):
+        self.image_directory = image_directory
+        self.output_directory = output_directory
+        self.thumbnail_size = thumbnail_size
+        self.frame_size = frame_size
+        self.frames = frames
+        self.statistics = statistics
+        self.columns = columns
+        self.processes = processes or os.cpu_count() or 1
+        self.force = force
+        self.images_processed = 0
+        self.errors = 0
+
+        for subdirectory in ["manifest", "stats", "thumbnails", "frames", "sheets"]:
+            os.makedirs(os.path.join(output_directory, subdirectory), exist_ok=True)
+
+    def _path(self, subdirectory, day, name=None):
+        if name is None:
+            return os.path.join(self.output_directory, subdirectory, day)
+        stem = os.path.splitext(os.path.basename(name))[0]
+        return os.path.join(self.output_directory, subdirectory, day, stem + ".jpeg")
+
+    def _jobs(self, days, start, end, queued):
+        """
+        Yields a job for every image that hasn't been processed. The days are
+        added to the days queue before their jobs, and no more than the
+        queued semaphore allows are waiting to be processed at once.
+        """
+        for day, images in images_by_day(self.image_directory, start, end):
+            manifest_path = self._path("manifest", day) + ".jsonl"
+            if self.force and os.path.exists(manifest_path):
+                os.remove(manifest_path)
+            manifest = _read_manifest(manifest_path)
+            pending = [name for name in images if name not in manifest]
+            sheet = self._path("sheets", day) + ".jpeg"
+            if not pending and os.path.exists(sheet):
+                continue
+
+            os.makedirs(self._path("thumbnails", day), exist_ok=True)
+            if self.frames:
+                os.makedirs(self._path("frames", day), exist_ok=True)
+            days.append(Day(day, images, manifest, len(pending)))
+
+            for name in pending:
+                queued.acquire()
+                yield (
+                    name,
+                    os.path.join(self.image_directory, *name.split("/")),
+                    self._path("thumbnails", day, name),
+                    self._path("frames", day, name) if self.frames else None,
+                    self.thumbnail_size,
+                    self.frame_size,
+                    self.statistics,
+                )
+
+    def _finish(self, day, manifest_file):
+        """
+        Writes the contact sheet and statistics of a day once all of its
+        images are processed.
+        """
+        manifest_file.close()
+        thumbnails = []
+        rows = []
+        for name in day.images:
+            entry = day.manifest.get(name)
+            if entry is None or "error" in entry:
+                continue
+            thumbnails.append(
+                (
+                    image_time(name).strftime("%H:%M"),
+                    self._path("thumbnails", day.name, name),
+                )
+            )
+            rows.append([image_time(name)] + [entry.get(s, "") for s in STATISTICS])
+
+        if thumbnails:
+            contact_sheet(
+                thumbnails,
+                self._path("sheets", day.name) + ".jpeg",
+                self.columns,
+                self.thumbnail_size,
+            )
+        if self.statistics:
+            with open(self._path("stats", day.name) + ".csv", "w", newline="") as file:
+                writer = csv.writer(file)
+                writer.writerow(["Time"] + STATISTICS)
+                writer.writerows(rows)
+
+        elapsed = time.monotonic() - day.started
+        rate = day.processed / elapsed if elapsed > 0 else 0.0
+        print(
+            f"{day.name}: processed {day.processed} of {len(day.images)} images "
+            f"in {elapsed:.1f} s ({rate:.1f} images/s)"
+        )
+
+    def run(self, start=None, end=None):
+        """
+        Processes the images taken between the datetimes start and end.
+        Returns the number of images processed per second.
+        """
+        started = time.monotonic()
+        days = collections.deque()
+        queued = threading.Semaphore(self.processes * QUEUED_PER_PROCESS)
+        jobs = self._jobs(days, start, end, queued)
+
+        day = None
+        manifest_file = None
+        with multiprocessing.Pool(self.processes) as pool:
+            # The results arrive in the order of the jobs, so they belong to
+            # the oldest day that still has images pending
+            for entry in pool.imap(_process, jobs, chunksize=4):
+                queued.release()
+                while day is None or day.processed == day.pending:
+                    if day is not None:
+                        self._finish(day, manifest_file)
+                    day = days.popleft()
+                    manifest_file = open(
+                        self._path("manifest", day.name) + ".jsonl", "a"
+                    )
+
+                if "error" in entry:
+                    self.errors += 1
+                    print(f"ERROR: Could not process {entry['name']}: {entry['error']}")
+                day.manifest[entry["name"]] = entry
+                manifest_file.write(json.dumps(entry) + "\n")
+                day.processed += 1
+                self.images_processed += 1
+
+        # Finish the last day and any days that only needed a contact sheet
+        if day is not None:
+            self._finish(day, manifest_file)
+        while days:
+            day = days.popleft()
+            self._finish(day, open(self._path("manifest", day.name) + ".jsonl", "a"))
+
+        elapsed = time.monotonic() - started
+        rate = self.images_processed / elapsed if elapsed > 0 else 0.0
+        print(
+            f"Processed {self.images_processed} images in {elapsed:.1f} s "
+            f"({rate:.1f} images/s with {self.processes} processes, {self.errors} errors)"
+        )
+        return rate
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Make contact sheets and time-lapse frames from the sky images"
+    )
+    parser.add_argument("directory", help="The directory holding the images")
+    parser.add_argument("--output", required=True, help="Where the results are written")
+    parser.add_argument("--start", type=query.parse_time, help="e.g. 2021-08-01")
+    parser.add_argument("--end", type=query.parse_time, help="e.g. 2021-09-01")
+    parser.add_argument("--thumbnail-size", type=int, default=256, help="In pixels")
+    parser.add_argument("--frame-size", type=int, default=1024, help="In pixels")
+    parser.add_argument("--columns", type=int, default=8, help="Contact sheet columns")
+    parser.add_argument(
+        "--no-frames", action="store_true", help="Don't write the time-lapse frames"
+    )
+    parser.add_argument(
+        "--no-statistics",
+        action="store_true",
+        help="Don't measure the brightness, colour and cloud cover",
+    )
+    parser.add_argument("--processes", type=int, help="Number of worker processes")
+    parser.add_argument(
+        "--force", action="store_true", help="Process images already in the manifest"
+    )
+    args = parser.parse_args(argv)
+
+    TimeLapse(
+        args.directory,
+        args.output,
+        args.thumbnail_size,
+        args.frame_size,
+        not args.no_frames,
+        not args.no_statistics,
+        args.columns,
+        args.processes,
+        args.force,
+    ).run(args.start, args.end)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+# Timestamp Ring
+#
+# A fixed size ring buffer of timestamps backed by a preallocated array of
+# doubles. It is used to store the times of switch closures from the sensors.
+#
+# Adding a timestamp is O(1) and doesn't allocate any memory, so it can be
+# called from the gpiozero callback thread at a high rate. There is a single
+# writer and the readers never modify the buffer, so no lock is needed: a
+# reader takes a snapshot of the count and only looks at entries before it.
+# The timestamps are expected to be added in increasing order, which allows
+# the entries within a time range to be found with a binary search.
+#
+# The timestamps can also be kept in a buffer provided by the caller, such as
+# a memory mapped file, so they survive a restart.
+#
+# Daniel Hornberger
+# 2021
+
+from array import array
+
+
+class TimestampRing:
+    """
+    Holds the most recent capacity timestamps. The capacity is rounded up to
+    a power of two. If a buffer (a writable memoryview of capacity doubles)
+    is given, the timestamps are kept in it and count is the number of
+    timestamps already in it.
+    """
+
+    def __init__(self, capacity=131072, buffer=None, count=0):
+        size = 1
+        while size < capacity:
+            size *= 2
+
+        self.capacity = size
+        self._mask = size - 1
+        if buffer is not None:
+            if len(buffer) != size:
+                raise ValueError(f"The buffer must hold {size} timestamps")
+            self._times = buffer
+        else:
+            self._times = array("d", bytes(8 * size))
+        # The total number of timestamps ever added
+        self.count = count
+
+    def push(self, timestamp):
+        """
+        Adds a timestamp, overwriting the oldest one if the buffer is full.
+        """
+        self._times[self.count & self._mask] = timestamp
+        self.count += 1
+
+    def _first_index(self):
+        return max(self.count - self.capacity, 0)
+
+    def _search(self, timestamp, low, high):
+        """
+        Returns the index of the first timestamp at or after timestamp
+        between the indexes low and high.
+        """
+        times = self._times
+        mask = self._mask
+        while low < high:
+            middle = (low + high) // 2
+            if times[middle & mask] < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def count_between(self, start, end):
+        """
+        Returns the number of timestamps t where start <= t < end.
+        """
+        high = self.count
+        low = self._first_index()
+        return self._search(end, low, high) - self._search(start, low, high)
+
+    def between(self, start, end):
+        """
+        Returns an array of the timestamps t where start <= t < end in order.
+        """
+        high = self.count
+        low = self._first_index()
+        first = self._search(start, low, high)
+        last = self._search(end, low, high)
+
+        first_slot = first & self._mask
+        last_slot = last & self._mask
+        if last - first == 0:
+            return array("d")
+        if first_slot < last_slot:
+            return self._slice(first_slot, last_slot)
+        return self._slice(first_slot, self.capacity) + self._slice(0, last_slot)
+
+    def _slice(self, start, end):
+        times = self._times[start:end]
+        return times if isinstance(times, array) else array("d", times)
+
+    def latest(self):
+        """
+        Returns the most recent timestamp or None if there aren't any.
+        """
+        count = self.count
+        if count == 0:
+            return None
+        return self._times[(count - 1) & self._mask]
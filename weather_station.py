@@ -2,441 +2,849 @@
 #
 # A basic weather data logging station controlled by a Raspberry Pi.
 #
+# The settings are read from weather_station.ini (see config.py). The station
+# starts in phases that are timed and logged. The anemometer and rain gauge
+# are listening before anything else is set up, and the camera and database
+# are started in the background (see startup.py), so the station is sampling
+# within a fraction of a second and keeps logging if either of them fails.
+#
 # Written by Daniel Hornberger
 
 
-from gpiozero import Button
+import argparse
 import bme280_sensor
 import camera
+import config
 import datetime
-from influxdb import InfluxDBClient
+from image_store import ImageStore
+from influx_writer import InfluxWriter
+import journal
+from live_api import LiveServer
 import logger as logging
-import math
+import metrics
 import os
-from pathlib import Path
-from picamera import PiCamera
-import shutil
-import statistics
-import subprocess
-import sys
-import time
+from anemometer import WindEngine
+from circular_stats import DirectionAccumulator
+from columnar_store import ColumnarWriter
+from derived import DerivedEngine
+from profiler import Profiler
+from rollup import RollupEngine
+from rain_gauge import RainEngine
+from scheduler import Scheduler
+import sensor_backend
+from startup import StartupTimer
+from startup import Subsystem
 import traceback
 import wind_direction
 
 
-# How often the sensor readings should be logged
-LOG_INTERVAL = 900  # 15 Minutes in seconds
-#LOG_INTERVAL = 10  # 15 Minutes in seconds
-
-# How often readings should be taken to form the average that will be logged
-ACCUMULATION_INTERVAL = 10  # 10 seconds
-#ACCUMULATION_INTERVAL = 5  # 10 seconds
-#ACCUMULATION_INTERVAL = 2  # 10 seconds
-
-# Enable or disable the photos from being taken.
-# If enabled, more disk space will be used.
-PHOTOS_ENABLED = True
-
-# When the disk has less than this amount of free storage in bytes,
-# images will cease to be captured.
-IMAGE_DISK_USAGE_THRESHOLD = 1000000000 # 1 GB
-
-# When an image has an average grayscale brightness less than this value,
-# images will not be saved to the disk. This is so images won't be taken
-# during the night.
-# TODO: This value may need further tuning after deployment and further testing
-BRIGHTNESS_THRESHOLD = 10
+BACKUP_WARNING = (
+    "WARNING: The data is not being backed up. Ensure an external storage "
+    "device is connected and restart the system."
+)
 
-# Issues occur unless only a single camera object is used for the duration of
-# the program.
-camera_obj = PiCamera()
-camera_obj.resolution = (1024, 1024)
-camera_obj.brightness = 50
-camera_obj.rotation = 90 
+# The stages of the sampling loop that are timed in the metrics. The metrics
+# are served at /metrics by the live API and summarized in the log after every
+# record. See metrics.py.
+RAIN_FLUSH = metrics.stage("rain_flush")
+WIND_DIRECTION_READ = metrics.stage("wind_direction_read")
+WIND_SPEED = metrics.stage("wind_speed")
+LIVE_PUBLISH = metrics.stage("live_publish")
+WIND_STATISTICS = metrics.stage("wind_statistics")
+CAMERA_WAIT = metrics.stage("camera_wait")
+RAIN_STATISTICS = metrics.stage("rain_statistics")
+DERIVED = metrics.stage("derived")
+CSV_APPEND = metrics.stage("csv_append")
+COLUMNAR_APPEND = metrics.stage("columnar_append")
+ROLLUPS = metrics.stage("rollups")
+RECORDS = metrics.counter("records", "Records logged")
 
 ###############################################################################
-# InfluxDB Database Setup
+# Command Line
 ###############################################################################
 
-# Create the client connection
-host = "localhost"
-port = 8086
-client = InfluxDBClient(host=host, port=port)
 
-# Connect to the 'weather' database. This must already exist for this to work.
-# Using the create_database() function with it already existing will cause this
-# script to crash.
-dbname = "weather"
-client.switch_database(dbname)
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Weather station data logger")
+    parser.add_argument(
+        "--config",
+        metavar="FILE",
+        help="Read the settings from FILE instead of weather_station.ini",
+    )
+    parser.add_argument(
+        "--record",
+        metavar="FILE",
+        help="Record the raw sensor readings to FILE so they can be replayed later",
+    )
+    parser.add_argument(
+        "--replay",
+        metavar="FILE",
+        help="Replay the sensor readings recorded in FILE instead of using the hardware",
+    )
+    parser.add_argument(
+        "--speed",
+        type=float,
+        default=1000.0,
+        help="How many times faster than real time to replay (0 is as fast as possible)",
+    )
+    parser.add_argument(
+        "--data-directory",
+        metavar="DIR",
+        help="Write the data, images and logs to DIR instead of the default locations",
+    )
+    parser.add_argument(
+        "--debug",
+        action="store_true",
+        help="Also log the messages for every individual sensor reading",
+    )
+    return parser.parse_args(argv)
+
 
 ###############################################################################
-# Anemometer
+# Storage Locations
 ###############################################################################
 
-CM_IN_A_MILE = 160934.4
-SECS_IN_AN_HOUR = 3600
-# Calibration factor used to report the correct wind speed
-WIND_CALIBRATION = 2.3589722140805094
-RADIUS_CM = 9.0  # Radius of the anemometer
 
-wind_speed_sensor = Button(5)  # BCM 5
-wind_count = 0  # Number of half rotations for calculating wind speed
-store_speeds = []  # Store speeds in order to record wind gusts
-store_directions = []  # Store directions to calculate the avg direction
+def device_mounted(device):
+    """
+    Returns True if the storage device is mounted. Reading the mount table is
+    much faster than running df.
+    """
+    try:
+        with open("/proc/mounts") as file:
+            return any(line.split()[:1] == [device] for line in file)
+    except OSError:
+        return False
+
+
+def storage_locations(paths, data_directory, time_name):
+    """
+    Returns the data file, image directory and log file to use, and whether
+    they're on the external storage device.
+    """
+    data_directory = data_directory or paths.data_directory
+
+    # Write the data to the directory specified on the command line or in
+    # the settings
+    if data_directory:
+        return (
+            os.path.join(data_directory, time_name + ".csv"),
+            os.path.join(data_directory, "weather_images"),
+            os.path.join(data_directory, "logs", time_name + ".log"),
+            False,
+        )
+
+    # If an external USB storage device is connected, write the data to it
+    if device_mounted(paths.external_device):
+        return (
+            os.path.join(paths.external_directory, time_name + ".csv"),
+            os.path.join(paths.external_directory, "weather_images"),
+            os.path.join(paths.external_directory, time_name + ".log"),
+            True,
+        )
 
+    # If an external USB storage device isn't connected, write to the repo
+    # directory
+    return (
+        os.path.join(paths.internal_directory, time_name + ".csv"),
+        os.path.join(paths.internal_directory, "weather_images"),
+        os.path.join(paths.internal_log_directory, time_name + ".log"),
+        False,
+    )
 
-def reset_wind():
-    global wind_count
-    wind_count = 0
 
+###############################################################################
+# Subsystems
+###############################################################################
 
-def spin():
-    global wind_count
-    wind_count = wind_count + 1
 
+def start_camera(backend, settings, image_directory):
+    """
+    Sets up the camera and the image store and returns a CameraWorker that
+    takes the pictures on a background thread.
+    """
+    # Note that a trailing slash is required for it to create the last
+    # directory specified in the path
+    os.makedirs(os.path.dirname(image_directory + "/"), exist_ok=True)
 
-def calculate_speed(time_sec):
-    logging.log("Calculating the wind speed")
-    global wind_count
-    circumference_cm = (2 * math.pi) * RADIUS_CM
-    rotations = wind_count / 2.0
+    store = ImageStore(
+        image_directory, settings.storage_budget, settings.min_free_space
+    )
 
-    # Calculate the distance travelled by a cup in cm
-    dist_mile = (circumference_cm * rotations) / CM_IN_A_MILE
+    # Issues occur unless only a single camera object is used for the
+    # duration of the program.
+    camera_obj = backend.camera()
+    camera_obj.resolution = (settings.width, settings.height)
+    camera_obj.brightness = settings.brightness
+    camera_obj.rotation = settings.rotation
 
-    # Report the wind speed in miles per hour
-    miles_per_sec = dist_mile / time_sec
-    miles_per_hour = miles_per_sec * SECS_IN_AN_HOUR
+    return camera.CameraWorker(camera_obj, store, backend.now)
 
-    # Clear the wind count so it will be ready for the next reading
-    reset_wind()
 
-    # The anemometer data sheet indicates that if the switch closes once per
-    # second, a wind speed of 1.492 MPH should be reported
-    # Multiply by the calibration factor to be accurate according to the
-    # data sheet
-    return miles_per_hour * WIND_CALIBRATION
+def start_live_api(settings):
+    """
+    Returns a started LiveServer that serves the current conditions over HTTP.
+    See live_api.py.
+    """
+    server = LiveServer(settings.host, settings.port, settings.capacity)
+    server.start()
+    return server
 
 
-# Call the spin function every half rotation
-wind_speed_sensor.when_pressed = spin
+def start_writer(url, database, queue_directory, station=None, name="database"):
+    """
+    Returns a started InfluxWriter. The points are written through a queue on
+    the disk by a background thread so they aren't lost if the database (or
+    the ingest server if the station is given) can't be reached. See
+    influx_writer.py.
+    """
+    writer = InfluxWriter(queue_directory, url, database, station=station, name=name)
+    writer.start()
+    return writer
 
 
 ###############################################################################
-# Rain Gauge
+# Main Program
 ###############################################################################
 
-BUCKET_SIZE = 0.011  # Inches per bucket tip
-
-rain_sensor = Button(6)
-rain_count = 0
-precipitation = 0.0
 
+def main(argv=None):
+    timer = StartupTimer()
 
-def bucket_tipped():
-    logging.log("Detected a rainfall bucket tip")
-    global rain_count
-    global precipitation
-    rain_count = rain_count + 1
-    precipitation = round(rain_count * BUCKET_SIZE, 4)
+    with timer.phase("settings"):
+        args = parse_args(argv)
+        settings = config.load(args.config)
+        intervals = settings.intervals
+        camera_settings = settings.camera
+        calibration = settings.calibration
 
+    with timer.phase("sensor backend"):
+        backend = sensor_backend.initialize_backend(
+            args.record, args.replay, args.speed
+        )
 
-def reset_rainfall():
-    logging.log("Resetting the accumulated rainfall")
-    global rain_count
-    global precipitation
-    rain_count = 0
-    precipitation = 0.0
-
+    ###########################################################################
+    # Anemometer
+    ###########################################################################
+
+    # The anemometer is listened to first so no wind is missed while the rest
+    # of the station starts
+    with timer.phase("anemometer"):
+        # The times of the anemometer's switch closures are stored so the
+        # average speed, gust and lull can be calculated over any window
+        wind = WindEngine(
+            radius_cm=calibration.anemometer_radius_cm,
+            calibration=calibration.wind_calibration,
+        )
 
-rain_sensor.when_pressed = bucket_tipped
+        def spin():
+            wind.pulse(backend.monotonic())
 
+        # Call the spin function every half rotation
+        backend.on_edge(settings.pins.wind_speed, spin)
+        metrics.counter(
+            "anemometer_pulses",
+            "Anemometer switch closures",
+            function=lambda: wind.pulses.count,
+        )
 
-###############################################################################
-# Main Program Loop
-###############################################################################
+    # Running sums of the directions to calculate the avg direction
+    direction_stats = DirectionAccumulator()
 
-# The data file will be named by the current date and time
-time_name = datetime.datetime.now().strftime("%m-%d-%Y--%H-%M-%S")
-data_file = ""
-image_directory = ""
-log_file = ""
-backup_file = ""
-external_storage_connected = False
-disk_space_ok = True
-previous_day = datetime.datetime.now()
-previous_month = datetime.datetime.now()
-
-# Check if an external USB storage device is connected
-check_external_drive = subprocess.Popen(
-    "df -h | grep /dev/sda1",
-    shell=True,
-    stdout=subprocess.PIPE,
-    stderr=subprocess.STDOUT,
-)
-stdout, stderr = check_external_drive.communicate()
-
-
-# If an external USB storage device is connected, write the data to it
-if len(stdout) > 0:
-    external_storage_connected = True
-    data_file = "/mnt/usb1/" + time_name + ".csv"
-    # For some reason, python can't create a subdirectory in the mounted device
-    # TODO: Find out if this works
-    image_directory = "/mnt/usb1/weather_images" 
-    log_file = "/mnt/usb1/" + time_name + ".log"
-
-    # Database location
-    database_src = "/var/lib/influxdb/data/" + dbname
-    database_dest = "/mnt/usb1/"
-# If an external USB storage device isn't connected, write to the repo directory
-else:
-    data_file = (
-        "/home/pi/WeatherStation" + "/" + "data" + "/" + time_name + ".csv"
+    # The humidity, pressure, and temperature are sampled every
+    # bme280_sample_ticks accumulation ticks and averaged over the log
+    # interval
+    bme280_sampler = bme280_sensor.BME280Sampler(
+        calibration.bme280_oversampling,
+        calibration.pressure_offset,
+        calibration.fahrenheit,
     )
-    image_directory = "/home/pi/WeatherStation/data/weather_images"
-    log_file = f"/home/pi/WeatherStation/logs/{time_name}.log"
-
-# Since the PiCamera module seems to not be able to write directly
-# to the USB device, they will first be written here, and then copied
-# to the drive later.
-temp_image_directory = "/home/pi/WeatherStation/data/weather_images"
 
-backup_file = data_file + ".bak"
+    # The dew point, heat index, wind chill, feels like temperature, pressure
+    # tendency and sea level pressure of each record
+    derived_engine = DerivedEngine(
+        calibration.fahrenheit, calibration.elevation, calibration.pressure_offset
+    )
+    derived_labels = derived_engine.labels()
 
-# Setup the logger. This will create the log_file directory if not already there.
-logging.initialize_logger(log_file)
+    ###########################################################################
+    # Storage
+    ###########################################################################
 
-if not external_storage_connected:
-    print(
-        "WARNING: The data is not being backed up. Ensure an external storage device is connected and restart the system."
-    )
-    logging.log(
-        "WARNING: The data is not being backed up. Ensure an external storage device is connected and restart the system."
-    )
+    with timer.phase("storage"):
+        # The data file will be named by the current date and time
+        time_name = backend.now().strftime("%m-%d-%Y--%H-%M-%S")
+        data_file, image_directory, log_file, external_storage_connected = (
+            storage_locations(settings.paths, args.data_directory, time_name)
+        )
+        data_directory = os.path.dirname(data_file)
 
-print("The weather station has been started")
-logging.log("The weather station has been started")
-logging.log(f"Readings will be accumulated every {ACCUMULATION_INTERVAL} seconds")
-logging.log(f"The data will be written every {LOG_INTERVAL} seconds")
-logging.log(f"The data file is located here: {data_file}")
-
-try:
-    # Create the data directory if it doesn't already exist
-    if not os.path.exists(os.path.dirname(data_file)):
-        try:
-            os.makedirs(os.path.dirname(data_file))
-        except OSError as e:
-            if e.errno != errno.EEXIST:
-                raise
-
-    # Create the image directory if it doesn't already exist
-    # This needs to be created after the data directory since
-    # if the USB drive isn't connected, this directory resides
-    # inside the data directory
-    try:
-        # Note that a trailing slash is required for it to create the last
-        # directory specified in the path
-        os.makedirs(os.path.dirname(image_directory + "/"), exist_ok=True)
-    except OSError as e:
-        print(f"ERROR: Could not create {image_directory}")
-        logging.log(f"ERROR: Could not create {image_directory}")
-        print(str(e))
-        raise
-
-    with open(data_file, "w") as file:
-        # Write the labels row
-        file.write(
-            "Record Number,"
-            "Time,"
-            "Temperature (F),"
-            "Pressure (mbars),"
-            "Relative Humidity (%),"
-            "Wind Direction (Degrees),"
-            "Wind Direction (String),"
-            "Wind Speed (MPH),"
-            "Wind Gust (MPH),"
-            "Precipitation (Inches),"
-            "Image\n"
+        # Setup the logger. This will create the log_file directory if not
+        # already there. The messages logged before this are kept and
+        # written once it's set up.
+        logging.initialize_logger(
+            log_file, logging.DEBUG if args.debug else logging.INFO
         )
 
-    record_number = 1
+        # Create the data directory if it doesn't already exist
+        os.makedirs(data_directory, exist_ok=True)
 
-    ## Database fields
-    # The name of the "table" (even though it's not) for the database records
-    measurement = "weather"
-    location = "backyard"
+    ###########################################################################
+    # Rain Gauge
+    ###########################################################################
 
-    ###############################################################################
-    # The main program loop
-    ###############################################################################
-    while True:
-        start_time = time.time()
+    # The bucket tips are kept in a file so the day's rainfall survives a
+    # restart
+    with timer.phase("rain gauge"):
+        rain = RainEngine(
+            os.path.join(data_directory, "rain_tips.bin"),
+            calibration.rain_bucket_size,
+        )
 
-        store_directions = []
-        store_speeds = []
+        def bucket_tipped():
+            rain.tip(backend.time())
 
-        # Accumulate wind direction and wind speeds every ACCUMULATION_INTERVAL
-        # seconds, and log the averages every LOG_INTERVAL
-        logging.log("Accumulating the sensor readings")
-        while time.time() - start_time <= LOG_INTERVAL:
+        backend.on_edge(settings.pins.rain, bucket_tipped)
+        metrics.counter(
+            "rain_tips", "Rain gauge bucket tips", function=lambda: rain.tips.count
+        )
+        metrics.counter(
+            "rain_bounces",
+            "Rain gauge switch bounces that were ignored",
+            function=lambda: rain.bounces,
+        )
 
-            store_directions.append(wind_direction.get_current_angle())
-            store_speeds.append(calculate_speed(ACCUMULATION_INTERVAL))
+    ###########################################################################
+    # Profiler
+    ###########################################################################
+
+    # Profiling can be switched on while the station is running to see where
+    # the time goes. Nothing is sampled until then.
+    profiler = None
+    if settings.profiler.enabled:
+        profiler = Profiler(
+            os.path.join(data_directory, "profiles"),
+            settings.profiler.rate,
+            settings.profiler.max_duration,
+            settings.profiler.max_file_size,
+            settings.profiler.max_files,
+            os.path.join(data_directory, settings.profiler.control_file)
+            if settings.profiler.control_file
+            else None,
+        )
+        if not profiler.install():
+            logging.log("The profiler can only be switched on by its control file")
+
+    ###########################################################################
+    # Camera and Database
+    ###########################################################################
+
+    # These are started in the background since the camera can take seconds
+    # to start, and either of them failing shouldn't stop the readings from
+    # being logged. They're started again later if they fail.
+    camera_subsystem = Subsystem(
+        "camera",
+        lambda: start_camera(backend, camera_settings, image_directory),
+        timer,
+        settings.startup.retry_interval,
+    )
+    if camera_settings.enabled:
+        camera_subsystem.start()
+
+    # Points waiting to be written to the database are kept next to the data
+    database = Subsystem(
+        "database",
+        lambda: start_writer(
+            settings.database.url,
+            settings.database.name,
+            os.path.join(data_directory, "influx_queue"),
+        ),
+        timer,
+        settings.startup.retry_interval,
+    )
+    database.start()
+
+    # The records are also published to the ingest server if there is one,
+    # through their own queue so they're kept until the server has them
+    publisher = None
+    if settings.ingest.url:
+        publisher = Subsystem(
+            "ingest publisher",
+            lambda: start_writer(
+                settings.ingest.url,
+                settings.database.name,
+                os.path.join(data_directory, "ingest_queue"),
+                settings.ingest.station or settings.database.location,
+                "ingest",
+            ),
+            timer,
+            settings.startup.retry_interval,
+        )
+        publisher.start()
+
+    # The current conditions are served from memory for anything that wants
+    # them sooner than the records are logged
+    live = None
+    if settings.live.enabled:
+        live = Subsystem(
+            "live api",
+            lambda: start_live_api(settings.live),
+            timer,
+            settings.startup.retry_interval,
+        )
+        live.start()
+
+    if args.replay:
+        # The replayed clock runs far faster than the subsystems start, so
+        # wait for them to keep replays repeatable
+        with timer.phase("waiting for the camera and database"):
+            if camera_settings.enabled:
+                camera_subsystem.wait()
+            database.wait()
+            if publisher is not None:
+                publisher.wait()
+
+    if not external_storage_connected:
+        print(BACKUP_WARNING)
+        logging.log(BACKUP_WARNING)
+
+    print("The weather station has been started")
+    logging.log("The weather station has been started")
+    logging.log(
+        f"Readings will be accumulated every {intervals.accumulation_interval} seconds"
+    )
+    logging.log(f"The data will be written every {intervals.log_interval} seconds")
+    logging.log(f"The data file is located here: {data_file}")
+
+    def shut_down(reason):
+        """
+        Saves the rain gauge's tips, sends the points still waiting in the
+        writers and stops the subsystems.
+        """
+        rain.flush()
+        if profiler is not None:
+            profiler.stop(reason)
+        database.stop(lambda writer: writer.stop())
+        if publisher is not None:
+            publisher.stop(lambda writer: writer.stop())
+        if live is not None:
+            live.stop(lambda server: server.stop())
+        camera_subsystem.stop(lambda camera_worker: camera_worker.stop())
+        backend.close()
 
-            time.sleep(ACCUMULATION_INTERVAL)
+    try:
+        with timer.phase("data files"):
+            # Repair any data files left incomplete by a power loss
+            journal.recover_directory(data_directory)
+
+            # Create the data file and write the labels row. Records are
+            # appended through a journal so a power loss can't corrupt the
+            # file.
+            data_file_writer = journal.DataFile(
+                data_file,
+                (
+                    "Record Number,"
+                    "Time,"
+                    "Temperature (F),"
+                    "Pressure (mbars),"
+                    "Relative Humidity (%),"
+                    "Wind Direction (Degrees),"
+                    "Wind Direction (String),"
+                    "Wind Speed (MPH),"
+                    "Wind Gust (MPH),"
+                    "Precipitation (Inches),"
+                    "Image\n"
+                ),
+            )
 
-        # Obtain the wind gust and the average speed over the LOG_INTERVAL
-        wind_gust = round(max(store_speeds), 1)
-        wind_speed = round(statistics.mean(store_speeds), 1)
+            # The records are also stored by day in a binary columnar format
+            columnar_directory = os.path.join(data_directory, "columnar")
+            columnar_writer = ColumnarWriter(columnar_directory)
+
+            # The pressures logged before a restart give the pressure
+            # tendency
+            try:
+                derived_engine.seed(columnar_directory, backend.time())
+            except Exception as e:
+                logging.log("ERROR: Reading the earlier pressures failed: " + str(e.args))
+
+            # Hourly, daily and monthly summaries of the records. These are
+            # also written to the database for long range graphs once it has
+            # started.
+            rollups = RollupEngine(
+                os.path.join(data_directory, "rollups"),
+                None,
+                {"location": settings.database.location},
+            )
 
-        # Obtain the average wind direction over the LOG_INTERVAL
-        wind_direction_avg = round(wind_direction.get_average(store_directions), 1)
-        wind_direction_string = wind_direction.get_direction_as_string(
-            wind_direction_avg
+        rain_event_ongoing = False
+        record_number = 1
+
+        ## Database fields
+        # The name of the "table" (even though it's not) for the database records
+        measurement = settings.database.measurement
+        location = settings.database.location
+
+        #######################################################################
+        # The main program loop
+        #######################################################################
+        # Accumulate wind direction and wind speeds every accumulation interval
+        # seconds, and log the averages every log interval. The ticks are aligned
+        # to the clock so the records land on the same times every day.
+        scheduler = Scheduler(
+            intervals.accumulation_interval, intervals.log_interval, backend
         )
+        started = backend.monotonic()
+        pending_image = None
 
-        # Obtain the current humidity, pressure, and ambient temperature
         logging.log(
-            "Obtaining the humidity, pressure, and temperature readings from the bme280 sensor"
+            f"Startup: sampling started after {round(timer.elapsed(), 3)} seconds "
+            f"({timer.summary()})"
         )
-        try:
-            humidity, pressure, ambient_temp = bme280_sensor.read_all()
-        except:
-            logging.log("ERROR: Attempting to read from the bme280 sensor failed")
-            humidity = -1000 # The influx database fails with math.nan
-            pressure = -1000
-            ambient_temp = -1000
-
-        if shutil.disk_usage(image_directory).free < IMAGE_DISK_USAGE_THRESHOLD:
-            disk_space_ok = False
-            print(f"Image capturing disabled due to limited remaining disk space: {shutil.disk_usage(image_directory).free} bytes remaining")
-            logging.log(f"Image capturing disabled due to limited remaining disk space: {shutil.disk_usage(image_directory).free} bytes remaining")
-
-        # Take a picture of the sky if enabled, if there's enough disk space,
-        # and if there is the desired amount of ambient light
-        if PHOTOS_ENABLED and disk_space_ok and camera.sufficient_brightness(camera_obj, BRIGHTNESS_THRESHOLD):
-            image_name = camera.take_picture(camera_obj, f"{image_directory}")
-        else:
+        logging.log("Accumulating the sensor readings")
+        for tick in scheduler.ticks():
+            if tick.lateness >= intervals.accumulation_interval:
+                logging.log(
+                    f"WARNING: Tick {tick.number} ran {round(tick.lateness, 3)} seconds late"
+                )
+
+            # Switch profiling on or off if the control file was created or
+            # removed
+            if profiler is not None:
+                profiler.poll()
+
+            # Save the rain gauge's bucket tips
+            with RAIN_FLUSH:
+                rain.flush()
+
+            # Sample the temperature, pressure and humidity
+            if tick.number % intervals.bme280_sample_ticks == 0:
+                bme280_sampler.sample()
+
+            # Weight each direction by the wind speed since the previous tick
+            with WIND_DIRECTION_READ:
+                current_angle = wind_direction.get_current_angle()
+            with WIND_SPEED:
+                tick_wind_speed = wind.speed(
+                    tick.deadline - intervals.accumulation_interval, tick.deadline
+                )
+            direction_stats.add(current_angle, tick_wind_speed)
+
+            # Publish the latest readings to the live API's clients
+            live_server = live.get() if live is not None else None
+            if live_server is not None:
+                with LIVE_PUBLISH:
+                    sample_time = backend.now()
+                    humidity = pressure = ambient_temp = None
+                    if bme280_sampler.last is not None:
+                        humidity, pressure, ambient_temp = (
+                            round(value, 1) for value in bme280_sampler.last
+                        )
+                    live_server.publish(
+                        "sample",
+                        {
+                            "time": sample_time.isoformat(),
+                            "tick": tick.number,
+                            "wind_speed": round(tick_wind_speed, 1),
+                            "wind_direction": round(current_angle, 1),
+                            "wind_direction_string": wind_direction.get_direction_as_string(
+                                current_angle
+                            ),
+                            "humidity": humidity,
+                            "pressure": pressure,
+                            "temperature": ambient_temp,
+                            "precipitation": round(rain.daily_total(sample_time), 4),
+                            "rain_rate": round(rain.rate(sample_time.timestamp()), 3),
+                        },
+                    )
+
+            # Take a picture of the sky in the background during the last tick
+            # before the record is logged if enabled, if there's enough disk
+            # space, and if there is the desired amount of ambient light. The
+            # image store removes old images to make room for new ones, so there
+            # is only no room if the disk is filled by other files.
+            if camera_settings.enabled and (tick.number + 1) % scheduler.ticks_per_log == 0:
+                camera_worker = camera_subsystem.get()
+                if camera_worker is None:
+                    logging.log("Image skipped since the camera hasn't started")
+                elif camera_worker.store.has_room():
+                    pending_image = camera_worker.request(camera_settings.brightness_threshold)
+                else:
+                    print(f"Image skipped due to limited remaining disk space: {camera_worker.store.free_space()} bytes remaining")
+                    logging.log(f"Image skipped due to limited remaining disk space: {camera_worker.store.free_space()} bytes remaining")
+
+            if not tick.is_log:
+                continue
+
+            # The station may have been started partway through a log interval
+            interval_start = max(tick.deadline - intervals.log_interval, started)
+            if tick.deadline - interval_start < intervals.accumulation_interval:
+                # Start the first full interval without the readings of the
+                # partial one
+                direction_stats.reset()
+                bme280_sampler.reset()
+                continue
+
+            # Obtain the wind gust, lull and the average speed over the
+            # log interval from the anemometer pulses. Since the interval has
+            # already ended, this is exact even if the tick fired late.
+            logging.log("Calculating the wind speed")
+            with WIND_STATISTICS:
+                wind_speed = round(wind.speed(interval_start, tick.deadline), 1)
+                wind_gust, wind_lull = wind.gust_and_lull(interval_start, tick.deadline)
+                wind_gust = round(wind_gust, 1)
+                wind_lull = round(wind_lull, 1)
+
+                # Obtain the average wind direction over the log interval
+                wind_direction_avg = round(direction_stats.mean(), 1)
+                wind_direction_std_dev = round(direction_stats.std_dev(), 1)
+                vector_direction, vector_speed = direction_stats.vector_mean()
+                wind_vector_direction = round(vector_direction, 1)
+                wind_vector_speed = round(vector_speed, 1)
+                wind_direction_string = wind_direction.get_direction_as_string(
+                    wind_direction_avg
+                )
+
+            # Obtain the average humidity, pressure, and ambient temperature over
+            # the log interval
+            logging.log(
+                f"Obtaining the humidity, pressure, and temperature from {bme280_sampler.count} "
+                f"bme280 samples ({bme280_sampler.failures} failed)"
+            )
+            if bme280_sampler.count:
+                humidity = round(bme280_sampler.humidity.mean, 1)
+                pressure = round(bme280_sampler.pressure.mean, 1)
+                ambient_temp = round(bme280_sampler.temperature.mean, 1)
+            else:
+                logging.log("ERROR: Attempting to read from the bme280 sensor failed")
+                humidity = -1000 # The influx database fails with math.nan
+                pressure = -1000
+                ambient_temp = -1000
+
+            # Collect the picture requested on the previous tick
             image_name = "nan" # The influx database fails with math.nan
+            if pending_image is not None:
+                try:
+                    with CAMERA_WAIT:
+                        image_name = pending_image.result(timeout=camera_settings.timeout)
+                except Exception as e:
+                    logging.log(f"ERROR: The picture wasn't taken in time: {str(e.args)}")
+                pending_image = None
+
+            # This will pull from the Real Time Clock so it can be accurate
+            # when there isn't an internet connection. See the readme for
+            # instructions on how to configure the Real Time Clock correctly.
+            current_time = backend.now()
+
+            # Obtain the rainfall since midnight, the rain rate over the last
+            # hour, and the highest rain rate over the log interval
+            end_time = current_time.timestamp()
+            start_time = end_time - (tick.deadline - interval_start)
+            with RAIN_STATISTICS:
+                precipitation = round(rain.daily_total(current_time), 4)
+                rain_rate = round(rain.rate(end_time), 3)
+                max_rain_rate = round(rain.max_rate(start_time, end_time), 3)
+                rain_event = rain.last_event(end_time)
+            if rain_event is not None and rain_event.ongoing:
+                rain_event_total = round(rain_event.total, 4)
+                rain_event_duration = round((rain_event.end - rain_event.start) / 60, 1)
+                if not rain_event_ongoing:
+                    logging.log(f"A rain event started at {datetime.datetime.fromtimestamp(rain_event.start)}")
+            else:
+                rain_event_total = 0.0
+                rain_event_duration = 0.0
+                if rain_event_ongoing and rain_event is not None:
+                    logging.log(
+                        f"The rain event from {datetime.datetime.fromtimestamp(rain_event.start)} "
+                        f"to {datetime.datetime.fromtimestamp(rain_event.end)} "
+                        f"dropped {round(rain_event.total, 4)} inches"
+                    )
+            rain_event_ongoing = rain_event is not None and rain_event.ongoing
+
+            # Calculate the dew point, feels like temperature, pressure
+            # tendency and so on
+            with DERIVED:
+                derived_values = derived_engine.add(
+                    end_time, ambient_temp, humidity, pressure, wind_speed
+                )
+            if rain.bounces:
+                logging.debug(f"Ignored {rain.bounces} rain gauge switch bounces")
+
+            logging.log("Printing the values obtained and calculated")
+
+            print(f"Record Number:            {record_number}")
+            print(f"Time:                     {current_time}")
+
+            # Weather
+            print(f"Temperature (F):          {ambient_temp}")
+            print(f"Pressure (mbar):          {pressure}")
+            print(f"Relative Humidity (%):    {humidity}")
+            print(f"Wind Direction (Degrees): {wind_direction_avg}")
+            print(f"Wind Direction (String):  {wind_direction_string}")
+            print(f"Wind Dir. Std. Dev.:      {wind_direction_std_dev}")
+            print(f"Avg. Wind Speed (MPH):    {wind_speed}")
+            print(f"Wind Gust (MPH):          {wind_gust}")
+            print(f"Wind Lull (MPH):          {wind_lull}")
+            print(f"Precipitation (Inches):   {precipitation}")
+            print(f"Rain Rate (in/hr):        {rain_rate}")
+            print(f"Dew Point:                {derived_values.get('dew_point')}")
+            print(f"Feels Like:               {derived_values.get('feels_like')}")
+            print(f"Pressure Tendency (mbar): {derived_values.get('pressure_tendency')}")
+            print(f"Image:                    {image_name}")
 
-        # This will pull from the Real Time Clock so it can be accurate
-        # when there isn't an internet connection. See the readme for
-        # instructions on how to configure the Real Time Clock correctly.
-        current_time = datetime.datetime.now()
-
-        logging.log("Printing the values obtained and calculated")
-
-        print(f"Record Number:            {record_number}")
-        print(f"Time:                     {current_time}")
-
-        # Weather
-        print(f"Temperature (F):          {ambient_temp}")
-        print(f"Pressure (mbar):          {pressure}")
-        print(f"Relative Humidity (%):    {humidity}")
-        print(f"Wind Direction (Degrees): {wind_direction_avg}")
-        print(f"Wind Direction (String):  {wind_direction_string}")
-        print(f"Avg. Wind Speed (MPH):    {wind_speed}")
-        print(f"Wind Gust (MPH):          {wind_gust}")
-        print(f"Precipitation (Inches):   {precipitation}")
-        print(f"Image:                    {image_name}")
-
-        print(
-            "##########################################################################"
-        )
-
-        logging.log(f"Creating a temporary backup file of the data at {backup_file}")
-        backup_data = subprocess.Popen(
-            f"cp {data_file} {backup_file}",
-            shell=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-        )
-        stdout, stderr = backup_data.communicate()
-
-        # Log the data by appending the values to the data .csv file
-        logging.log(f"Writing the data to {data_file}")
-        with open(data_file, "a") as file:
-            file.write(
-                f"{record_number},{current_time},{ambient_temp},{pressure},"
-                f"{humidity},{wind_direction_avg},{wind_direction_string},"
-                f"{wind_speed},{wind_gust},{precipitation},{image_name}\n"
+            print(
+                "##########################################################################"
             )
 
-        # Write the data to the database as well for Grafana visualization
-        logging.log(f"Writing to the database")
-        data = [
-        {
-          "measurement": measurement,
-            "tags": {
-                "location": location,
-            },
-            # Use UTC time so it is handled correctly in Grafana
-            # Note that this time will be slightly different than
-            # the time logged in the CSV. Ideally, I would convert the
-            # current_time to utc time.
-            "time": datetime.datetime.utcnow(),
-            "fields": {
-                "Temperature (F)": ambient_temp,
-                "Pressure (mbar)": pressure,
-                "Relative Humidity (%)": humidity,
-                "Wind Direction (Degrees)": wind_direction_avg,
-                "Wind Direction (String)": wind_direction_string,
-                "Avg. Wind Speed (MPH)": wind_speed,
-                "Wind Gust (MPH)": wind_gust,
-                "Precipitation (Inches)": precipitation,
-                "Image": image_name
+            # Log the data by appending the values to the data .csv file
+            logging.log(f"Writing the data to {data_file}")
+            with CSV_APPEND:
+                data_file_writer.append(
+                    f"{record_number},{current_time},{ambient_temp},{pressure},"
+                    f"{humidity},{wind_direction_avg},{wind_direction_string},"
+                    f"{wind_speed},{wind_gust},{precipitation},{image_name}\n"
+                )
+            RECORDS.inc()
+
+            record = {
+                "record_number": record_number,
+                "time": current_time,
+                "temperature": ambient_temp,
+                "pressure": pressure,
+                "humidity": humidity,
+                "wind_direction": wind_direction_avg,
+                "wind_direction_string": wind_direction_string,
+                "wind_speed": wind_speed,
+                "wind_gust": wind_gust,
+                "precipitation": precipitation,
+                "image": image_name,
             }
-        }]
-        try:
-            client.write_points(data)
-        except Exception as e:
-            logging.log("ERROR: Writing to the database failed!: " + str(e.args))
-
-        logging.log(f"Removing the temporary backup file {backup_file}")
-        remove_temp_backup_file = subprocess.Popen(
-            f"rm {backup_file}",
-            shell=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-        )
-        stdout, stderr = remove_temp_backup_file.communicate()
-
-        if not external_storage_connected:
-            print(
-                "WARNING: The data is not being backed up. Ensure an external storage device is connected and restart the system."
-            )
-            logging.log(
-                "WARNING: The data is not being backed up. Ensure an external storage device is connected and restart the system."
-            )
 
-        # Empty the log file every month so it doesn't grow too big
-        if int(current_time.strftime("%-m")) != int(previous_month.strftime("%-m")):
-            print("Emptying the log file to conserve disk space")
-            logging.log("Emptying the log file to conserve disk space")
-            clear_log = subprocess.Popen(
-                f"rm {log_file}",
-                shell=True,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-            )
-            stdout, stderr = clear_log.communicate()
-            previous_month = current_time
-
-        # Clear the recorded values so they can be updated over the next LOG_INTERVAL
-        store_speeds.clear()
-        store_directions.clear()
-
-        # Clear the rainfall each day at midnight
-        # When it's a new weekday, clear the rainfall total
-        if int(current_time.strftime("%w")) != int(previous_day.strftime("%w")):
-            print("Resetting the accumulated rainfall")
-            reset_rainfall()
-            previous_day = current_time
-
-        record_number = record_number + 1
-
-except Exception as e:
-    camera_obj.close()
-    logging.log("An unhandled exception occurred causing a crash: " + str(e.args))
-    traceback.print_exc()
+            # Also store the record in the compact binary format for fast queries
+            try:
+                with COLUMNAR_APPEND:
+                    columnar_writer.append(record)
+            except Exception as e:
+                logging.log("ERROR: Writing to the columnar store failed: " + str(e.args))
+
+            # Write the data to the database as well for Grafana visualization
+            logging.log(f"Writing to the database")
+            data = [
+            {
+              "measurement": measurement,
+                "tags": {
+                    "location": location,
+                },
+                # Use UTC time so it is handled correctly in Grafana
+                # Note that this time will be slightly different than
+                # the time logged in the CSV. Ideally, I would convert the
+                # current_time to utc time.
+                "time": backend.utcnow(),
+                "fields": {
+                    "Temperature (F)": ambient_temp,
+                    "Pressure (mbar)": pressure,
+                    "Relative Humidity (%)": humidity,
+                    "Wind Direction (Degrees)": wind_direction_avg,
+                    "Wind Direction (String)": wind_direction_string,
+                    "Wind Direction Std. Dev. (Degrees)": wind_direction_std_dev,
+                    "Wind Vector Direction (Degrees)": wind_vector_direction,
+                    "Wind Vector Speed (MPH)": wind_vector_speed,
+                    "Avg. Wind Speed (MPH)": wind_speed,
+                    "Wind Gust (MPH)": wind_gust,
+                    "Wind Lull (MPH)": wind_lull,
+                    "Precipitation (Inches)": precipitation,
+                    "Rain Rate (in/hr)": rain_rate,
+                    "Max Rain Rate (in/hr)": max_rain_rate,
+                    "Rain Event Total (Inches)": rain_event_total,
+                    "Rain Event Duration (Minutes)": rain_event_duration,
+                    "Image": image_name
+                }
+            }]
+            # The spread of the readings over the interval
+            if bme280_sampler.count:
+                for label, unit, stats in [
+                    ("Temperature", "F", bme280_sampler.temperature),
+                    ("Pressure", "mbar", bme280_sampler.pressure),
+                    ("Relative Humidity", "%", bme280_sampler.humidity),
+                ]:
+                    data[0]["fields"][f"{label} Min ({unit})"] = round(stats.min, 1)
+                    data[0]["fields"][f"{label} Max ({unit})"] = round(stats.max, 1)
+                    data[0]["fields"][f"{label} Std. Dev. ({unit})"] = round(
+                        stats.std_dev(), 2
+                    )
+            # The derived quantities that could be calculated
+            for name, value in derived_values.items():
+                data[0]["fields"][derived_labels[name]] = value
+            writer = database.get()
+            if writer is None:
+                logging.log("ERROR: The record wasn't written to the database since it hasn't started")
+            else:
+                try:
+                    writer.write_points(data)
+                except Exception as e:
+                    logging.log("ERROR: Queueing the database write failed!: " + str(e.args))
+            # Send the record to the ingest server
+            if publisher is not None:
+                ingest_writer = publisher.get()
+                if ingest_writer is None:
+                    logging.log("ERROR: The record wasn't published since the ingest publisher hasn't started")
+                else:
+                    try:
+                        ingest_writer.write_points(data)
+                    except Exception as e:
+                        logging.log("ERROR: Queueing the record for the ingest server failed: " + str(e.args))
+            # Publish the record to the live API's clients
+            if live_server is not None:
+                live_server.publish(
+                    "record",
+                    dict(
+                        data[0]["fields"],
+                        record_number=record_number,
+                        time=current_time.isoformat(),
+                    ),
+                )
+            # Update the hourly, daily and monthly summaries
+            rollups.writer = writer
+            try:
+                with ROLLUPS:
+                    rollups.add(record)
+            except Exception as e:
+                logging.log("ERROR: Updating the rollups failed: " + str(e.args))
+
+            if writer is not None:
+                logging.log(
+                    f"Database queue depth: {writer.queue_depth()} points, "
+                    f"last flush took {round(writer.last_flush_latency * 1000, 1)} ms, "
+                    f"{writer.write_failures} failed writes, "
+                    f"{writer.points_rejected} rejected points"
+                )
+
+            if not external_storage_connected:
+                print(BACKUP_WARNING)
+                logging.log(BACKUP_WARNING)
+
+            logging.log(f"Scheduler: {scheduler.summary()}")
+            scheduler.reset_stats()
+            logging.log(f"Metrics: {metrics.summary()}")
+
+            # Clear the recorded values so they can be updated over the next log interval
+            direction_stats.reset()
+            bme280_sampler.reset()
+
+            record_number = record_number + 1
+
+            logging.log("Accumulating the sensor readings")
+
+    except sensor_backend.ReplayFinished:
+        shut_down("the replay finished")
+        print("The end of the replayed recording has been reached")
+        logging.log("The end of the replayed recording has been reached")
+    except Exception as e:
+        # Logged first in case shutting down fails too
+        logging.log("An unhandled exception occurred causing a crash: " + str(e.args))
+        traceback.print_exc()
+        shut_down("the station crashed")
+
+
+if __name__ == "__main__":
+    main()
@@ -22,17 +22,20 @@
 # 3v3 to pin 16 on (Vdd) the MCP3208 chip
 # 4.7kohm resistor from ground to pin 1 on the MCP3208 chip for voltage div
 
-from gpiozero import MCP3208
-
+from array import array
+from circular_stats import DirectionAccumulator
 import logger as logging
-import math
+import sensor_backend
 import time
 
 # How often the average wind direction should be logged
 LOG_INTERVAL = 5  # 900 # 15 Minutes
 
-# Analog to Digital Converter
-adc = MCP3208(channel=0)
+# The MCP3208 channel the wind direction sensor is connected to
+ADC_CHANNEL = 0
+
+# The reference voltage of the MCP3208
+VREF = 3.3
 
 # These voltage values mapped to headings came from the Raspberry Pi
 # weather station tutorial (see the readme). However, the voltages came
@@ -64,73 +67,6 @@ volts = {
     0.6: 337.5,
 }
 
-# Calculate the average angle from a list of angles
-def get_average(angles):
-    logging.log("Calculating the average of the list of angles")
-
-    sin_sum = 0.0
-    cos_sum = 0.0
-
-    for angle in angles:
-        r = math.radians(angle)
-        sin_sum += math.sin(r)
-        cos_sum += math.cos(r)
-
-    flen = float(len(angles))
-
-    # Don't allow division by 0
-    if flen == 0:
-        return 0.0
-
-    s = sin_sum / flen
-    c = cos_sum / flen
-    arc = math.degrees(math.atan(s / c))
-    average = 0.0
-
-    if s > 0 and c > 0:
-        average = arc
-    elif c < 0:
-        average = arc + 180
-    elif s < 0 and c > 0:
-        average = arc + 360
-
-    return 0.0 if average == 360 else average
-
-
-# Returns the average direction read over a period of time
-def get_value(time_period=LOG_INTERVAL):
-    global volts
-
-    logging.log("Obtaining the average wind direction over a period of time")
-
-    data = []
-    expected_voltages = volts.keys()
-    start_time = time.time()
-
-    while time.time() - start_time <= time_period:
-
-        voltage = round(adc.value * 3.3, 3)
-
-        closest_voltage = min(expected_voltages, key=lambda x: abs(x - voltage))
-        data.append(volts[closest_voltage])
-
-    return get_average(data)
-
-
-# Returns the current wind direction
-def get_current_angle():
-    global volts
-
-    logging.log("Obtaining the current wind direction angle")
-
-    expected_voltages = volts.keys()
-    voltage = round(adc.value * 3.3, 3)
-    closest_voltage = min(expected_voltages, key=lambda x: abs(x - voltage))
-
-    # Return the angle mapped to the voltage read
-    return volts[closest_voltage]
-
-
 # A map that maps headings to wind direction strings
 directions = {
     0.0: "N",
@@ -152,23 +88,131 @@ directions = {
 }
 
 
-def get_direction(time_period=LOG_INTERVAL):
-    global directions
+# The 16 headings in order from north, clockwise
+headings = sorted(directions.keys())
+
+
+class DirectionDecoder:
+    """
+    Maps the raw ADC codes read from the wind direction sensor to headings.
+
+    A table holding the index of the heading for every possible ADC code is
+    built once from a calibration that maps voltages to headings, so decoding
+    a reading is a single lookup.
+    """
+
+    def __init__(self, calibration, vref=VREF, max_code=sensor_backend.ADC_MAX_CODE):
+        # The codes rise with the voltage, so the closest expected voltage
+        # only has to be chosen from the two on either side of each code.
+        # Ties go to the voltage listed first in the calibration.
+        order = {voltage: i for i, voltage in enumerate(calibration)}
+        expected_voltages = sorted(calibration)
+        indexes = [headings.index(calibration[v]) for v in expected_voltages]
+        last = len(expected_voltages) - 1
+        table = bytearray(max_code + 1)
+        above = 0
+        for code in range(max_code + 1):
+            voltage = round(code / max_code * vref, 3)
+            while above <= last and expected_voltages[above] < voltage:
+                above += 1
+            if above == 0:
+                closest = 0
+            elif above > last:
+                closest = last
+            else:
+                below_distance = abs(expected_voltages[above - 1] - voltage)
+                above_distance = abs(expected_voltages[above] - voltage)
+                closest = above
+                if below_distance < above_distance or (
+                    below_distance == above_distance
+                    and order[expected_voltages[above - 1]]
+                    < order[expected_voltages[above]]
+                ):
+                    closest = above - 1
+            table[code] = indexes[closest]
+        self.table = bytes(table)
+
+    def index(self, code):
+        """
+        Returns the index into headings of the heading for the ADC code.
+        """
+        return self.table[code]
+
+    def angle(self, code):
+        return headings[self.table[code]]
+
+    def direction(self, code):
+        return directions[headings[self.table[code]]]
+
+    def decode_indexes(self, codes):
+        """
+        Returns an array of heading indexes for a sequence of ADC codes.
+        """
+        return array("B", map(self.table.__getitem__, codes))
+
+    def decode_angles(self, codes):
+        """
+        Returns a list of headings in degrees for a sequence of ADC codes.
+        """
+        return [headings[index] for index in self.decode_indexes(codes)]
+
+
+# The decoder is built the first time a reading is decoded so importing this
+# module doesn't slow down the station's startup
+decoder = None
+
+
+def get_decoder():
+    global decoder
+
+    if decoder is None:
+        decoder = DirectionDecoder(volts)
+    return decoder
+
+
+# Replaces the voltage to heading calibration used to decode the readings
+def set_calibration(calibration):
+    global decoder
+    decoder = DirectionDecoder(calibration)
+
+
+# Returns the raw code read by the Analog to Digital Converter
+def read_code():
+    return sensor_backend.get_backend().read_adc(ADC_CHANNEL)
 
-    value = get_value(time_period)
 
-    expected_directions = directions.keys()
-    closest_direction = min(expected_directions, key=lambda x: abs(x - value))
+# Calculate the average angle from a list of angles
+def get_average(angles):
+    accumulator = DirectionAccumulator()
+    for angle in angles:
+        accumulator.add(angle)
+    return accumulator.mean()
 
-    return directions[closest_direction]
 
+# Returns the average direction read over a period of time
+def get_value(time_period=LOG_INTERVAL):
+    logging.log("Obtaining the average wind direction over a period of time")
 
-def get_direction_as_string(angle):
-    global directions
+    codes = array("H")
+    start_time = time.time()
+
+    while time.time() - start_time <= time_period:
+        codes.append(read_code())
 
-    logging.log("Converting an angle direction to a string")
+    return get_average(get_decoder().decode_angles(codes))
 
-    expected_directions = directions.keys()
-    closest_direction = min(expected_directions, key=lambda x: abs(x - angle))
 
-    return directions[closest_direction]
+# Returns the current wind direction
+def get_current_angle():
+    # Return the angle mapped to the voltage read
+    return get_decoder().angle(read_code())
+
+
+def get_direction(time_period=LOG_INTERVAL):
+    return get_direction_as_string(get_value(time_period))
+
+
+# Returns the name of the heading closest to the angle. The headings don't wrap
+# around, so angles past NNW (such as 355) are still NNW as they always were.
+def get_direction_as_string(angle):
+    return directions[min(headings, key=lambda heading: abs(heading - angle))]